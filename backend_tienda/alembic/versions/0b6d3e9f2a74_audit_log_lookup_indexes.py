@@ -0,0 +1,44 @@
+"""audit_log_lookup_indexes
+
+Revision ID: 0b6d3e9f2a74
+Revises: f5a0c6d2e813
+Create Date: 2025-11-28 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0b6d3e9f2a74'
+down_revision: Union[str, None] = 'f5a0c6d2e813'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema - Add covering and BRIN indexes on audit_log."""
+    # El historial de un registro filtra por tabla + registro y ordena por fecha DESC;
+    # accion e id_audit van en INCLUDE para poder filtrar por acción desde el índice.
+    op.create_index(
+        'ix_audit_lookup',
+        'audit_log',
+        ['tabla_nombre', 'registro_id', sa.text('fecha_accion DESC')],
+        postgresql_include=['accion', 'id_audit'],
+    )
+
+    # audit_log es append-only: fecha_accion crece con el orden físico de las filas
+    op.create_index(
+        'ix_audit_fecha_brin',
+        'audit_log',
+        ['fecha_accion'],
+        postgresql_using='brin',
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema - Drop audit_log lookup indexes."""
+    op.drop_index('ix_audit_fecha_brin', table_name='audit_log')
+    op.drop_index('ix_audit_lookup', table_name='audit_log')
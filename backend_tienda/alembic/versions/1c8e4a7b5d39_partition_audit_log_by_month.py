@@ -0,0 +1,155 @@
+"""partition_audit_log_by_month
+
+Revision ID: 1c8e4a7b5d39
+Revises: 0b6d3e9f2a74
+Create Date: 2025-12-01 08:45:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1c8e4a7b5d39'
+down_revision: Union[str, None] = '0b6d3e9f2a74'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Índices de audit_log (se recrean sobre la tabla particionada)
+AUDIT_INDEXES = """
+    CREATE INDEX ix_audit_log_id_audit ON audit_log (id_audit);
+    CREATE INDEX ix_audit_log_tabla_nombre ON audit_log (tabla_nombre);
+    CREATE INDEX ix_audit_log_registro_id ON audit_log (registro_id);
+    CREATE INDEX ix_audit_log_accion ON audit_log (accion);
+    CREATE INDEX ix_audit_log_usuario_id ON audit_log (usuario_id);
+    CREATE INDEX ix_audit_log_fecha_accion ON audit_log (fecha_accion);
+    CREATE INDEX ix_audit_lookup ON audit_log (tabla_nombre, registro_id, fecha_accion DESC)
+        INCLUDE (accion, id_audit);
+    CREATE INDEX ix_audit_fecha_brin ON audit_log USING BRIN (fecha_accion);
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema - Partition audit_log by month on fecha_accion."""
+    # Nueva tabla particionada con las mismas columnas; la PK debe incluir la clave de partición
+    op.execute("""
+        CREATE TABLE audit_log_new (
+            LIKE audit_log INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+        ) PARTITION BY RANGE (fecha_accion);
+
+        ALTER TABLE audit_log_new ADD PRIMARY KEY (id_audit, fecha_accion);
+        ALTER TABLE audit_log_new
+            ADD CONSTRAINT audit_log_usuario_id_fkey FOREIGN KEY (usuario_id)
+            REFERENCES usuarios (id_usuario) ON DELETE SET NULL;
+
+        -- Red de seguridad: filas fuera de las particiones mensuales existentes
+        CREATE TABLE audit_log_default PARTITION OF audit_log_new DEFAULT;
+    """)
+
+    # Crea (si no existe) la partición mensual que contiene `mes`.
+    # Se debe ejecutar por adelantado para el mes siguiente, p. ej. con pg_cron:
+    #   SELECT cron.schedule('audit_log_particion', '0 3 25 * *',
+    #       $$SELECT crear_particion_audit_log((date_trunc('month', now()) + interval '1 month')::date)$$);
+    op.execute("""
+        CREATE OR REPLACE FUNCTION crear_particion_audit_log(mes DATE)
+        RETURNS TEXT AS $$
+        DECLARE
+            desde DATE := date_trunc('month', mes)::DATE;
+            hasta DATE := (date_trunc('month', mes) + INTERVAL '1 month')::DATE;
+            nombre TEXT := format('audit_log_y%sm%s', to_char(desde, 'YYYY'), to_char(desde, 'MM'));
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF audit_log FOR VALUES FROM (%L) TO (%L)',
+                nombre, desde, hasta
+            );
+            RETURN nombre;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Particiones desde el registro más antiguo hasta dos meses por delante
+    op.execute("""
+        DO $$
+        DECLARE
+            mes DATE;
+            desde DATE;
+        BEGIN
+            SELECT date_trunc('month', COALESCE(MIN(fecha_accion), now()))::DATE INTO mes FROM audit_log;
+            WHILE mes <= (date_trunc('month', now()) + INTERVAL '2 months')::DATE LOOP
+                desde := mes;
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF audit_log_new FOR VALUES FROM (%L) TO (%L)',
+                    format('audit_log_y%sm%s', to_char(desde, 'YYYY'), to_char(desde, 'MM')),
+                    desde, (desde + INTERVAL '1 month')::DATE
+                );
+                mes := (mes + INTERVAL '1 month')::DATE;
+            END LOOP;
+        END;
+        $$;
+    """)
+
+    # Copiar datos, pasar la secuencia de id_audit a la nueva tabla e intercambiar nombres.
+    # El lock bloquea las escrituras de los triggers (no las lecturas) hasta el DROP:
+    # sin él, las filas confirmadas después de empezar el INSERT ... SELECT se perderían.
+    op.execute("""
+        LOCK TABLE audit_log IN SHARE ROW EXCLUSIVE MODE;
+
+        INSERT INTO audit_log_new SELECT * FROM audit_log;
+
+        DO $$
+        DECLARE
+            seq TEXT := pg_get_serial_sequence('audit_log', 'id_audit');
+        BEGIN
+            IF seq IS NOT NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s OWNED BY audit_log_new.id_audit', seq);
+            END IF;
+        END;
+        $$;
+
+        DROP TABLE audit_log;
+        ALTER TABLE audit_log_new RENAME TO audit_log;
+        ALTER TABLE audit_log RENAME CONSTRAINT audit_log_new_pkey TO audit_log_pkey;
+    """)
+
+    op.execute(AUDIT_INDEXES)
+
+
+def downgrade() -> None:
+    """Downgrade schema - Convert audit_log back to a regular table."""
+    op.execute("""
+        CREATE TABLE audit_log_old (
+            LIKE audit_log INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+        );
+
+        ALTER TABLE audit_log_old ADD PRIMARY KEY (id_audit);
+        ALTER TABLE audit_log_old
+            ADD CONSTRAINT audit_log_usuario_id_fkey FOREIGN KEY (usuario_id)
+            REFERENCES usuarios (id_usuario) ON DELETE SET NULL;
+
+        -- Bloquea las escrituras en audit_log (y sus particiones) hasta el DROP
+        LOCK TABLE audit_log IN SHARE ROW EXCLUSIVE MODE;
+
+        INSERT INTO audit_log_old SELECT * FROM audit_log;
+
+        DO $$
+        DECLARE
+            seq TEXT := pg_get_serial_sequence('audit_log', 'id_audit');
+        BEGIN
+            IF seq IS NOT NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s OWNED BY audit_log_old.id_audit', seq);
+            END IF;
+        END;
+        $$;
+
+        -- Elimina también todas las particiones
+        DROP TABLE audit_log;
+        ALTER TABLE audit_log_old RENAME TO audit_log;
+        ALTER TABLE audit_log RENAME CONSTRAINT audit_log_old_pkey TO audit_log_pkey;
+
+        DROP FUNCTION IF EXISTS crear_particion_audit_log(DATE);
+    """)
+
+    op.execute(AUDIT_INDEXES)
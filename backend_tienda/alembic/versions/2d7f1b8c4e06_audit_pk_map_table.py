@@ -0,0 +1,147 @@
+"""audit_pk_map_table
+
+Revision ID: 2d7f1b8c4e06
+Revises: 1c8e4a7b5d39
+Create Date: 2025-12-02 10:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2d7f1b8c4e06'
+down_revision: Union[str, None] = '1c8e4a7b5d39'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+PK_LOOKUP_TABLE = """        -- Columna de clave primaria de la tabla auditada (una consulta por sentencia)
+        pk_col := audit_pk_column(TG_TABLE_NAME);
+"""
+
+PK_LOOKUP_CTE = """        -- Columna de clave primaria de la tabla auditada
+        WITH pk_map (tabla, columna) AS (
+            VALUES ('usuarios', 'id_usuario'),
+                   ('clientes', 'id_cliente'),
+                   ('categorias', 'id_categoria'),
+                   ('productos', 'id_producto'),
+                   ('pedidos', 'id_pedido'),
+                   ('detalle_pedidos', 'id_detalle'),
+                   ('carrito', 'id_carrito'),
+                   ('detalle_carrito', 'id_detalle_carrito')
+        )
+        SELECT columna INTO pk_col FROM pk_map WHERE tabla = TG_TABLE_NAME;
+"""
+
+AUDIT_FUNCTION_TEMPLATE = """
+    CREATE OR REPLACE FUNCTION audit_trigger_function()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        pk_col TEXT;
+        ctx_user_id INTEGER;
+        ctx_user_email TEXT;
+        ctx_ip TEXT;
+        ctx_endpoint TEXT;
+    BEGIN
+{pk_lookup}
+        IF pk_col IS NULL THEN
+            RETURN NULL;
+        END IF;
+
+        -- Contexto publicado por la aplicación con set_config() (una vez por sentencia)
+        ctx_user_id := NULLIF(current_setting('app.user_id', true), '')::INTEGER;
+        ctx_user_email := NULLIF(current_setting('app.user_email', true), '');
+        ctx_ip := NULLIF(current_setting('app.ip', true), '');
+        ctx_endpoint := NULLIF(current_setting('app.endpoint', true), '');
+
+        IF TG_OP = 'INSERT' THEN
+            EXECUTE format($sql$
+                INSERT INTO audit_log (
+                    tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                    datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                )
+                SELECT %L, n.%I, 'INSERT', $1, $2,
+                       NULL, to_jsonb(n), NULL, $3, $4, CURRENT_TIMESTAMP
+                FROM nt n
+            $sql$, TG_TABLE_NAME, pk_col)
+            USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;
+        ELSIF TG_OP = 'UPDATE' THEN
+            -- Las filas se emparejan por clave primaria. Si un UPDATE cambia la PK,
+            -- el FULL JOIN conserva ambas versiones como dos registros UPDATE.
+            EXECUTE format($sql$
+                INSERT INTO audit_log (
+                    tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                    datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                )
+                SELECT %L, COALESCE(n.%I, o.%I), 'UPDATE', $1, $2,
+                       CASE WHEN n IS NULL THEN to_jsonb(o) END,
+                       CASE WHEN o IS NULL THEN to_jsonb(n) END,
+                       CASE WHEN o IS NULL OR n IS NULL THEN NULL
+                            ELSE COALESCE((
+                                SELECT jsonb_object_agg(k, to_jsonb(n)->k)
+                                FROM unnest(akeys(hstore(n) - hstore(o))) k
+                            ), '{}'::jsonb) END,
+                       $3, $4, CURRENT_TIMESTAMP
+                FROM nt n
+                FULL JOIN ot o ON o.%I = n.%I
+            $sql$, TG_TABLE_NAME, pk_col, pk_col, pk_col, pk_col)
+            USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;
+        ELSIF TG_OP = 'DELETE' THEN
+            EXECUTE format($sql$
+                INSERT INTO audit_log (
+                    tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                    datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                )
+                SELECT %L, o.%I, 'DELETE', $1, $2,
+                       to_jsonb(o), NULL, NULL, $3, $4, CURRENT_TIMESTAMP
+                FROM ot o
+            $sql$, TG_TABLE_NAME, pk_col)
+            USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+
+def upgrade() -> None:
+    """Upgrade schema - Resolve the audited table's PK column from audit_pk_map."""
+    # Tabla de configuración: tabla auditada -> columna de clave primaria
+    op.execute("""
+        CREATE TABLE audit_pk_map (
+            tabla TEXT PRIMARY KEY,
+            pk_col TEXT NOT NULL
+        );
+
+        INSERT INTO audit_pk_map (tabla, pk_col) VALUES
+            ('usuarios', 'id_usuario'),
+            ('clientes', 'id_cliente'),
+            ('categorias', 'id_categoria'),
+            ('productos', 'id_producto'),
+            ('pedidos', 'id_pedido'),
+            ('detalle_pedidos', 'id_detalle'),
+            ('carrito', 'id_carrito'),
+            ('detalle_carrito', 'id_detalle_carrito');
+    """)
+
+    # Helper STABLE: una sola búsqueda por índice en la PK de audit_pk_map
+    op.execute("""
+        CREATE OR REPLACE FUNCTION audit_pk_column(p_tabla TEXT)
+        RETURNS TEXT AS $$
+            SELECT pk_col FROM audit_pk_map WHERE tabla = p_tabla;
+        $$ LANGUAGE sql STABLE;
+    """)
+
+    op.execute(AUDIT_FUNCTION_TEMPLATE.replace("{pk_lookup}", PK_LOOKUP_TABLE))
+
+
+def downgrade() -> None:
+    """Downgrade schema - Restore the inline PK lookup CTE."""
+    op.execute(AUDIT_FUNCTION_TEMPLATE.replace("{pk_lookup}", PK_LOOKUP_CTE))
+    op.execute("DROP FUNCTION IF EXISTS audit_pk_column(TEXT);")
+    op.execute("DROP TABLE IF EXISTS audit_pk_map;")
@@ -0,0 +1,155 @@
+"""audit_excluded_columns
+
+Revision ID: 3e9a5c1d7b82
+Revises: 2d7f1b8c4e06
+Create Date: 2025-12-03 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e9a5c1d7b82'
+down_revision: Union[str, None] = '2d7f1b8c4e06'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Expresiones del payload con y sin columnas excluidas ($5 = excluded_cols)
+PAYLOAD_EXCLUDED = {
+    "{excluded_lookup}": """
+        -- Columnas que no se copian al audit_log (sensibles o voluminosas)
+        excluded_cols := audit_excluded_cols(TG_TABLE_NAME);
+""",
+    "{json_n}": "(to_jsonb(n) - $5)",
+    "{json_o}": "(to_jsonb(o) - $5)",
+    "{diff}": "COALESCE((SELECT jsonb_object_agg(k, to_jsonb(n)->k) "
+              "FROM unnest(akeys((hstore(n) - hstore(o)) - $5)) k), '{}'::jsonb)",
+    "{using}": "USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint, excluded_cols;",
+}
+
+PAYLOAD_FULL = {
+    "{excluded_lookup}": "",
+    "{json_n}": "to_jsonb(n)",
+    "{json_o}": "to_jsonb(o)",
+    "{diff}": "COALESCE((SELECT jsonb_object_agg(k, to_jsonb(n)->k) "
+              "FROM unnest(akeys(hstore(n) - hstore(o))) k), '{}'::jsonb)",
+    "{using}": "USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;",
+}
+
+AUDIT_FUNCTION_TEMPLATE = """
+    CREATE OR REPLACE FUNCTION audit_trigger_function()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        pk_col TEXT;
+        excluded_cols TEXT[];
+        ctx_user_id INTEGER;
+        ctx_user_email TEXT;
+        ctx_ip TEXT;
+        ctx_endpoint TEXT;
+    BEGIN
+        -- Columna de clave primaria de la tabla auditada (una consulta por sentencia)
+        pk_col := audit_pk_column(TG_TABLE_NAME);
+
+        IF pk_col IS NULL THEN
+            RETURN NULL;
+        END IF;
+{excluded_lookup}
+        -- Contexto publicado por la aplicación con set_config() (una vez por sentencia)
+        ctx_user_id := NULLIF(current_setting('app.user_id', true), '')::INTEGER;
+        ctx_user_email := NULLIF(current_setting('app.user_email', true), '');
+        ctx_ip := NULLIF(current_setting('app.ip', true), '');
+        ctx_endpoint := NULLIF(current_setting('app.endpoint', true), '');
+
+        IF TG_OP = 'INSERT' THEN
+            EXECUTE format($sql$
+                INSERT INTO audit_log (
+                    tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                    datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                )
+                SELECT %L, n.%I, 'INSERT', $1, $2,
+                       NULL, {json_n}, NULL, $3, $4, CURRENT_TIMESTAMP
+                FROM nt n
+            $sql$, TG_TABLE_NAME, pk_col)
+            {using}
+        ELSIF TG_OP = 'UPDATE' THEN
+            -- Las filas se emparejan por clave primaria. Si un UPDATE cambia la PK,
+            -- el FULL JOIN conserva ambas versiones como dos registros UPDATE.
+            EXECUTE format($sql$
+                INSERT INTO audit_log (
+                    tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                    datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                )
+                SELECT %L, COALESCE(n.%I, o.%I), 'UPDATE', $1, $2,
+                       CASE WHEN n IS NULL THEN {json_o} END,
+                       CASE WHEN o IS NULL THEN {json_n} END,
+                       CASE WHEN o IS NULL OR n IS NULL THEN NULL
+                            ELSE {diff} END,
+                       $3, $4, CURRENT_TIMESTAMP
+                FROM nt n
+                FULL JOIN ot o ON o.%I = n.%I
+            $sql$, TG_TABLE_NAME, pk_col, pk_col, pk_col, pk_col)
+            {using}
+        ELSIF TG_OP = 'DELETE' THEN
+            EXECUTE format($sql$
+                INSERT INTO audit_log (
+                    tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                    datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                )
+                SELECT %L, o.%I, 'DELETE', $1, $2,
+                       {json_o}, NULL, NULL, $3, $4, CURRENT_TIMESTAMP
+                FROM ot o
+            $sql$, TG_TABLE_NAME, pk_col)
+            {using}
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+def render_audit_function(payload: dict) -> str:
+    """Sustituye los marcadores de AUDIT_FUNCTION_TEMPLATE."""
+    sql = AUDIT_FUNCTION_TEMPLATE
+    for marcador, valor in payload.items():
+        sql = sql.replace(marcador, valor)
+    return sql
+
+
+def upgrade() -> None:
+    """Upgrade schema - Exclude sensitive and bulky columns from audit payloads."""
+    # Tabla de configuración: columnas que no se guardan en audit_log por tabla
+    op.execute("""
+        CREATE TABLE audit_config (
+            tabla TEXT PRIMARY KEY,
+            excluded_cols TEXT[] NOT NULL DEFAULT '{}'
+        );
+
+        INSERT INTO audit_config (tabla, excluded_cols) VALUES
+            ('usuarios', ARRAY['contraseña', 'token_confirmacion', 'token_reset']),
+            ('productos', ARRAY['descripcion', 'imagen_url']);
+    """)
+
+    # Las tablas sin fila en audit_config no excluyen ninguna columna
+    op.execute("""
+        CREATE OR REPLACE FUNCTION audit_excluded_cols(p_tabla TEXT)
+        RETURNS TEXT[] AS $$
+            SELECT COALESCE(
+                (SELECT excluded_cols FROM audit_config WHERE tabla = p_tabla),
+                '{}'::TEXT[]
+            );
+        $$ LANGUAGE sql STABLE;
+    """)
+
+    op.execute(render_audit_function(PAYLOAD_EXCLUDED))
+
+
+def downgrade() -> None:
+    """Downgrade schema - Store every column in audit payloads."""
+    op.execute(render_audit_function(PAYLOAD_FULL))
+    op.execute("DROP FUNCTION IF EXISTS audit_excluded_cols(TEXT);")
+    op.execute("DROP TABLE IF EXISTS audit_config;")
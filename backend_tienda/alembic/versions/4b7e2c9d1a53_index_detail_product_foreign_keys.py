@@ -0,0 +1,44 @@
+"""index_detail_product_foreign_keys
+
+Revision ID: 4b7e2c9d1a53
+Revises: 3e9a5c1d7b82
+Create Date: 2025-12-10 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7e2c9d1a53'
+down_revision: Union[str, None] = '3e9a5c1d7b82'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Claves foráneas hacia productos que no tenían índice: sin él, borrar o cambiar un
+# producto recorre detalle_pedidos y detalle_carrito enteros para comprobar la FK
+DETAIL_PRODUCT_INDEXES = [
+    ('ix_detalle_pedidos_id_producto', 'detalle_pedidos'),
+    ('ix_detalle_carrito_id_producto', 'detalle_carrito'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema - Index id_producto on order and cart details."""
+    # CONCURRENTLY no bloquea las escrituras, pero no puede ir dentro de una transacción
+    with op.get_context().autocommit_block():
+        for nombre, tabla in DETAIL_PRODUCT_INDEXES:
+            op.create_index(
+                nombre, tabla, ['id_producto'],
+                postgresql_concurrently=True, if_not_exists=True
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema - Drop the id_producto indexes on order and cart details."""
+    with op.get_context().autocommit_block():
+        for nombre, tabla in DETAIL_PRODUCT_INDEXES:
+            op.drop_index(nombre, table_name=tabla, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,40 @@
+"""server_side_creation_timestamps
+
+Revision ID: 5c1f8e3a2b94
+Revises: 4b7e2c9d1a53
+Create Date: 2025-12-12 10:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1f8e3a2b94'
+down_revision: Union[str, None] = '4b7e2c9d1a53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Columnas de fecha de alta que ahora rellena la base de datos en el INSERT
+CREATION_TIMESTAMPS = [
+    ('usuarios', 'fecha_creacion'),
+    ('clientes', 'fecha_registro'),
+    ('pedidos', 'fecha_pedido'),
+    ('carrito', 'fecha_creacion'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema - Default creation timestamps to the current UTC time."""
+    # Mismo valor que datetime.utcnow(): TIMESTAMP sin zona horaria en UTC
+    for tabla, columna in CREATION_TIMESTAMPS:
+        op.alter_column(tabla, columna, server_default=sa.text("timezone('utc', now())"))
+
+
+def downgrade() -> None:
+    """Downgrade schema - Drop the creation timestamp defaults."""
+    for tabla, columna in CREATION_TIMESTAMPS:
+        op.alter_column(tabla, columna, server_default=None)
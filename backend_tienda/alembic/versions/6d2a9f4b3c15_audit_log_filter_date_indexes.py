@@ -0,0 +1,71 @@
+"""audit_log_filter_date_indexes
+
+Revision ID: 6d2a9f4b3c15
+Revises: 5c1f8e3a2b94
+Create Date: 2025-12-15 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d2a9f4b3c15'
+down_revision: Union[str, None] = '5c1f8e3a2b94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# GET /audit filtra por una columna y ordena por fecha_accion DESC con LIMIT: con la columna
+# de filtro delante el planner recorre el índice en orden y se detiene tras `limit` filas.
+# Sin filtros ya sirve ix_audit_log_fecha_accion (un btree se recorre también hacia atrás).
+AUDIT_FILTER_INDEXES = [
+    ('ix_audit_usuario_fecha', 'usuario_id'),
+    ('ix_audit_accion_fecha', 'accion'),
+    ('ix_audit_tabla_fecha', 'tabla_nombre'),
+]
+
+
+def _indice_particion(nombre: str, particion: str) -> str:
+    """Nombre del índice de una partición, p. ej. ix_audit_log_y2025m01_usuario_fecha."""
+    return f"ix_{particion}_{nombre.removeprefix('ix_audit_')}"
+
+
+def upgrade() -> None:
+    """Upgrade schema - Add (filter column, fecha_accion DESC) indexes on audit_log."""
+    # audit_log está particionada y PostgreSQL no admite CREATE INDEX CONCURRENTLY sobre la
+    # tabla padre. Un CREATE INDEX normal tomaría SHARE sobre el padre y todas las particiones
+    # durante toda la construcción, bloqueando los triggers de auditoría (todas las escrituras).
+    # En su lugar: índice inválido solo en el padre (ON ONLY, instantáneo), índice CONCURRENTLY
+    # en cada partición y ATTACH PARTITION; al adjuntar todas, el índice del padre pasa a válido.
+    for nombre, columna in AUDIT_FILTER_INDEXES:
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS {nombre} ON ONLY audit_log ({columna}, fecha_accion DESC)"
+        )
+
+    with op.get_context().autocommit_block():
+        particiones = op.get_bind().execute(sa.text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'audit_log'::regclass
+            ORDER BY c.relname
+        """)).scalars().all()
+
+        for nombre, columna in AUDIT_FILTER_INDEXES:
+            for particion in particiones:
+                indice = _indice_particion(nombre, particion)
+                op.create_index(
+                    indice, particion, [columna, sa.text('fecha_accion DESC')],
+                    postgresql_concurrently=True, if_not_exists=True
+                )
+                op.execute(f"ALTER INDEX {nombre} ATTACH PARTITION {indice}")
+
+
+def downgrade() -> None:
+    """Downgrade schema - Drop the (filter column, fecha_accion DESC) indexes on audit_log."""
+    # Borrar el índice del padre borra también los de las particiones adjuntas
+    for nombre, _ in AUDIT_FILTER_INDEXES:
+        op.drop_index(nombre, table_name='audit_log', if_exists=True)
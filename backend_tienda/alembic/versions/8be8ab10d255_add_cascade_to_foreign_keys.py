@@ -4,6 +4,10 @@ Revision ID: 8be8ab10d255
 Revises: b27588c0553a
 Create Date: 2025-01-20 20:00:00.000000
 
+Nota: esta revisión ya estaba publicada cuando se cambió para crear las FK como NOT VALID
+y validarlas aparte. Solo afecta a bases de datos que todavía no la han aplicado (instalaciones
+nuevas o anteriores a 8be8ab10d255); las que ya la tienen no la vuelven a ejecutar y quedan
+con el mismo esquema final (FK con CASCADE/SET NULL ya validadas).
 """
 from typing import Sequence, Union
 
@@ -18,15 +22,30 @@ branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
 
+# FK recreadas en upgrade(), en el mismo orden
+VALIDATE_FOREIGN_KEYS = [
+    ('clientes', 'clientes_id_usuario_fkey'),
+    ('pedidos', 'pedidos_id_cliente_fkey'),
+    ('detalle_pedidos', 'detalle_pedidos_id_pedido_fkey'),
+    ('carrito', 'carrito_id_cliente_fkey'),
+    ('detalle_carrito', 'detalle_carrito_id_carrito_fkey'),
+    ('audit_log', 'audit_log_usuario_id_fkey'),
+]
+
+
 def upgrade() -> None:
     """Upgrade schema."""
+    # Las FK se recrean como NOT VALID: el ALTER TABLE solo toma el lock exclusivo
+    # el tiempo de cambiar el catálogo, sin recorrer la tabla hija.
+
     # Actualizar foreign key de clientes -> usuarios con CASCADE
     op.drop_constraint('clientes_id_usuario_fkey', 'clientes', type_='foreignkey')
     op.create_foreign_key(
         'clientes_id_usuario_fkey',
         'clientes', 'usuarios',
         ['id_usuario'], ['id_usuario'],
-        ondelete='CASCADE'
+        ondelete='CASCADE',
+        postgresql_not_valid=True
     )
     
     # Actualizar foreign key de pedidos -> clientes con CASCADE
@@ -35,7 +54,8 @@ def upgrade() -> None:
         'pedidos_id_cliente_fkey',
         'pedidos', 'clientes',
         ['id_cliente'], ['id_cliente'],
-        ondelete='CASCADE'
+        ondelete='CASCADE',
+        postgresql_not_valid=True
     )
     
     # Actualizar foreign key de detalle_pedidos -> pedidos con CASCADE
@@ -44,7 +64,8 @@ def upgrade() -> None:
         'detalle_pedidos_id_pedido_fkey',
         'detalle_pedidos', 'pedidos',
         ['id_pedido'], ['id_pedido'],
-        ondelete='CASCADE'
+        ondelete='CASCADE',
+        postgresql_not_valid=True
     )
     
     # Actualizar foreign key de carrito -> clientes con CASCADE
@@ -53,7 +74,8 @@ def upgrade() -> None:
         'carrito_id_cliente_fkey',
         'carrito', 'clientes',
         ['id_cliente'], ['id_cliente'],
-        ondelete='CASCADE'
+        ondelete='CASCADE',
+        postgresql_not_valid=True
     )
     
     # Actualizar foreign key de detalle_carrito -> carrito con CASCADE
@@ -62,7 +84,8 @@ def upgrade() -> None:
         'detalle_carrito_id_carrito_fkey',
         'detalle_carrito', 'carrito',
         ['id_carrito'], ['id_carrito'],
-        ondelete='CASCADE'
+        ondelete='CASCADE',
+        postgresql_not_valid=True
     )
     
     # Actualizar foreign key de audit_log -> usuarios con SET NULL (para mantener historial)
@@ -71,9 +94,17 @@ def upgrade() -> None:
         'audit_log_usuario_id_fkey',
         'audit_log', 'usuarios',
         ['usuario_id'], ['id_usuario'],
-        ondelete='SET NULL'
+        ondelete='SET NULL',
+        postgresql_not_valid=True
     )
 
+    # Validación de las filas existentes. VALIDATE CONSTRAINT solo toma
+    # SHARE UPDATE EXCLUSIVE (no bloquea lecturas ni escrituras); cada una se
+    # confirma por separado para no acumular locks hasta el final de la migración.
+    with op.get_context().autocommit_block():
+        for tabla, constraint in VALIDATE_FOREIGN_KEYS:
+            op.execute(f"ALTER TABLE {tabla} VALIDATE CONSTRAINT {constraint}")
+
 
 def downgrade() -> None:
     """Downgrade schema."""
@@ -4,6 +4,10 @@ Revision ID: 9263c2bef436
 Revises: 8be8ab10d255
 Create Date: 2025-01-20 21:00:00.000000
 
+Nota: esta revisión ya estaba publicada cuando se cambió el ALTER COLUMN TYPE por columna
+nueva, copia por lotes e intercambio de nombres. Solo afecta a bases de datos que todavía no
+la han aplicado; las que ya la tienen no la vuelven a ejecutar y quedan con el mismo esquema
+(token_confirmacion VARCHAR(6) con su índice), salvo la posición física de la columna.
 """
 from typing import Sequence, Union
 
@@ -18,23 +22,54 @@ branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
 
+# Filas de usuarios copiadas por transacción durante el backfill
+BATCH_SIZE = 10_000
+
+
 def upgrade() -> None:
     """Upgrade schema."""
-    # Cambiar el tipo de columna token_confirmacion de VARCHAR(255) a VARCHAR(6)
-    # Primero, limpiar cualquier token existente que no sea de 6 dígitos (por si acaso)
-    # Luego cambiar el tipo de columna
+    # Cambiar token_confirmacion de VARCHAR(255) a VARCHAR(6) sin reescribir la tabla
+    # bajo lock exclusivo: columna nueva, copia por lotes e intercambio de nombres.
+    # Los tokens que no son de 6 dígitos no se copian (quedan en NULL).
+    op.add_column('usuarios', sa.Column('token_confirmacion_new', sa.String(length=6), nullable=True))
+
+    bind = op.get_bind()
+    max_id = bind.execute(sa.text("SELECT COALESCE(MAX(id_usuario), 0) FROM usuarios")).scalar()
+
+    # Cada lote se confirma por separado para limitar el WAL y los locks de fila
+    with op.get_context().autocommit_block():
+        for lo in range(1, max_id + 1, BATCH_SIZE):
+            bind.execute(
+                sa.text("""
+                    UPDATE usuarios
+                    SET token_confirmacion_new = token_confirmacion
+                    WHERE id_usuario BETWEEN :lo AND :hi
+                    AND LENGTH(token_confirmacion) = 6
+                """),
+                {"lo": lo, "hi": lo + BATCH_SIZE - 1}
+            )
+
+    # Tokens escritos o borrados mientras corría el backfill; luego se intercambian las columnas
     op.execute("""
-        UPDATE usuarios 
-        SET token_confirmacion = NULL 
-        WHERE token_confirmacion IS NOT NULL 
-        AND LENGTH(token_confirmacion) != 6
+        UPDATE usuarios
+        SET token_confirmacion_new = t.pin
+        FROM (
+            SELECT id_usuario,
+                   CASE WHEN LENGTH(token_confirmacion) = 6 THEN token_confirmacion END AS pin
+            FROM usuarios
+        ) t
+        WHERE usuarios.id_usuario = t.id_usuario
+        AND usuarios.token_confirmacion_new IS DISTINCT FROM t.pin
     """)
-    
-    # Cambiar el tipo de columna
-    op.alter_column('usuarios', 'token_confirmacion',
-                    existing_type=sa.String(length=255),
-                    type_=sa.String(length=6),
-                    existing_nullable=True)
+    op.drop_column('usuarios', 'token_confirmacion')
+    op.alter_column('usuarios', 'token_confirmacion_new', new_column_name='token_confirmacion')
+
+    # DROP COLUMN eliminó también su índice
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_usuarios_token_confirmacion', 'usuarios', ['token_confirmacion'],
+            postgresql_concurrently=True
+        )
 
 
 def downgrade() -> None:
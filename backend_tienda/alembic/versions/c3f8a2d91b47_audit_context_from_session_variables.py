@@ -0,0 +1,133 @@
+"""audit_context_from_session_variables
+
+Revision ID: c3f8a2d91b47
+Revises: a1b2c3d4e5f6
+Create Date: 2025-11-24 10:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f8a2d91b47'
+down_revision: Union[str, None] = 'a1b2c3d4e5f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Cuerpo común de la función; solo cambia el INSERT final
+AUDIT_FUNCTION_TEMPLATE = """
+    CREATE OR REPLACE FUNCTION audit_trigger_function()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        registro_id_val INTEGER;
+        old_data JSONB;
+        new_data JSONB;
+        changed_fields JSONB;
+    BEGIN
+        -- Obtener el ID según la tabla (OLD para DELETE, NEW en otro caso)
+        IF TG_OP = 'DELETE' THEN
+            new_data := NULL;
+            old_data := to_jsonb(OLD);
+        ELSE
+            new_data := to_jsonb(NEW);
+            old_data := CASE WHEN TG_OP = 'UPDATE' THEN to_jsonb(OLD) ELSE NULL END;
+        END IF;
+
+        registro_id_val := (COALESCE(new_data, old_data) ->> CASE TG_TABLE_NAME
+            WHEN 'usuarios' THEN 'id_usuario'
+            WHEN 'clientes' THEN 'id_cliente'
+            WHEN 'categorias' THEN 'id_categoria'
+            WHEN 'productos' THEN 'id_producto'
+            WHEN 'pedidos' THEN 'id_pedido'
+            WHEN 'detalle_pedidos' THEN 'id_detalle'
+            WHEN 'carrito' THEN 'id_carrito'
+            WHEN 'detalle_carrito' THEN 'id_detalle_carrito'
+        END)::INTEGER;
+
+        -- Solo insertar si tenemos un registro_id válido
+        IF registro_id_val IS NULL THEN
+            RETURN COALESCE(NEW, OLD);
+        END IF;
+
+        -- Calcular campos que cambiaron
+        IF TG_OP = 'UPDATE' THEN
+            changed_fields := (
+                SELECT jsonb_object_agg(key, value)
+                FROM jsonb_each(new_data)
+                WHERE value IS DISTINCT FROM (old_data->key)
+            );
+        ELSE
+            changed_fields := NULL;
+        END IF;
+
+        {insert}
+
+        RETURN COALESCE(NEW, OLD);
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# El contexto (usuario, IP, endpoint) lo publica la aplicación con set_config()
+# al iniciar la transacción; la cadena vacía equivale a "sin contexto".
+INSERT_WITH_CONTEXT = """
+        INSERT INTO audit_log (
+            tabla_nombre,
+            registro_id,
+            accion,
+            usuario_id,
+            usuario_email,
+            datos_anteriores,
+            datos_nuevos,
+            cambios,
+            ip_address,
+            endpoint,
+            fecha_accion
+        ) VALUES (
+            TG_TABLE_NAME,
+            registro_id_val,
+            TG_OP,
+            NULLIF(current_setting('app.user_id', true), '')::INTEGER,
+            NULLIF(current_setting('app.user_email', true), ''),
+            old_data,
+            new_data,
+            changed_fields,
+            NULLIF(current_setting('app.ip', true), ''),
+            NULLIF(current_setting('app.endpoint', true), ''),
+            CURRENT_TIMESTAMP
+        );
+"""
+
+INSERT_WITHOUT_CONTEXT = """
+        INSERT INTO audit_log (
+            tabla_nombre,
+            registro_id,
+            accion,
+            datos_anteriores,
+            datos_nuevos,
+            cambios,
+            fecha_accion
+        ) VALUES (
+            TG_TABLE_NAME,
+            registro_id_val,
+            TG_OP,
+            old_data,
+            new_data,
+            changed_fields,
+            CURRENT_TIMESTAMP
+        );
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema - Read audit context from session variables inside the trigger."""
+    # Los triggers existentes siguen apuntando a la función; basta con reemplazarla
+    op.execute(AUDIT_FUNCTION_TEMPLATE.replace("{insert}", INSERT_WITH_CONTEXT))
+
+
+def downgrade() -> None:
+    """Downgrade schema - Restore trigger without session context."""
+    op.execute(AUDIT_FUNCTION_TEMPLATE.replace("{insert}", INSERT_WITHOUT_CONTEXT))
@@ -0,0 +1,221 @@
+"""audit_statement_level_triggers
+
+Revision ID: d94e6b0c7a15
+Revises: c3f8a2d91b47
+Create Date: 2025-11-25 09:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd94e6b0c7a15'
+down_revision: Union[str, None] = 'c3f8a2d91b47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+AUDITED_TABLES = [
+    'carrito',
+    'detalle_carrito',
+    'usuarios',
+    'clientes',
+    'categorias',
+    'productos',
+    'pedidos',
+    'detalle_pedidos',
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema - Audit with FOR EACH STATEMENT triggers over transition tables."""
+    # Una sola ejecución de la función por sentencia: un INSERT ... SELECT
+    # sobre las tablas de transición en lugar de un INSERT por fila.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION audit_trigger_function()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            pk_col TEXT;
+            ctx_user_id INTEGER;
+            ctx_user_email TEXT;
+            ctx_ip TEXT;
+            ctx_endpoint TEXT;
+        BEGIN
+            -- Columna de clave primaria de la tabla auditada
+            WITH pk_map (tabla, columna) AS (
+                VALUES ('usuarios', 'id_usuario'),
+                       ('clientes', 'id_cliente'),
+                       ('categorias', 'id_categoria'),
+                       ('productos', 'id_producto'),
+                       ('pedidos', 'id_pedido'),
+                       ('detalle_pedidos', 'id_detalle'),
+                       ('carrito', 'id_carrito'),
+                       ('detalle_carrito', 'id_detalle_carrito')
+            )
+            SELECT columna INTO pk_col FROM pk_map WHERE tabla = TG_TABLE_NAME;
+
+            IF pk_col IS NULL THEN
+                RETURN NULL;
+            END IF;
+
+            -- Contexto publicado por la aplicación con set_config() (una vez por sentencia)
+            ctx_user_id := NULLIF(current_setting('app.user_id', true), '')::INTEGER;
+            ctx_user_email := NULLIF(current_setting('app.user_email', true), '');
+            ctx_ip := NULLIF(current_setting('app.ip', true), '');
+            ctx_endpoint := NULLIF(current_setting('app.endpoint', true), '');
+
+            IF TG_OP = 'INSERT' THEN
+                EXECUTE format($sql$
+                    INSERT INTO audit_log (
+                        tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                        datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                    )
+                    SELECT %L, n.%I, 'INSERT', $1, $2,
+                           NULL, to_jsonb(n), NULL, $3, $4, CURRENT_TIMESTAMP
+                    FROM nt n
+                $sql$, TG_TABLE_NAME, pk_col)
+                USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;
+            ELSIF TG_OP = 'UPDATE' THEN
+                -- Las filas se emparejan por clave primaria. Si un UPDATE cambia la PK,
+                -- el FULL JOIN conserva ambas versiones como dos registros UPDATE
+                -- (uno solo con datos_anteriores y otro solo con datos_nuevos).
+                EXECUTE format($sql$
+                    INSERT INTO audit_log (
+                        tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                        datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                    )
+                    SELECT %L, COALESCE(n.%I, o.%I), 'UPDATE', $1, $2,
+                           to_jsonb(o), to_jsonb(n),
+                           CASE WHEN o IS NULL OR n IS NULL THEN NULL ELSE (
+                               SELECT jsonb_object_agg(key, value)
+                               FROM jsonb_each(to_jsonb(n))
+                               WHERE value IS DISTINCT FROM (to_jsonb(o)->key)
+                           ) END,
+                           $3, $4, CURRENT_TIMESTAMP
+                    FROM nt n
+                    FULL JOIN ot o ON o.%I = n.%I
+                $sql$, TG_TABLE_NAME, pk_col, pk_col, pk_col, pk_col)
+                USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;
+            ELSIF TG_OP = 'DELETE' THEN
+                EXECUTE format($sql$
+                    INSERT INTO audit_log (
+                        tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                        datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                    )
+                    SELECT %L, o.%I, 'DELETE', $1, $2,
+                           to_jsonb(o), NULL, NULL, $3, $4, CURRENT_TIMESTAMP
+                    FROM ot o
+                $sql$, TG_TABLE_NAME, pk_col)
+                USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # PostgreSQL no permite tablas de transición en triggers con varios eventos,
+    # así que se crea un trigger por operación.
+    for tabla in AUDITED_TABLES:
+        op.execute(f"""
+            DROP TRIGGER IF EXISTS audit_trigger ON {tabla};
+
+            CREATE TRIGGER audit_trigger_insert
+            AFTER INSERT ON {tabla}
+            REFERENCING NEW TABLE AS nt
+            FOR EACH STATEMENT EXECUTE FUNCTION audit_trigger_function();
+
+            CREATE TRIGGER audit_trigger_update
+            AFTER UPDATE ON {tabla}
+            REFERENCING OLD TABLE AS ot NEW TABLE AS nt
+            FOR EACH STATEMENT EXECUTE FUNCTION audit_trigger_function();
+
+            CREATE TRIGGER audit_trigger_delete
+            AFTER DELETE ON {tabla}
+            REFERENCING OLD TABLE AS ot
+            FOR EACH STATEMENT EXECUTE FUNCTION audit_trigger_function();
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema - Restore FOR EACH ROW audit trigger."""
+    for tabla in AUDITED_TABLES:
+        op.execute(f"""
+            DROP TRIGGER IF EXISTS audit_trigger_insert ON {tabla};
+            DROP TRIGGER IF EXISTS audit_trigger_update ON {tabla};
+            DROP TRIGGER IF EXISTS audit_trigger_delete ON {tabla};
+        """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION audit_trigger_function()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            registro_id_val INTEGER;
+            old_data JSONB;
+            new_data JSONB;
+            changed_fields JSONB;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                new_data := NULL;
+                old_data := to_jsonb(OLD);
+            ELSE
+                new_data := to_jsonb(NEW);
+                old_data := CASE WHEN TG_OP = 'UPDATE' THEN to_jsonb(OLD) ELSE NULL END;
+            END IF;
+
+            registro_id_val := (COALESCE(new_data, old_data) ->> CASE TG_TABLE_NAME
+                WHEN 'usuarios' THEN 'id_usuario'
+                WHEN 'clientes' THEN 'id_cliente'
+                WHEN 'categorias' THEN 'id_categoria'
+                WHEN 'productos' THEN 'id_producto'
+                WHEN 'pedidos' THEN 'id_pedido'
+                WHEN 'detalle_pedidos' THEN 'id_detalle'
+                WHEN 'carrito' THEN 'id_carrito'
+                WHEN 'detalle_carrito' THEN 'id_detalle_carrito'
+            END)::INTEGER;
+
+            IF registro_id_val IS NULL THEN
+                RETURN COALESCE(NEW, OLD);
+            END IF;
+
+            IF TG_OP = 'UPDATE' THEN
+                changed_fields := (
+                    SELECT jsonb_object_agg(key, value)
+                    FROM jsonb_each(new_data)
+                    WHERE value IS DISTINCT FROM (old_data->key)
+                );
+            ELSE
+                changed_fields := NULL;
+            END IF;
+
+            INSERT INTO audit_log (
+                tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+            ) VALUES (
+                TG_TABLE_NAME,
+                registro_id_val,
+                TG_OP,
+                NULLIF(current_setting('app.user_id', true), '')::INTEGER,
+                NULLIF(current_setting('app.user_email', true), ''),
+                old_data,
+                new_data,
+                changed_fields,
+                NULLIF(current_setting('app.ip', true), ''),
+                NULLIF(current_setting('app.endpoint', true), ''),
+                CURRENT_TIMESTAMP
+            );
+
+            RETURN COALESCE(NEW, OLD);
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    for tabla in AUDITED_TABLES:
+        op.execute(f"""
+            CREATE TRIGGER audit_trigger
+            AFTER INSERT OR UPDATE OR DELETE ON {tabla}
+            FOR EACH ROW EXECUTE FUNCTION audit_trigger_function();
+        """)
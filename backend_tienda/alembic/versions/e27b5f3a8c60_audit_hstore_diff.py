@@ -0,0 +1,126 @@
+"""audit_hstore_diff
+
+Revision ID: e27b5f3a8c60
+Revises: d94e6b0c7a15
+Create Date: 2025-11-26 11:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e27b5f3a8c60'
+down_revision: Union[str, None] = 'd94e6b0c7a15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Expresión que calcula `cambios` en las actualizaciones (o = fila anterior, n = nueva)
+DIFF_HSTORE = """COALESCE((
+                               SELECT jsonb_object_agg(k, to_jsonb(n)->k)
+                               FROM unnest(akeys(hstore(n) - hstore(o))) k
+                           ), '{}'::jsonb)"""
+
+DIFF_JSONB = """(
+                               SELECT jsonb_object_agg(key, value)
+                               FROM jsonb_each(to_jsonb(n))
+                               WHERE value IS DISTINCT FROM (to_jsonb(o)->key)
+                           )"""
+
+AUDIT_FUNCTION_TEMPLATE = """
+    CREATE OR REPLACE FUNCTION audit_trigger_function()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        pk_col TEXT;
+        ctx_user_id INTEGER;
+        ctx_user_email TEXT;
+        ctx_ip TEXT;
+        ctx_endpoint TEXT;
+    BEGIN
+        -- Columna de clave primaria de la tabla auditada
+        WITH pk_map (tabla, columna) AS (
+            VALUES ('usuarios', 'id_usuario'),
+                   ('clientes', 'id_cliente'),
+                   ('categorias', 'id_categoria'),
+                   ('productos', 'id_producto'),
+                   ('pedidos', 'id_pedido'),
+                   ('detalle_pedidos', 'id_detalle'),
+                   ('carrito', 'id_carrito'),
+                   ('detalle_carrito', 'id_detalle_carrito')
+        )
+        SELECT columna INTO pk_col FROM pk_map WHERE tabla = TG_TABLE_NAME;
+
+        IF pk_col IS NULL THEN
+            RETURN NULL;
+        END IF;
+
+        -- Contexto publicado por la aplicación con set_config() (una vez por sentencia)
+        ctx_user_id := NULLIF(current_setting('app.user_id', true), '')::INTEGER;
+        ctx_user_email := NULLIF(current_setting('app.user_email', true), '');
+        ctx_ip := NULLIF(current_setting('app.ip', true), '');
+        ctx_endpoint := NULLIF(current_setting('app.endpoint', true), '');
+
+        IF TG_OP = 'INSERT' THEN
+            EXECUTE format($sql$
+                INSERT INTO audit_log (
+                    tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                    datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                )
+                SELECT %L, n.%I, 'INSERT', $1, $2,
+                       NULL, to_jsonb(n), NULL, $3, $4, CURRENT_TIMESTAMP
+                FROM nt n
+            $sql$, TG_TABLE_NAME, pk_col)
+            USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;
+        ELSIF TG_OP = 'UPDATE' THEN
+            -- Las filas se emparejan por clave primaria. Si un UPDATE cambia la PK,
+            -- el FULL JOIN conserva ambas versiones como dos registros UPDATE.
+            EXECUTE format($sql$
+                INSERT INTO audit_log (
+                    tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                    datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                )
+                SELECT %L, COALESCE(n.%I, o.%I), 'UPDATE', $1, $2,
+                       to_jsonb(o), to_jsonb(n),
+                       CASE WHEN o IS NULL OR n IS NULL THEN NULL ELSE {diff} END,
+                       $3, $4, CURRENT_TIMESTAMP
+                FROM nt n
+                FULL JOIN ot o ON o.%I = n.%I
+            $sql$, TG_TABLE_NAME, pk_col, pk_col, pk_col, pk_col)
+            USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;
+        ELSIF TG_OP = 'DELETE' THEN
+            EXECUTE format($sql$
+                INSERT INTO audit_log (
+                    tabla_nombre, registro_id, accion, usuario_id, usuario_email,
+                    datos_anteriores, datos_nuevos, cambios, ip_address, endpoint, fecha_accion
+                )
+                SELECT %L, o.%I, 'DELETE', $1, $2,
+                       to_jsonb(o), NULL, NULL, $3, $4, CURRENT_TIMESTAMP
+                FROM ot o
+            $sql$, TG_TABLE_NAME, pk_col)
+            USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema - Compute audit changes with the hstore minus operator."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS hstore;")
+
+    # hstore(n) - hstore(o) conserva solo los pares clave/valor de n que difieren de o.
+    # De ahí se toman solo las claves: los valores se leen de to_jsonb(n), con el mismo tipo y
+    # formato que datos_nuevos. hstore guarda todo como texto; hstore_to_jsonb devolvería solo
+    # strings y hstore_to_jsonb_loose adivina el tipo ("987654321" pasaría a número).
+    op.execute(AUDIT_FUNCTION_TEMPLATE.replace("{diff}", DIFF_HSTORE))
+
+
+def downgrade() -> None:
+    """Downgrade schema - Restore jsonb_each based diff."""
+    op.execute(AUDIT_FUNCTION_TEMPLATE.replace("{diff}", DIFF_JSONB))
+    # La extensión hstore se conserva: pudo existir antes de esta migración
@@ -1,148 +1,117 @@
 """
-Sistema de auditoría usando SQLAlchemy event listeners.
-Captura información del contexto (usuario, IP, endpoint) y actualiza los registros creados por triggers.
+Sistema de auditoría basado en variables de sesión de PostgreSQL.
+Captura información del contexto (usuario, IP, endpoint) de cada request en un
+ContextVar y la publica en la transacción de la sesión de esa request para que el
+trigger `audit_trigger_function()` la incluya directamente en el registro de audit_log.
 """
 
-from datetime import datetime
+import logging
+from contextvars import ContextVar, Token
+from typing import Optional
+
 from sqlalchemy import event, text
-from . import models
 
-# Contexto global para almacenar información de la request actual
+logger = logging.getLogger(__name__)
+
+
 class AuditContext:
-    def __init__(self):
-        self.user_id = None
-        self.user_email = None
-        self.ip_address = None
-        self.endpoint = None
-        self.reset()
-    
-    def reset(self):
-        self.user_id = None
-        self.user_email = None
-        self.ip_address = None
-        self.endpoint = None
-
-# Contexto global (thread-local)
-audit_context = AuditContext()
-
-def set_audit_context(user_id=None, user_email=None, ip_address=None, endpoint=None):
-    """Establece el contexto de auditoría para la request actual."""
-    audit_context.user_id = user_id
-    audit_context.user_email = user_email
-    audit_context.ip_address = ip_address
-    audit_context.endpoint = endpoint
-
-def clear_audit_context():
-    """Limpia el contexto de auditoría."""
-    audit_context.reset()
-
-def get_record_id(instance):
-    """Obtiene el ID del registro según el tipo de modelo."""
-    if hasattr(instance, 'id_usuario'):
-        return instance.id_usuario
-    elif hasattr(instance, 'id_cliente'):
-        return instance.id_cliente
-    elif hasattr(instance, 'id_categoria'):
-        return instance.id_categoria
-    elif hasattr(instance, 'id_producto'):
-        return instance.id_producto
-    elif hasattr(instance, 'id_pedido'):
-        return instance.id_pedido
-    elif hasattr(instance, 'id_detalle'):
-        return instance.id_detalle
-    elif hasattr(instance, 'id_carrito'):
-        return instance.id_carrito
-    elif hasattr(instance, 'id_detalle_carrito'):
-        return instance.id_detalle_carrito
-    return None
-
-def get_table_name(instance):
-    """Obtiene el nombre de la tabla del modelo."""
-    if hasattr(instance, '__tablename__'):
-        return instance.__tablename__
-    return None
-
-def update_audit_log(connection, instance, operation: str):
-    """Actualiza el registro de auditoría creado por el trigger con información del contexto."""
+    """Contexto de auditoría de una request."""
+
+    def __init__(self, user_id=None, user_email=None, ip_address=None, endpoint=None):
+        self.user_id = user_id
+        self.user_email = user_email
+        self.ip_address = ip_address
+        self.endpoint = endpoint
+
+    def is_empty(self):
+        return not self.user_id and not self.user_email and not self.ip_address and not self.endpoint
+
+
+# Cada request (tarea asyncio) y los hilos del threadpool que la atienden ven su propia copia
+_audit_context: ContextVar[Optional[AuditContext]] = ContextVar("audit_context", default=None)
+
+
+def set_audit_context(user_id=None, user_email=None, ip_address=None, endpoint=None) -> Token:
+    """Establece el contexto de auditoría de la request actual y devuelve el token para restaurarlo."""
+    return _audit_context.set(AuditContext(
+        user_id=user_id,
+        user_email=user_email,
+        ip_address=ip_address,
+        endpoint=endpoint
+    ))
+
+
+def clear_audit_context(token: Token):
+    """Restaura el contexto de auditoría anterior a `set_audit_context`."""
+    _audit_context.reset(token)
+
+
+def get_audit_context() -> Optional[AuditContext]:
+    """Devuelve el contexto de auditoría de la request actual (o None)."""
+    return _audit_context.get()
+
+
+def normalizar_user_id(user_id):
+    """Convierte el id de usuario del token a entero; devuelve None si no es válido."""
+    if user_id is None or isinstance(user_id, bool):
+        return None
     try:
-        # Obtener información del contexto
-        user_id = audit_context.user_id
-        user_email = audit_context.user_email
-        ip_address = audit_context.ip_address
-        endpoint = audit_context.endpoint
-        
-        if not user_id and not user_email and not ip_address and not endpoint:
-            return  # No hay contexto que actualizar
-        
-        # Obtener ID del registro y nombre de tabla
-        registro_id = get_record_id(instance)
-        tabla_nombre = get_table_name(instance)
-        
-        if registro_id is None or tabla_nombre is None:
-            return  # No se puede actualizar sin esta información
-        
-        # Actualizar registro existente en audit_log con información del contexto
-        # Esto actualiza el registro creado por el trigger con información adicional
-        # Buscamos el registro más reciente (últimos 2 segundos) para ese registro y operación
-        # Usamos una subconsulta para obtener el ID del registro más reciente
-        connection.execute(
-            text("""
-                UPDATE audit_log 
-                SET usuario_id = :user_id,
-                    usuario_email = :user_email,
-                    ip_address = :ip_address,
-                    endpoint = :endpoint
-                WHERE id_audit = (
-                    SELECT id_audit
-                    FROM audit_log
-                    WHERE tabla_nombre = :tabla_nombre
-                        AND registro_id = :registro_id
-                        AND accion = :accion
-                        AND fecha_accion > NOW() - INTERVAL '2 seconds'
-                    ORDER BY fecha_accion DESC
-                    LIMIT 1
-                )
-            """),
-            {
-                'user_id': user_id,
-                'user_email': user_email,
-                'ip_address': ip_address,
-                'endpoint': endpoint,
-                'tabla_nombre': tabla_nombre,
-                'registro_id': registro_id,
-                'accion': operation
-            }
-        )
-        # NO hacer commit aquí - dejar que la transacción principal lo maneje
-    except Exception as e:
-        # No fallar la operación principal si hay error en auditoría
-        # NO hacer rollback aquí - dejar que la transacción principal lo maneje
-        print(f"Error en auditoría: {e}")
-
-# Registrar listeners para cada modelo usando funciones con closure
-def make_listener(op_type):
-    """Crea un listener para un tipo de operación específico."""
-    def listener(mapper, connection, target):
-        try:
-            update_audit_log(connection, target, op_type)
-        except Exception as e:
-            # No fallar la operación principal si hay error en auditoría
-            print(f"Error en listener de auditoría ({op_type}): {e}")
-    return listener
-
-# Registrar listeners para cada modelo
-tables_to_audit = [
-    models.Usuario,
-    models.Cliente,
-    models.Categoria,
-    models.Producto,
-    models.Pedido,
-    models.DetallePedido,
-    models.Carrito,
-    models.DetalleCarrito
-]
-
-for model in tables_to_audit:
-    event.listens_for(model, 'after_insert', propagate=True)(make_listener('INSERT'))
-    event.listens_for(model, 'after_update', propagate=True)(make_listener('UPDATE'))
-    event.listens_for(model, 'after_delete', propagate=True)(make_listener('DELETE'))
+        return int(user_id)
+    except (TypeError, ValueError):
+        logger.warning("id_usuario no válido en el contexto de auditoría: %r", user_id)
+        return None
+
+
+# Equivalente a SET LOCAL app.* en una sola sentencia (un único round-trip).
+# El tercer argumento de set_config (is_local = true) limita el valor a la transacción.
+SET_AUDIT_CONTEXT_SQL = text("""
+    SELECT set_config('app.user_id', :user_id, true),
+           set_config('app.user_email', :user_email, true),
+           set_config('app.ip', :ip_address, true),
+           set_config('app.endpoint', :endpoint, true)
+""")
+
+
+def publicar_contexto_auditoria(db, contexto):
+    """
+    Asocia el contexto de auditoría a la sesión de la request.
+
+    Registra listeners solo sobre esta sesión: la primera escritura de cada
+    transacción (flush del ORM o UPDATE/DELETE/INSERT masivo) publica el contexto
+    como variables de sesión de PostgreSQL. Las transacciones de solo lectura
+    no pagan el round-trip.
+    """
+    if contexto is None or contexto.is_empty():
+        return
+
+    user_id = normalizar_user_id(contexto.user_id)
+    # El trigger interpreta la cadena vacía como NULL
+    params = {
+        'user_id': str(user_id) if user_id is not None else '',
+        'user_email': contexto.user_email or '',
+        'ip_address': contexto.ip_address or '',
+        'endpoint': contexto.endpoint or ''
+    }
+
+    def aplicar_contexto_auditoria(session):
+        # Una sola vez por transacción: SET LOCAL dura hasta el COMMIT/ROLLBACK
+        transaccion = session.get_transaction()
+        if session.info.get("audit_transaccion") is transaccion:
+            return
+        connection = session.connection()
+        # Las variables app.* solo existen en PostgreSQL (los tests usan SQLite)
+        if connection.dialect.name == "postgresql":
+            # Si falla, la transacción queda abortada: se deja propagar el error original
+            connection.execute(SET_AUDIT_CONTEXT_SQL, params)
+        session.info["audit_transaccion"] = transaccion
+
+    def antes_de_flush(session, flush_context, instances):
+        if session.new or session.dirty or session.deleted:
+            aplicar_contexto_auditoria(session)
+
+    def antes_de_ejecutar(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            aplicar_contexto_auditoria(orm_execute_state.session)
+
+    event.listen(db, "before_flush", antes_de_flush)
+    event.listen(db, "do_orm_execute", antes_de_ejecutar)
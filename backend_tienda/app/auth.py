@@ -8,17 +8,26 @@ Includes functions for:
 
 Main dependencies:
 - FastAPI
-- jose
-- passlib
+- PyJWT
+- argon2-cffi
+- bcrypt (legacy hashes)
 """
 
 import os
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import jwt
+from jwt.exceptions import InvalidTokenError
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
+import bcrypt
+from argon2 import PasswordHasher, Type
+from argon2.exceptions import InvalidHashError, VerificationError
 from dotenv import load_dotenv
+from .auth_cache import token_cache_key, get_cached_payload, cache_payload
 
 # Cargar variables de entorno
 load_dotenv()
@@ -29,19 +38,86 @@ if not SECRET_KEY:
     raise ValueError(
         "SECRET_KEY no está configurada. Por favor, configura la variable de entorno SECRET_KEY."
     )
-ALGORITHM = "HS256"
+
+# Valores de ejemplo de la documentación y de los archivos de entorno: nunca deben firmar tokens
+INSECURE_SECRET_KEYS = frozenset({
+    "cambia_esta_clave_por_una_segura",
+    "cambia_esto_por_un_valor_ultra_secreto",
+    "tu-clave-secreta-aqui-minimo-32-caracteres-para-jwt",
+    "your-secret-key-here-min-32-characters",
+})
+if SECRET_KEY in INSECURE_SECRET_KEYS:
+    raise ValueError(
+        "SECRET_KEY tiene un valor de ejemplo. Genera una clave segura, por ejemplo con: "
+        "python -c \"import secrets; print(secrets.token_urlsafe(48))\""
+    )
+
+# Algoritmo de firma de los JWT. HS256 usa SECRET_KEY; los algoritmos asimétricos
+# (EdDSA, ES256, RS256...) firman con JWT_PRIVATE_KEY y verifican con JWT_PUBLIC_KEY (PEM).
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+_jwt_algorithm = jwt.get_algorithm_by_name(ALGORITHM)
+if ALGORITHM.startswith("HS"):
+    _SIGNING_KEY = _VERIFYING_KEY = _jwt_algorithm.prepare_key(SECRET_KEY)
+else:
+    # Las variables de entorno de una sola línea traen los saltos de línea escapados (\n)
+    _private_pem = os.getenv("JWT_PRIVATE_KEY", "").replace("\\n", "\n")
+    _public_pem = os.getenv("JWT_PUBLIC_KEY", "").replace("\\n", "\n")
+    if not _private_pem or not _public_pem:
+        raise ValueError(
+            f"JWT_ALGORITHM={ALGORITHM} requiere JWT_PRIVATE_KEY y JWT_PUBLIC_KEY en formato PEM."
+        )
+    # Las claves se parsean una sola vez, no en cada encode/decode
+    _SIGNING_KEY = _jwt_algorithm.prepare_key(_private_pem)
+    _VERIFYING_KEY = _jwt_algorithm.prepare_key(_public_pem)
+
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+_DEFAULT_TTL_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+# Los tokens solo llevan exp como claim registrado: se exige y se omiten las demás
+# validaciones. Si algún día se emiten aud/iss/nbf/iat, activar aquí su verificación.
+_DECODE_OPTIONS = {
+    "require": ["exp"],
+    "verify_exp": True,
+    "verify_aud": False,
+    "verify_iss": False,
+    "verify_nbf": False,
+    "verify_iat": False,
+}
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-# Configurar CryptContext con bcrypt, deshabilitando la detección automática de bugs
-# que puede causar problemas con algunas versiones de bcrypt
-pwd_context = CryptContext(
-    schemes=["bcrypt"],
-    deprecated="auto",
-    bcrypt__rounds=12
+# Roles con acceso a recursos de cualquier usuario
+_ADMIN_ROLES = frozenset({"admin", "super_admin"})
+
+# Argon2id para hashes nuevos (por defecto la configuración mínima de OWASP: 19 MiB, t=2, p=1).
+# Cada hash en curso reserva ARGON2_MEMORY_COST KiB: la memoria pico es ese valor por
+# PASSWORD_HASH_CONCURRENCY, así que subir cualquiera de los dos exige dimensionar la instancia.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "19456"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+_password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+    hash_len=32,
+    type=Type.ID,
 )
 
+# Hashes y verificaciones simultáneos por proceso. Son CPU pura (argon2-cffi y bcrypt liberan
+# el GIL): más hilos que núcleos no terminan antes, solo compiten y reservan más memoria.
+# Se ejecutan en un pool propio: las versiones async esperan su turno en el event loop, sin
+# ocupar hilos ni tokens del threadpool de las rutas síncronas (THREADPOOL_MAX_WORKERS).
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(os.cpu_count() or 1)))
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="password-hash")
+
+# bcrypt solo usa los primeros 72 bytes de la contraseña (passlib truncaba igual)
+BCRYPT_MAX_BYTES = 72
+
+# Prefijos de las variantes de bcrypt que acepta bcrypt.checkpw (hashes heredados)
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+ARGON2_PREFIX = "$argon2"
+
 def crear_token_de_acceso(data: dict, expires_delta: timedelta = None):
     """
     Generates a JWT access token with expiration.
@@ -54,42 +130,57 @@ def crear_token_de_acceso(data: dict, expires_delta: timedelta = None):
         str: Encoded JWT token.
     """
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    ttl_seconds = int(expires_delta.total_seconds()) if expires_delta else _DEFAULT_TTL_SECONDS
+    to_encode["exp"] = int(time.time()) + ttl_seconds
+    encoded_jwt = jwt.encode(to_encode, _SIGNING_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def verificar_token(token: str):
     """
     Decodes and validates a JWT token.
 
+    Valid payloads are cached for a short time (keyed by the token's SHA-256),
+    so repeated requests with the same token skip the signature check.
+    The token expiration is still checked on every cache hit.
+
     Args:
         token (str): JWT token to verify.
 
     Returns:
         dict | None: Payload if valid, None if invalid or expired.
     """
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    clave = token_cache_key(token)
+    payload = get_cached_payload(clave)
+    if payload is not None:
         return payload
-    except JWTError:
+
+    try:
+        payload = jwt.decode(token, _VERIFYING_KEY, algorithms=[ALGORITHM], options=_DECODE_OPTIONS)
+    except InvalidTokenError:
         return None
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+    cache_payload(clave, payload)
+    return payload
+
+def get_current_user(request: Request, token: str = Depends(oauth2_scheme)):
     """
     Extracts user information from the JWT token.
     Raises an HTTP exception if the token is invalid or expired.
 
+    Reuses the payload that the request middleware already decoded
+    (`request.state.user`) and only verifies the token itself when the
+    middleware did not.
+
     Args:
+        request (Request): Current request.
         token (str): JWT token extracted from the request.
 
     Returns:
         dict: Payload of the authenticated user.
     """
-    payload = verificar_token(token)
+    payload = getattr(request.state, "user", None)
+    if payload is None:
+        payload = verificar_token(token)
     if payload is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -101,6 +192,8 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
 def require_role(required_roles: list[str]):
     """
     Dependency factory that validates the user has one of the required roles.
+
+    Identical role sets share the same checker function.
     
     Args:
         required_roles: List of allowed roles (e.g., ["admin"], ["cliente"], ["admin", "cliente"])
@@ -108,31 +201,29 @@ def require_role(required_roles: list[str]):
     Returns:
         function: Dependency function that validates the role
     """
+    return _role_checker(frozenset(required_roles))
+
+@functools.cache
+def _role_checker(required_roles: frozenset[str]):
+    """Builds (once per role set) the dependency that validates the role."""
+    detail = f"Acceso denegado. Se requiere uno de los roles: {sorted(required_roles)}"
+
     def role_checker(current_user: dict = Depends(get_current_user)):
         user_role = current_user.get("rol")
         if user_role not in required_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"Acceso denegado. Se requiere uno de los roles: {required_roles}"
+                detail=detail
             )
         return current_user
+    role_checker.__name__ = f"role_checker_{'_'.join(sorted(required_roles))}"
     return role_checker
 
-def require_admin():
-    """Dependency that validates the user is an administrator or super administrator."""
-    return require_role(["admin", "super_admin"])
-
-def require_super_admin():
-    """Dependency that validates the user is a super administrator."""
-    return require_role(["super_admin"])
-
-def require_cliente():
-    """Dependency that validates the user is a client."""
-    return require_role(["cliente"])
-
-def require_cliente_or_admin():
-    """Dependency that validates the user is a client, administrator or super administrator."""
-    return require_role(["cliente", "admin", "super_admin"])
+# Dependencias de rol compartidas por todas las rutas: usar Depends(require_admin), sin llamar
+require_admin = require_role(["admin", "super_admin"])
+require_super_admin = require_role(["super_admin"])
+require_cliente = require_role(["cliente"])
+require_cliente_or_admin = require_role(["cliente", "admin", "super_admin"])
 
 def verify_resource_owner(resource_user_id: int, current_user: dict = Depends(get_current_user)):
     """
@@ -148,32 +239,103 @@ def verify_resource_owner(resource_user_id: int, current_user: dict = Depends(ge
     Raises:
         HTTPException: If the user doesn't have permissions
     """
-    user_id = current_user.get("id_usuario")
-    user_role = current_user.get("rol")
+    # Los administradores acceden a cualquier recurso: no hace falta comparar el id
+    if current_user.get("rol") in _ADMIN_ROLES:
+        return current_user
     
-    if user_role not in ["admin", "super_admin"] and user_id != resource_user_id:
+    if current_user.get("id_usuario") != resource_user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="No tienes permisos para acceder a este recurso"
         )
     return current_user
 
+def _hash(password: str) -> str:
+    return _password_hasher.hash(password)
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    if hashed_password.startswith(ARGON2_PREFIX):
+        try:
+            return _password_hasher.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHashError):
+            return False
+    # Hashes heredados de passlib u otras librerías bcrypt: $2a$, $2b$ o $2y$
+    if not hashed_password.startswith(BCRYPT_PREFIXES):
+        return False
+    try:
+        return bcrypt.checkpw(
+            plain_password.encode("utf-8")[:BCRYPT_MAX_BYTES],
+            hashed_password.encode("utf-8")
+        )
+    except ValueError:
+        return False
+
 def hash_password(password: str) -> str:
     """
-    Hashes a plain text password using bcrypt.
+    Hashes a plain text password using Argon2id.
+
+    Runs in the password hashing pool; the calling thread waits for the result.
 
     Args:
         password (str): Plain text password.
 
     Returns:
-        str: Hashed password.
+        str: Hashed password in PHC format ($argon2id$...).
     """
-    return pwd_context.hash(password)
+    return _hash_executor.submit(_hash, password).result()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Checks if a plain text password matches the hashed password.
 
+    Accepts Argon2 hashes and legacy bcrypt hashes. Runs in the password
+    hashing pool; the calling thread waits for the result.
+
+    Args:
+        plain_password (str): Plain text password.
+        hashed_password (str): Hashed password.
+
+    Returns:
+        bool: True if they match, False otherwise (including malformed hashes).
+    """
+    return _hash_executor.submit(_verify, plain_password, hashed_password).result()
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """
+    Tells whether a stored hash should be replaced by a new Argon2id hash.
+
+    Args:
+        hashed_password (str): Stored hash of a password that was just verified.
+
+    Returns:
+        bool: True for legacy bcrypt hashes and for Argon2 hashes with other parameters.
+    """
+    if not hashed_password.startswith(ARGON2_PREFIX):
+        return True
+    try:
+        return _password_hasher.check_needs_rehash(hashed_password)
+    except InvalidHashError:
+        return True
+
+async def hash_password_async(password: str) -> str:
+    """
+    Hashes a password in the password hashing pool without blocking the event loop.
+
+    While the pool is busy the request waits on the event loop, not in a
+    threadpool worker.
+
+    Args:
+        password (str): Plain text password.
+
+    Returns:
+        str: Hashed password.
+    """
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, _hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    Checks a password in the password hashing pool without blocking the event loop.
+
     Args:
         plain_password (str): Plain text password.
         hashed_password (str): Hashed password.
@@ -181,4 +343,6 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Returns:
         bool: True if they match, False otherwise.
     """
-    return pwd_context.verify(plain_password, hashed_password) 
\ No newline at end of file
+    return await asyncio.get_running_loop().run_in_executor(
+        _hash_executor, _verify, plain_password, hashed_password
+    )
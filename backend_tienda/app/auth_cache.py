@@ -0,0 +1,67 @@
+"""
+Cache of already validated JWT payloads.
+
+The same bearer token is sent on many requests while it is valid, so its
+decoded payload is kept for a short time and the signature check is skipped
+on repeated tokens.
+
+Main dependencies:
+- cachetools
+"""
+
+import hashlib
+import threading
+import time
+from cachetools import TTLCache
+
+# La clave es el SHA-256 del token: no se guardan tokens en claro y el tamaño en memoria queda acotado
+TOKEN_CACHE_MAXSIZE = 10_000
+TOKEN_CACHE_TTL = 60
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_MAXSIZE, ttl=TOKEN_CACHE_TTL)
+_token_cache_lock = threading.Lock()
+
+def token_cache_key(token: str) -> bytes:
+    """
+    Returns the cache key of a raw token.
+
+    Args:
+        token (str): JWT token.
+
+    Returns:
+        bytes: SHA-256 digest of the token.
+    """
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+def get_cached_payload(key: bytes):
+    """
+    Returns a copy of the cached payload if it has not expired.
+
+    Args:
+        key (bytes): Key returned by `token_cache_key`.
+
+    Returns:
+        dict | None: Payload copy, or None on a miss or an expired entry.
+    """
+    with _token_cache_lock:
+        payload = _token_cache.get(key)
+        # El TTL de la caché puede ser mayor que la vida restante del token
+        if payload is not None and payload.get("exp", 0) <= time.time():
+            _token_cache.pop(key, None)
+            payload = None
+    return dict(payload) if payload is not None else None
+
+def cache_payload(key: bytes, payload: dict):
+    """
+    Stores a validated payload.
+
+    Args:
+        key (bytes): Key returned by `token_cache_key`.
+        payload (dict): Decoded token payload.
+    """
+    with _token_cache_lock:
+        _token_cache[key] = dict(payload)
+
+def clear_token_cache():
+    """Removes every cached payload."""
+    with _token_cache_lock:
+        _token_cache.clear()
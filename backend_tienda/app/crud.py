@@ -10,15 +10,124 @@ Main dependencies:
 - Local modules: models, schemas, auth
 """
 
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, case, event, exists, insert, literal, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, raiseload, selectinload
 from fastapi import HTTPException
 from typing import Optional
 from . import models, schemas
-from datetime import datetime, timedelta
+from datetime import date, datetime, time, timedelta
 from .auth import hash_password
+import hmac
 import secrets
-import uuid
+import threading
+from cachetools import TTLCache
+
+# Relaciones que serializan los schemas de respuesta (Pedido -> cliente -> usuario, ...).
+# En los listados, selectinload las carga con un SELECT ... IN por nivel en lugar de uno
+# por fila; raiseload("*") hace fallar cualquier otra carga perezosa que se añada sin querer.
+CARGA_CLIENTE = (
+    selectinload(models.Cliente.usuario),
+    raiseload("*"),
+)
+CARGA_PRODUCTO = (
+    selectinload(models.Producto.categoria),
+    raiseload("*"),
+)
+CARGA_PEDIDO = (
+    selectinload(models.Pedido.cliente).selectinload(models.Cliente.usuario),
+    raiseload("*"),
+)
+CARGA_DETALLE_PEDIDO = (
+    selectinload(models.DetallePedido.pedido).selectinload(models.Pedido.cliente).selectinload(models.Cliente.usuario),
+    selectinload(models.DetallePedido.producto).selectinload(models.Producto.categoria),
+    raiseload("*"),
+)
+CARGA_CARRITO = (
+    selectinload(models.Carrito.cliente).selectinload(models.Cliente.usuario),
+    raiseload("*"),
+)
+CARGA_DETALLE_CARRITO = (
+    selectinload(models.DetalleCarrito.carrito).selectinload(models.Carrito.cliente).selectinload(models.Cliente.usuario),
+    selectinload(models.DetalleCarrito.producto).selectinload(models.Producto.categoria),
+    raiseload("*"),
+)
+
+# Consultas de las rutas más frecuentes (login, registro, perfil), construidas una sola vez
+# al importar el módulo. Los valores van en bindparam y se pasan al ejecutar; los objetos
+# Select son inmutables, así que se comparten sin riesgo entre sesiones e hilos.
+SELECT_USUARIO_POR_CORREO = select(models.Usuario).where(models.Usuario.correo == bindparam("correo"))
+SELECT_CLIENTE_POR_USUARIO = select(models.Cliente).where(models.Cliente.id_usuario == bindparam("id_usuario"))
+
+def paginar(query, columna_id, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    """
+    Applies pagination to a query or select.
+
+    With `after_id` it uses keyset pagination (`WHERE id > :after_id ORDER BY id`),
+    which seeks the primary key index instead of scanning and discarding `skip` rows.
+    Without it, the previous OFFSET pagination is kept.
+
+    Args:
+        query: Query or Select to paginate.
+        columna_id: Primary key column that orders the pages.
+        skip (int): Number of records to skip (only without `after_id`).
+        limit (int): Maximum number of records to return.
+        after_id (int, optional): Last ID received by the client.
+
+    Returns:
+        The paginated query or select.
+    """
+    if after_id is not None:
+        return query.where(columna_id > after_id).order_by(columna_id).limit(limit)
+    return query.offset(skip).limit(limit)
+
+def _actualizar_returning(db: Session, modelo, *condiciones, **valores):
+    """
+    Updates a row with a single UPDATE ... RETURNING.
+
+    Replaces the SELECT + UPDATE + refresh SELECT sequence with one round trip.
+    The instance already in the session (if any) is synchronized with the new values.
+
+    Args:
+        db (Session): Database session.
+        modelo: Mapped class to update.
+        *condiciones: WHERE conditions (primary key plus any state precondition).
+        **valores: Column values to set.
+
+    Returns:
+        The updated instance, or None if no row matched the conditions.
+    """
+    return db.execute(
+        update(modelo).where(*condiciones).values(**valores).returning(modelo)
+    ).scalar_one_or_none()
+
+def _crear_actualizador(modelo, columna_id, campos, al_actualizar=None):
+    """
+    Builds the `actualizar_*` function of a model whose update just copies fields.
+
+    The column list and the WHERE clause are resolved once at import time; each call
+    runs a single UPDATE ... RETURNING through `_actualizar_returning`.
 
+    Args:
+        modelo: Mapped class to update.
+        columna_id: Primary key column (e.g. `models.Categoria.id_categoria`).
+        campos (tuple[str, ...]): Schema fields copied to the columns of the same name.
+        al_actualizar (callable, optional): Called with the ID after a row is updated.
+
+    Returns:
+        callable: `(db, id, datos) -> instance | None`.
+    """
+    def actualizar(db: Session, objeto_id: int, datos):
+        db_objeto = _actualizar_returning(
+            db, modelo, columna_id == objeto_id,
+            **{campo: getattr(datos, campo) for campo in campos}
+        )
+        if db_objeto is not None and al_actualizar is not None:
+            al_actualizar(objeto_id)
+        return db_objeto
+    
+    actualizar.__doc__ = f"Updates a {modelo.__name__} row; returns it, or None if not found."
+    return actualizar
 
 def get_usuario(db: Session, usuario_id: int):
     """
@@ -31,7 +140,7 @@ def get_usuario(db: Session, usuario_id: int):
     Returns:
         models.Usuario | None: Found user or None if not found.
     """
-    return db.query(models.Usuario).filter(models.Usuario.id_usuario == usuario_id).first()
+    return db.get(models.Usuario, usuario_id)
 
 def get_usuario_por_correo(db: Session, correo: str):
     """
@@ -44,7 +153,7 @@ def get_usuario_por_correo(db: Session, correo: str):
     Returns:
         models.Usuario | None: Found user or None if not found.
     """
-    return db.query(models.Usuario).filter(models.Usuario.correo == correo).first()
+    return db.execute(SELECT_USUARIO_POR_CORREO, {"correo": correo}).scalar_one_or_none()
 
 def get_usuarios(
     db: Session,
@@ -52,7 +161,8 @@ def get_usuarios(
     limit: int = 100,
     rol: Optional[str] = None,
     correo: Optional[str] = None,
-    email_verificado: Optional[str] = None
+    email_verificado: Optional[str] = None,
+    after_id: Optional[int] = None
 ):
     """
     Retrieves a list of users with optional filters and pagination.
@@ -64,6 +174,7 @@ def get_usuarios(
         rol (str, optional): Filter by role (cliente, admin, super_admin).
         correo (str, optional): Filter by email (partial match).
         email_verificado (str, optional): Filter by email verification status (S, N).
+        after_id (int, optional): Last user ID received; enables keyset pagination.
 
     Returns:
         list[models.Usuario]: List of users matching the filters.
@@ -79,38 +190,102 @@ def get_usuarios(
     if email_verificado:
         query = query.filter(models.Usuario.email_verificado == email_verificado)
     
-    return query.offset(skip).limit(limit).all()
+    return paginar(query, models.Usuario.id_usuario, skip, limit, after_id).all()
 
-def crear_usuario(db: Session, usuario: schemas.UsuarioCreate):
+def _generar_pin() -> str:
+    """
+    Generates a 6-digit PIN with the OS CSPRNG.
+
+    A single randbelow(10**6) call is uniform over 000000-999999 (randbelow uses
+    rejection sampling, so there is no modulo bias) and replaces six per-digit calls.
+
+    Returns:
+        str: Zero-padded 6-digit PIN.
+    """
+    return f"{secrets.randbelow(1_000_000):06d}"
+
+def _pin_coincide(esperado: Optional[str], pin: str) -> bool:
+    """
+    Compares a stored PIN with the submitted one in constant time.
+
+    Args:
+        esperado (str | None): PIN stored for the user.
+        pin (str): PIN submitted by the client.
+
+    Returns:
+        bool: True if a PIN is stored and both match.
+    """
+    if not esperado:
+        return False
+    # Bytes: compare_digest solo acepta str ASCII y el PIN recibido puede no serlo
+    return hmac.compare_digest(esperado.encode("utf-8"), pin.encode("utf-8"))
+
+def _insert_ignorando_conflicto(db: Session, modelo):
+    """
+    Returns the dialect INSERT construct that supports ON CONFLICT DO NOTHING.
+
+    Args:
+        db (Session): Database session.
+        modelo: Mapped class to insert into.
+
+    Returns:
+        Insert: PostgreSQL INSERT in production, SQLite INSERT in the tests.
+    """
+    dialecto = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialecto.insert(modelo)
+
+def crear_usuario(db: Session, usuario: schemas.UsuarioCreate, contraseña_hash: Optional[str] = None):
     """
     Creates a new user in the database with a hashed password and generates a confirmation PIN.
 
     Args:
         db (Session): Database session.
         usuario (schemas.UsuarioCreate): User data to create.
+        contraseña_hash (str, optional): Password hash computed by the caller before
+            touching the database; hashed here if omitted.
 
     Returns:
-        models.Usuario: Created user.
+        models.Usuario | None: Created user, or None if the email is already registered.
     """
     # Generar PIN de confirmación de 6 dígitos
-    pin_confirmacion = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
-    
-    db_usuario = models.Usuario(
-        correo=usuario.correo,
-        contraseña=hash_password(usuario.contraseña),
-        rol=usuario.rol,
-        fecha_creacion=datetime.utcnow(),
-        email_verificado="N",
-        token_confirmacion=pin_confirmacion,
-        token_confirmacion_expira=datetime.utcnow() + timedelta(minutes=15)  # Expira en 15 minutos
-    )
-    db.add(db_usuario)
-    db.commit()
-    db.refresh(db_usuario)
-    return db_usuario
+    pin_confirmacion = _generar_pin()
+    
+    # El índice único de correo resuelve el duplicado en el propio INSERT (sin SELECT previo ni carrera)
+    return db.execute(
+        _insert_ignorando_conflicto(db, models.Usuario)
+        .values(
+            correo=usuario.correo,
+            contraseña=contraseña_hash or hash_password(usuario.contraseña),
+            rol=usuario.rol,
+            email_verificado="N",
+            token_confirmacion=pin_confirmacion,
+            token_confirmacion_expira=datetime.utcnow() + timedelta(minutes=15)  # Expira en 15 minutos
+        )
+        .on_conflict_do_nothing(index_elements=[models.Usuario.correo])
+        .returning(models.Usuario)
+    ).scalar_one_or_none()
+
+def get_clientes(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return paginar(db.query(models.Cliente).options(*CARGA_CLIENTE), models.Cliente.id_cliente, skip, limit, after_id).all()
 
-def get_clientes(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Cliente).offset(skip).limit(limit).all()
+def _get_usuario_y_cliente(db: Session, id_usuario: int):
+    """
+    Checks in one query whether a user exists and whether it already has a client profile.
+
+    Args:
+        db (Session): Database session.
+        id_usuario (int): User ID.
+
+    Returns:
+        Row | None: (id_usuario, id_cliente) with id_cliente None if the user has no
+            client profile, or None if the user doesn't exist.
+    """
+    return db.execute(
+        select(models.Usuario.id_usuario, models.Cliente.id_cliente)
+        .select_from(models.Usuario)
+        .outerjoin(models.Cliente, models.Cliente.id_usuario == models.Usuario.id_usuario)
+        .where(models.Usuario.id_usuario == id_usuario)
+    ).first()
 
 def crear_cliente(db: Session, cliente: schemas.ClienteCreate):
     """
@@ -126,34 +301,35 @@ def crear_cliente(db: Session, cliente: schemas.ClienteCreate):
     Raises:
         HTTPException: If the user doesn't exist or already has a client profile.
     """
-    # Validar que el usuario existe
-    usuario = get_usuario(db, cliente.id_usuario)
-    if not usuario:
-        raise HTTPException(status_code=404, detail=f"Usuario con ID {cliente.id_usuario} no encontrado")
-    
-    # Validar que el usuario no tenga ya un perfil de cliente
-    cliente_existente = get_cliente_por_id_usuario(db, cliente.id_usuario)
-    if cliente_existente:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"El usuario con ID {cliente.id_usuario} ya tiene un perfil de cliente"
-        )
+    # INSERT ... SELECT desde usuarios: el usuario debe existir y el índice único de
+    # id_usuario descarta el segundo perfil de forma atómica, sin SELECT previo
+    columnas = ["id_usuario", "nombre", "apellido", "telefono", "direccion"]
+    origen = select(
+        models.Usuario.id_usuario,
+        literal(cliente.nombre),
+        literal(cliente.apellido),
+        literal(cliente.telefono),
+        literal(cliente.direccion)
+    ).where(models.Usuario.id_usuario == cliente.id_usuario)
+    db_cliente = db.execute(
+        _insert_ignorando_conflicto(db, models.Cliente)
+        .from_select(columnas, origen)
+        .on_conflict_do_nothing(index_elements=[models.Cliente.id_usuario])
+        .returning(models.Cliente)
+    ).scalar_one_or_none()
+    if db_cliente:
+        return db_cliente
     
-    db_cliente = models.Cliente(
-        id_usuario=cliente.id_usuario,
-        nombre=cliente.nombre,
-        apellido=cliente.apellido,
-        telefono=cliente.telefono,
-        direccion=cliente.direccion,
-        fecha_registro=datetime.utcnow()
+    # No se insertó nada: el usuario no existe o ya tiene perfil de cliente
+    if not _get_usuario_y_cliente(db, cliente.id_usuario):
+        raise HTTPException(status_code=404, detail=f"Usuario con ID {cliente.id_usuario} no encontrado")
+    raise HTTPException(
+        status_code=400, 
+        detail=f"El usuario con ID {cliente.id_usuario} ya tiene un perfil de cliente"
     )
-    db.add(db_cliente)
-    db.commit()
-    db.refresh(db_cliente)
-    return db_cliente
 
-def get_categorias(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Categoria).offset(skip).limit(limit).all()
+def get_categorias(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return paginar(db.query(models.Categoria), models.Categoria.id_categoria, skip, limit, after_id).all()
 
 def crear_categoria(db: Session, categoria: schemas.CategoriaCreate):
     db_categoria = models.Categoria(
@@ -163,12 +339,12 @@ def crear_categoria(db: Session, categoria: schemas.CategoriaCreate):
         nombre=categoria.nombre
     )
     db.add(db_categoria)
-    db.commit()
+    db.flush()
     db.refresh(db_categoria)
     return db_categoria
 
-def get_productos(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Producto).offset(skip).limit(limit).all()
+def get_productos(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return paginar(db.query(models.Producto).options(*CARGA_PRODUCTO), models.Producto.id_producto, skip, limit, after_id).all()
 
 def crear_producto(db: Session, producto: schemas.ProductoCreate):
     """
@@ -185,15 +361,16 @@ def crear_producto(db: Session, producto: schemas.ProductoCreate):
         HTTPException: If the category doesn't exist, is inactive, or price/quantity is invalid.
     """
     # Validar que la categoría existe
-    categoria = get_categoria(db, producto.id_categoria)
+    categoria = _get_nombre_estado_categoria(db, producto.id_categoria)
     if not categoria:
         raise HTTPException(status_code=404, detail=f"Categoría con ID {producto.id_categoria} no encontrada")
     
     # Validar que la categoría esté activa
-    if categoria.estado != "activo":
+    nombre_categoria, estado_categoria = categoria
+    if estado_categoria != "activo":
         raise HTTPException(
             status_code=400, 
-            detail=f"No se pueden crear productos en la categoría '{categoria.nombre}' porque está inactiva"
+            detail=f"No se pueden crear productos en la categoría '{nombre_categoria}' porque está inactiva"
         )
     
     # Las validaciones de precio y cantidad ya están en el schema de Pydantic
@@ -209,12 +386,12 @@ def crear_producto(db: Session, producto: schemas.ProductoCreate):
         estado=producto.estado
     )
     db.add(db_producto)
-    db.commit()
+    db.flush()
     db.refresh(db_producto)
     return db_producto
 
-def get_pedidos(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Pedido).offset(skip).limit(limit).all()
+def get_pedidos(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return paginar(db.query(models.Pedido).options(*CARGA_PEDIDO), models.Pedido.id_pedido, skip, limit, after_id).all()
 
 def crear_pedido(db: Session, pedido: schemas.PedidoCreate):
     """
@@ -246,16 +423,86 @@ def crear_pedido(db: Session, pedido: schemas.PedidoCreate):
         id_cliente=pedido.id_cliente,
         estado=pedido.estado,
         direccion_envio=pedido.direccion_envio,
-        fecha_pedido=datetime.utcnow(),
         metodo_pago=pedido.metodo_pago
     )
     db.add(db_pedido)
-    db.commit()
+    db.flush()
     db.refresh(db_pedido)
     return db_pedido
 
-def get_detalles_pedido(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.DetallePedido).offset(skip).limit(limit).all()
+def get_detalles_pedido(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return paginar(db.query(models.DetallePedido).options(*CARGA_DETALLE_PEDIDO), models.DetallePedido.id_detalle, skip, limit, after_id).all()
+
+def _descontar_inventario(db: Session, id_producto: int, cantidad: int, *condiciones):
+    """
+    Atomically deducts inventory from a product if it has enough stock.
+
+    The stock check and the deduction run in a single UPDATE ... RETURNING,
+    which also locks the product row until the transaction ends.
+
+    Args:
+        db (Session): Database session.
+        id_producto (int): Product ID.
+        cantidad (int): Quantity to deduct (negative to return stock).
+        *condiciones: Extra WHERE conditions that must hold for the update.
+
+    Returns:
+        int | None: Remaining quantity, or None if no row matched.
+    """
+    return db.execute(
+        update(models.Producto)
+        .where(
+            models.Producto.id_producto == id_producto,
+            models.Producto.cantidad >= cantidad,
+            *condiciones
+        )
+        .values(cantidad=models.Producto.cantidad - cantidad)
+        .returning(models.Producto.cantidad)
+    ).scalar_one_or_none()
+
+def _validar_detalle_pedido_rechazado(db: Session, id_pedido: int, id_producto: int, cantidad: int):
+    """
+    Raises the HTTPException explaining why the inventory UPDATE matched no row.
+
+    Only runs on the error path, so the happy path stays at one round trip.
+
+    Args:
+        db (Session): Database session.
+        id_pedido (int): Order ID.
+        id_producto (int): Product ID.
+        cantidad (int): Quantity that was requested for the product.
+
+    Raises:
+        HTTPException: 404/400 with the same messages as the individual validations.
+    """
+    pedido = get_pedido(db, id_pedido)
+    if not pedido:
+        raise HTTPException(status_code=404, detail=f"Pedido con ID {id_pedido} no encontrado")
+    
+    producto = get_producto(db, id_producto)
+    if not producto:
+        raise HTTPException(status_code=404, detail=f"Producto con ID {id_producto} no encontrado")
+    
+    if producto.estado != "activo":
+        raise HTTPException(
+            status_code=400,
+            detail=f"El producto '{producto.nombre}' no está disponible (estado: {producto.estado})"
+        )
+    
+    if producto.cantidad < cantidad:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Inventario insuficiente para el producto {producto.nombre}. Disponible: {producto.cantidad}, Solicitado: {cantidad}"
+        )
+    
+    if pedido.estado in ["entregado", "cancelado"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"No se pueden agregar productos a un pedido con estado '{pedido.estado}'"
+        )
+    
+    # Otro pedido cambió el inventario entre el UPDATE y esta comprobación
+    raise HTTPException(status_code=409, detail="El inventario cambió; intenta de nuevo")
 
 def crear_detalle_pedido(db: Session, detalle: schemas.DetallePedidoCreate):
     """
@@ -273,65 +520,120 @@ def crear_detalle_pedido(db: Session, detalle: schemas.DetallePedidoCreate):
         HTTPException: If there's not enough inventory or if pedido/producto doesn't exist.
     """
     try:
-        # Validar que el pedido existe
-        pedido = get_pedido(db, detalle.id_pedido)
-        if not pedido:
-            raise HTTPException(status_code=404, detail=f"Pedido con ID {detalle.id_pedido} no encontrado")
-        
-        # Validar que el producto existe
-        producto = db.query(models.Producto).filter(models.Producto.id_producto == detalle.id_producto).first()
-        if not producto:
-            raise HTTPException(status_code=404, detail=f"Producto con ID {detalle.id_producto} no encontrado")
-        
-        # Validar que el producto esté activo
-        if producto.estado != "activo":
-            raise HTTPException(
-                status_code=400,
-                detail=f"El producto '{producto.nombre}' no está disponible (estado: {producto.estado})"
+        # SAVEPOINT: un error deshace solo esta operación, no la transacción de la request
+        with db.begin_nested():
+            # Descontar inventario y validar producto activo, stock y pedido abierto en una sola
+            # sentencia: el UPDATE bloquea la fila, así dos pedidos simultáneos no sobrevenden
+            pedido_abierto = exists().where(
+                models.Pedido.id_pedido == detalle.id_pedido,
+                models.Pedido.estado.notin_(["entregado", "cancelado"])
             )
-        
-        # Validar inventario suficiente
-        if producto.cantidad < detalle.cantidad:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Inventario insuficiente para el producto {producto.nombre}. Disponible: {producto.cantidad}, Solicitado: {detalle.cantidad}"
+            descontado = _descontar_inventario(
+                db, detalle.id_producto, detalle.cantidad,
+                models.Producto.estado == "activo", pedido_abierto
             )
-        
-        # Validar que el pedido no esté en un estado final
-        if pedido.estado in ["entregado", "cancelado"]:
-            raise HTTPException(
-                status_code=400,
-                detail=f"No se pueden agregar productos a un pedido con estado '{pedido.estado}'"
+            if descontado is None:
+                _validar_detalle_pedido_rechazado(db, detalle.id_pedido, detalle.id_producto, detalle.cantidad)
+            
+            # Las validaciones de cantidad y precio ya están en el schema de Pydantic
+            
+            # Calcular subtotal
+            subtotal = detalle.cantidad * detalle.precio_unitario
+            
+            # Crear detalle de pedido
+            db_detalle = models.DetallePedido(
+                id_pedido=detalle.id_pedido,
+                id_producto=detalle.id_producto,
+                cantidad=detalle.cantidad,
+                precio_unitario=detalle.precio_unitario,
+                subtotal=subtotal
             )
-        
-        # Las validaciones de cantidad y precio ya están en el schema de Pydantic
-        
-        # Calcular subtotal
-        subtotal = detalle.cantidad * detalle.precio_unitario
-        
-        # Crear detalle de pedido
-        db_detalle = models.DetallePedido(
-            id_pedido=detalle.id_pedido,
-            id_producto=detalle.id_producto,
-            cantidad=detalle.cantidad,
-            precio_unitario=detalle.precio_unitario,
-            subtotal=subtotal
-        )
-        
-        # Descontar inventario
-        producto.cantidad -= detalle.cantidad
-        
-        db.add(db_detalle)
-        db.commit()
-        db.refresh(db_detalle)
-        return db_detalle
+            
+            db.add(db_detalle)
+            db.flush()
+            db.refresh(db_detalle)
+            return db_detalle
     except HTTPException:
-        db.rollback()
         raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Error al crear detalle de pedido: {str(e)}")
 
+def crear_detalles_pedido_bulk(db: Session, detalles: list[schemas.DetallePedidoCreate]):
+    """
+    Creates several details of the same order in a single transaction.
+
+    Inventory is deducted with one multi-row UPDATE and the details are
+    inserted with one multi-row INSERT (insertmanyvalues), so an order with
+    M items costs a constant number of round trips instead of several per item.
+
+    Args:
+        db (Session): Database session.
+        detalles (list[schemas.DetallePedidoCreate]): Order details; all must share id_pedido.
+
+    Returns:
+        list[models.DetallePedido]: Created order details, in the same order as `detalles`.
+
+    Raises:
+        HTTPException: If the details belong to different orders, there's not enough
+            inventory or if pedido/producto doesn't exist.
+    """
+    id_pedido = detalles[0].id_pedido
+    if any(detalle.id_pedido != id_pedido for detalle in detalles):
+        raise HTTPException(status_code=400, detail="Todos los detalles deben pertenecer al mismo pedido")
+    
+    # Un mismo producto puede repetirse en varias líneas: se descuenta la suma
+    cantidades = {}
+    for detalle in detalles:
+        cantidades[detalle.id_producto] = cantidades.get(detalle.id_producto, 0) + detalle.cantidad
+    
+    try:
+        # SAVEPOINT: un error deshace solo esta operación, no la transacción de la request
+        with db.begin_nested():
+            pedido_abierto = exists().where(
+                models.Pedido.id_pedido == id_pedido,
+                models.Pedido.estado.notin_(["entregado", "cancelado"])
+            )
+            # CASE id_producto WHEN :id1 THEN :q1 ... END
+            descuento = case(cantidades, value=models.Producto.id_producto)
+            descontados = db.execute(
+                update(models.Producto)
+                .where(
+                    models.Producto.id_producto.in_(list(cantidades)),
+                    models.Producto.estado == "activo",
+                    models.Producto.cantidad >= descuento,
+                    pedido_abierto
+                )
+                .values(cantidad=models.Producto.cantidad - descuento)
+                .returning(models.Producto.id_producto)
+            ).scalars().all()
+            
+            if len(descontados) < len(cantidades):
+                # Los productos rechazados no se tocaron; al lanzar la excepción el SAVEPOINT
+                # deshace los descuentos de los demás
+                for id_producto, cantidad in cantidades.items():
+                    if id_producto not in descontados:
+                        _validar_detalle_pedido_rechazado(db, id_pedido, id_producto, cantidad)
+            
+            filas = [
+                {
+                    "id_pedido": detalle.id_pedido,
+                    "id_producto": detalle.id_producto,
+                    "cantidad": detalle.cantidad,
+                    "precio_unitario": detalle.precio_unitario,
+                    "subtotal": detalle.cantidad * detalle.precio_unitario
+                }
+                for detalle in detalles
+            ]
+            db_detalles = db.scalars(
+                insert(models.DetallePedido).returning(models.DetallePedido, sort_by_parameter_order=True),
+                filas
+            ).all()
+            return db_detalles
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al crear detalles de pedido: {str(e)}")
+
 def actualizar_usuario(db: Session, usuario_id: int, usuario: schemas.UsuarioUpdate, es_super_admin: bool = False):
     """
     Updates a user in the database. Only updates fields that are provided.
@@ -346,42 +648,45 @@ def actualizar_usuario(db: Session, usuario_id: int, usuario: schemas.UsuarioUpd
     Returns:
         models.Usuario | None: Updated user or None if not found.
     """
-    db_usuario = get_usuario(db, usuario_id)
-    if not db_usuario:
-        return None
-    
     # Actualizar solo los campos que se proporcionaron
+    valores = {}
     if usuario.correo is not None:
-        db_usuario.correo = usuario.correo
+        valores["correo"] = usuario.correo
     
     if usuario.contraseña is not None:
-        db_usuario.contraseña = hash_password(usuario.contraseña)
+        valores["contraseña"] = hash_password(usuario.contraseña)
     
     if usuario.rol is not None:
-        db_usuario.rol = usuario.rol
+        valores["rol"] = usuario.rol
     
     # Solo super_admin puede modificar email_verificado
     if es_super_admin and usuario.email_verificado is not None:
-        db_usuario.email_verificado = usuario.email_verificado
+        valores["email_verificado"] = usuario.email_verificado
         # Si se marca como verificado, limpiar tokens de confirmación
         if usuario.email_verificado == "S":
-            db_usuario.token_confirmacion = None
-            db_usuario.token_confirmacion_expira = None
+            valores["token_confirmacion"] = None
+            valores["token_confirmacion_expira"] = None
     
-    db.commit()
-    db.refresh(db_usuario)
-    return db_usuario
+    if not valores:
+        return get_usuario(db, usuario_id)
+    
+    if "correo" in valores or "email_verificado" in valores:
+        # No se conoce el correo anterior: se vacía la caché completa (operación de administración poco frecuente)
+        limpiar_cache_confirmados()
+    
+    return _actualizar_returning(db, models.Usuario, models.Usuario.id_usuario == usuario_id, **valores)
 
 def eliminar_usuario(db: Session, usuario_id: int):
     db_usuario = get_usuario(db, usuario_id)
     if not db_usuario:
         return None
     db.delete(db_usuario)
-    db.commit()
+    db.flush()
+    _olvidar_confirmado(db_usuario.correo)
     return db_usuario
 
 def get_cliente(db: Session, cliente_id: int):
-    return db.query(models.Cliente).filter(models.Cliente.id_cliente == cliente_id).first()
+    return db.get(models.Cliente, cliente_id)
 
 def actualizar_cliente(db: Session, cliente_id: int, cliente: schemas.ClienteCreate):
     """
@@ -404,13 +709,12 @@ def actualizar_cliente(db: Session, cliente_id: int, cliente: schemas.ClienteCre
     
     # Validar que el usuario existe si se está cambiando
     if cliente.id_usuario != db_cliente.id_usuario:
-        usuario = get_usuario(db, cliente.id_usuario)
+        usuario = _get_usuario_y_cliente(db, cliente.id_usuario)
         if not usuario:
             raise HTTPException(status_code=404, detail=f"Usuario con ID {cliente.id_usuario} no encontrado")
         
         # Validar que el nuevo usuario no tenga ya un perfil de cliente
-        cliente_existente = get_cliente_por_id_usuario(db, cliente.id_usuario)
-        if cliente_existente and cliente_existente.id_cliente != cliente_id:
+        if usuario.id_cliente is not None and usuario.id_cliente != cliente_id:
             raise HTTPException(
                 status_code=400,
                 detail=f"El usuario con ID {cliente.id_usuario} ya tiene un perfil de cliente"
@@ -421,7 +725,7 @@ def actualizar_cliente(db: Session, cliente_id: int, cliente: schemas.ClienteCre
     db_cliente.apellido = cliente.apellido
     db_cliente.telefono = cliente.telefono
     db_cliente.direccion = cliente.direccion
-    db.commit()
+    db.flush()
     db.refresh(db_cliente)
     return db_cliente
 
@@ -443,65 +747,108 @@ def eliminar_cliente(db: Session, cliente_id: int):
         HTTPException: Si hay un error al eliminar el cliente.
     """
     try:
-        from sqlalchemy.orm import joinedload
-        
-        # Cargar el cliente con la relación usuario ANTES de eliminar
-        # Esto es necesario porque el schema Cliente requiere el objeto Usuario completo
-        db_cliente = db.query(models.Cliente)\
-            .options(joinedload(models.Cliente.usuario))\
-            .filter(models.Cliente.id_cliente == cliente_id)\
-            .first()
-        
-        if not db_cliente:
-            return None
-        
-        # Separar el objeto de la sesión antes de eliminarlo
-        # Esto mantiene los datos en memoria para la serialización
-        db.expunge(db_cliente)
-        
-        # Ahora eliminamos el cliente (esto también eliminará el usuario por CASCADE)
-        db_cliente_to_delete = db.query(models.Cliente)\
-            .filter(models.Cliente.id_cliente == cliente_id)\
-            .first()
-        
-        if db_cliente_to_delete:
-            db.delete(db_cliente_to_delete)
-            db.commit()
-        
-        # Retornar el objeto expunged que tiene todos los datos en memoria
-        return db_cliente
+        # SAVEPOINT: un error deshace solo esta operación, no la transacción de la request
+        with db.begin_nested():
+            from sqlalchemy.orm import joinedload
+            
+            # Cargar el cliente con la relación usuario ANTES de eliminar
+            # Esto es necesario porque el schema Cliente requiere el objeto Usuario completo
+            db_cliente = db.query(models.Cliente)\
+                .options(joinedload(models.Cliente.usuario))\
+                .filter(models.Cliente.id_cliente == cliente_id)\
+                .first()
+            
+            if not db_cliente:
+                return None
+            
+            # Separar el objeto de la sesión antes de eliminarlo
+            # Esto mantiene los datos en memoria para la serialización
+            db.expunge(db_cliente)
+            
+            # Ahora eliminamos el cliente (esto también eliminará el usuario por CASCADE)
+            db_cliente_to_delete = db.query(models.Cliente)\
+                .filter(models.Cliente.id_cliente == cliente_id)\
+                .first()
+            
+            if db_cliente_to_delete:
+                db.delete(db_cliente_to_delete)
+                db.flush()
+            
+            # Retornar el objeto expunged que tiene todos los datos en memoria
+            return db_cliente
     except Exception as e:
-        db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al eliminar cliente: {str(e)}"
         )
 
 def get_categoria(db: Session, categoria_id: int):
-    return db.query(models.Categoria).filter(models.Categoria.id_categoria == categoria_id).first()
+    return db.get(models.Categoria, categoria_id)
 
-def actualizar_categoria(db: Session, categoria_id: int, categoria: schemas.CategoriaCreate):
-    db_categoria = get_categoria(db, categoria_id)
-    if not db_categoria:
+# Nombre y estado de las categorías ya consultadas, para validar productos sin ir a la BD.
+# Se guardan tuplas y no objetos ORM (no deben compartirse entre sesiones). Cada proceso tiene
+# su propia caché: los cambios hechos desde otro proceso se ven como mucho tras el TTL.
+CATEGORIA_CACHE_MAXSIZE = 4096
+CATEGORIA_CACHE_TTL = 60
+_categoria_cache = TTLCache(maxsize=CATEGORIA_CACHE_MAXSIZE, ttl=CATEGORIA_CACHE_TTL)
+_categoria_cache_lock = threading.Lock()
+
+def _get_nombre_estado_categoria(db: Session, categoria_id: int):
+    """
+    Returns the name and estado of a category, reading through a TTL cache.
+
+    Args:
+        db (Session): Database session.
+        categoria_id (int): Category ID.
+
+    Returns:
+        tuple[str, str] | None: (nombre, estado), or None if the category doesn't exist.
+    """
+    with _categoria_cache_lock:
+        cached = _categoria_cache.get(categoria_id)
+    if cached is not None:
+        return cached
+    
+    fila = db.execute(
+        select(models.Categoria.nombre, models.Categoria.estado)
+        .where(models.Categoria.id_categoria == categoria_id)
+    ).first()
+    if fila is None:
+        # Las categorías inexistentes no se cachean: podrían crearse enseguida
         return None
-    db_categoria.descripcion_corta = categoria.descripcion_corta
-    db_categoria.descripcion_larga = categoria.descripcion_larga
-    db_categoria.estado = categoria.estado
-    db_categoria.nombre = categoria.nombre
-    db.commit()
-    db.refresh(db_categoria)
-    return db_categoria
+    
+    cached = tuple(fila)
+    with _categoria_cache_lock:
+        _categoria_cache[categoria_id] = cached
+    return cached
+
+def _invalidar_categoria(categoria_id: int):
+    """Removes a category from the lookup cache after it changes."""
+    with _categoria_cache_lock:
+        _categoria_cache.pop(categoria_id, None)
+
+def limpiar_cache_categorias():
+    """Removes every cached category."""
+    with _categoria_cache_lock:
+        _categoria_cache.clear()
+
+actualizar_categoria = _crear_actualizador(
+    models.Categoria, models.Categoria.id_categoria,
+    ("descripcion_corta", "descripcion_larga", "estado", "nombre"),
+    al_actualizar=_invalidar_categoria
+)
 
 def eliminar_categoria(db: Session, categoria_id: int):
     db_categoria = get_categoria(db, categoria_id)
     if not db_categoria:
         return None
     db.delete(db_categoria)
-    db.commit()
+    db.flush()
+    _invalidar_categoria(categoria_id)
     return db_categoria
 
 def get_producto(db: Session, producto_id: int):
-    return db.query(models.Producto).filter(models.Producto.id_producto == producto_id).first()
+    return db.get(models.Producto, producto_id)
 
 def actualizar_producto(db: Session, producto_id: int, producto: schemas.ProductoCreate):
     """
@@ -518,31 +865,39 @@ def actualizar_producto(db: Session, producto_id: int, producto: schemas.Product
     Raises:
         HTTPException: If the category doesn't exist or is inactive.
     """
-    db_producto = get_producto(db, producto_id)
-    if not db_producto:
-        return None
+    # La categoría solo se valida si cambia: se condiciona en el propio UPDATE
+    # (misma categoría o categoría activa) y solo se diagnostica si no se actualizó nada
+    misma_o_activa = or_(
+        models.Producto.id_categoria == producto.id_categoria,
+        exists().where(
+            models.Categoria.id_categoria == producto.id_categoria,
+            models.Categoria.estado == "activo"
+        )
+    )
+    db_producto = _actualizar_returning(
+        db, models.Producto, models.Producto.id_producto == producto_id, misma_o_activa,
+        id_categoria=producto.id_categoria,
+        nombre=producto.nombre,
+        descripcion=producto.descripcion,
+        cantidad=producto.cantidad,
+        precio=producto.precio,
+        imagen_url=producto.imagen_url,
+        estado=producto.estado
+    )
+    if db_producto:
+        return db_producto
     
-    # Validar que la categoría existe si se está cambiando
-    if producto.id_categoria != db_producto.id_categoria:
-        categoria = get_categoria(db, producto.id_categoria)
-        if not categoria:
-            raise HTTPException(status_code=404, detail=f"Categoría con ID {producto.id_categoria} no encontrada")
-        if categoria.estado != "activo":
-            raise HTTPException(
-                status_code=400,
-                detail=f"No se puede asignar el producto a la categoría '{categoria.nombre}' porque está inactiva"
-            )
+    if not get_producto(db, producto_id):
+        return None
     
-    db_producto.id_categoria = producto.id_categoria
-    db_producto.nombre = producto.nombre
-    db_producto.descripcion = producto.descripcion
-    db_producto.cantidad = producto.cantidad
-    db_producto.precio = producto.precio
-    db_producto.imagen_url = producto.imagen_url
-    db_producto.estado = producto.estado
-    db.commit()
-    db.refresh(db_producto)
-    return db_producto
+    categoria = _get_nombre_estado_categoria(db, producto.id_categoria)
+    if not categoria:
+        raise HTTPException(status_code=404, detail=f"Categoría con ID {producto.id_categoria} no encontrada")
+    nombre_categoria, _ = categoria
+    raise HTTPException(
+        status_code=400,
+        detail=f"No se puede asignar el producto a la categoría '{nombre_categoria}' porque está inactiva"
+    )
 
 def eliminar_producto(db: Session, producto_id: int):
     """
@@ -562,42 +917,84 @@ def eliminar_producto(db: Session, producto_id: int):
         HTTPException: Si hay un error al eliminar el producto.
     """
     try:
-        from sqlalchemy.orm import joinedload
-        
-        # Cargar el producto con la relación categoria ANTES de eliminar
-        # Esto es necesario porque el schema Producto requiere el objeto Categoria completo
-        db_producto = db.query(models.Producto)\
-            .options(joinedload(models.Producto.categoria))\
-            .filter(models.Producto.id_producto == producto_id)\
-            .first()
-        
-        if not db_producto:
-            return None
-        
-        # Separar el objeto de la sesión antes de eliminarlo
-        # Esto mantiene los datos en memoria para la serialización
-        db.expunge(db_producto)
-        
-        # Ahora eliminamos el producto
-        db_producto_to_delete = db.query(models.Producto)\
-            .filter(models.Producto.id_producto == producto_id)\
-            .first()
-        
-        if db_producto_to_delete:
-            db.delete(db_producto_to_delete)
-            db.commit()
-        
-        # Retornar el objeto expunged que tiene todos los datos en memoria
-        return db_producto
+        # SAVEPOINT: un error deshace solo esta operación, no la transacción de la request
+        with db.begin_nested():
+            from sqlalchemy.orm import joinedload
+            
+            # Cargar el producto con la relación categoria ANTES de eliminar
+            # Esto es necesario porque el schema Producto requiere el objeto Categoria completo
+            db_producto = db.query(models.Producto)\
+                .options(joinedload(models.Producto.categoria))\
+                .filter(models.Producto.id_producto == producto_id)\
+                .first()
+            
+            if not db_producto:
+                return None
+            
+            # Separar el objeto de la sesión antes de eliminarlo
+            # Esto mantiene los datos en memoria para la serialización
+            db.expunge(db_producto)
+            
+            # Ahora eliminamos el producto
+            db_producto_to_delete = db.query(models.Producto)\
+                .filter(models.Producto.id_producto == producto_id)\
+                .first()
+            
+            if db_producto_to_delete:
+                db.delete(db_producto_to_delete)
+                db.flush()
+            
+            # Retornar el objeto expunged que tiene todos los datos en memoria
+            return db_producto
     except Exception as e:
-        db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al eliminar producto: {str(e)}"
         )
 
 def get_pedido(db: Session, pedido_id: int):
-    return db.query(models.Pedido).filter(models.Pedido.id_pedido == pedido_id).first()
+    return db.get(models.Pedido, pedido_id)
+
+def get_pedido_y_propietario(db: Session, pedido_id: int):
+    """
+    Loads an order together with the user that owns it, in one query.
+
+    Replaces the serial get_pedido + get_cliente lookups of the ownership checks.
+    The order stays in the identity map, so the later get_pedido is free.
+
+    Args:
+        db (Session): Database session.
+        pedido_id (int): Order ID.
+
+    Returns:
+        Row | None: (Pedido, id_usuario) with id_usuario None if the client is
+            missing, or None if the order doesn't exist.
+    """
+    return db.execute(
+        select(models.Pedido, models.Cliente.id_usuario)
+        .outerjoin(models.Cliente, models.Cliente.id_cliente == models.Pedido.id_cliente)
+        .where(models.Pedido.id_pedido == pedido_id)
+    ).first()
+
+def get_productos_de_pedido(db: Session, pedido_id: int):
+    """
+    Returns the products of an order's details with a single JOIN.
+
+    Only the products are loaded: the detail rows are not hydrated as ORM objects.
+
+    Args:
+        db (Session): Database session.
+        pedido_id (int): Order ID.
+
+    Returns:
+        list[models.Producto]: One product per detail (repeated if two details share it).
+    """
+    return db.execute(
+        select(models.Producto)
+        .join(models.DetallePedido, models.DetallePedido.id_producto == models.Producto.id_producto)
+        .where(models.DetallePedido.id_pedido == pedido_id)
+        .options(*CARGA_PRODUCTO)
+    ).scalars().all()
 
 def actualizar_pedido(db: Session, pedido_id: int, pedido: schemas.PedidoCreate):
     """
@@ -614,6 +1011,28 @@ def actualizar_pedido(db: Session, pedido_id: int, pedido: schemas.PedidoCreate)
     Raises:
         HTTPException: If the order is in a final state or client doesn't exist.
     """
+    # Validar dirección de envío
+    if pedido.direccion_envio and len(pedido.direccion_envio.strip()) < 5:
+        raise HTTPException(
+            status_code=400,
+            detail="La dirección de envío debe tener al menos 5 caracteres"
+        )
+    
+    # Pedido no final y cliente existente se comprueban en el propio UPDATE;
+    # solo si no se actualizó nada se consulta el motivo
+    db_pedido = _actualizar_returning(
+        db, models.Pedido,
+        models.Pedido.id_pedido == pedido_id,
+        models.Pedido.estado.notin_(["entregado", "cancelado"]),
+        exists().where(models.Cliente.id_cliente == pedido.id_cliente),
+        id_cliente=pedido.id_cliente,
+        estado=pedido.estado,
+        direccion_envio=pedido.direccion_envio,
+        metodo_pago=pedido.metodo_pago
+    )
+    if db_pedido:
+        return db_pedido
+    
     db_pedido = get_pedido(db, pedido_id)
     if not db_pedido:
         return None
@@ -625,26 +1044,7 @@ def actualizar_pedido(db: Session, pedido_id: int, pedido: schemas.PedidoCreate)
             detail=f"No se puede modificar un pedido con estado '{db_pedido.estado}'"
         )
     
-    # Validar que el cliente existe si se está cambiando
-    if pedido.id_cliente != db_pedido.id_cliente:
-        cliente = get_cliente(db, pedido.id_cliente)
-        if not cliente:
-            raise HTTPException(status_code=404, detail=f"Cliente con ID {pedido.id_cliente} no encontrado")
-    
-    # Validar dirección de envío
-    if pedido.direccion_envio and len(pedido.direccion_envio.strip()) < 5:
-        raise HTTPException(
-            status_code=400,
-            detail="La dirección de envío debe tener al menos 5 caracteres"
-        )
-    
-    db_pedido.id_cliente = pedido.id_cliente
-    db_pedido.estado = pedido.estado
-    db_pedido.direccion_envio = pedido.direccion_envio
-    db_pedido.metodo_pago = pedido.metodo_pago
-    db.commit()
-    db.refresh(db_pedido)
-    return db_pedido
+    raise HTTPException(status_code=404, detail=f"Cliente con ID {pedido.id_cliente} no encontrado")
 
 def eliminar_pedido(db: Session, pedido_id: int):
     """
@@ -664,42 +1064,43 @@ def eliminar_pedido(db: Session, pedido_id: int):
         HTTPException: Si hay un error al eliminar el pedido.
     """
     try:
-        from sqlalchemy.orm import joinedload
-        
-        # Cargar el pedido con la relación cliente ANTES de eliminar
-        # Esto es necesario porque el schema Pedido requiere el objeto Cliente completo
-        db_pedido = db.query(models.Pedido)\
-            .options(joinedload(models.Pedido.cliente))\
-            .filter(models.Pedido.id_pedido == pedido_id)\
-            .first()
-        
-        if not db_pedido:
-            return None
-        
-        # Separar el objeto de la sesión antes de eliminarlo
-        # Esto mantiene los datos en memoria para la serialización
-        db.expunge(db_pedido)
-        
-        # Ahora eliminamos el pedido
-        db_pedido_to_delete = db.query(models.Pedido)\
-            .filter(models.Pedido.id_pedido == pedido_id)\
-            .first()
-        
-        if db_pedido_to_delete:
-            db.delete(db_pedido_to_delete)
-            db.commit()
-        
-        # Retornar el objeto expunged que tiene todos los datos en memoria
-        return db_pedido
+        # SAVEPOINT: un error deshace solo esta operación, no la transacción de la request
+        with db.begin_nested():
+            from sqlalchemy.orm import joinedload
+            
+            # Cargar el pedido con la relación cliente ANTES de eliminar
+            # Esto es necesario porque el schema Pedido requiere el objeto Cliente completo
+            db_pedido = db.query(models.Pedido)\
+                .options(joinedload(models.Pedido.cliente))\
+                .filter(models.Pedido.id_pedido == pedido_id)\
+                .first()
+            
+            if not db_pedido:
+                return None
+            
+            # Separar el objeto de la sesión antes de eliminarlo
+            # Esto mantiene los datos en memoria para la serialización
+            db.expunge(db_pedido)
+            
+            # Ahora eliminamos el pedido
+            db_pedido_to_delete = db.query(models.Pedido)\
+                .filter(models.Pedido.id_pedido == pedido_id)\
+                .first()
+            
+            if db_pedido_to_delete:
+                db.delete(db_pedido_to_delete)
+                db.flush()
+            
+            # Retornar el objeto expunged que tiene todos los datos en memoria
+            return db_pedido
     except Exception as e:
-        db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al eliminar pedido: {str(e)}"
         )
 
 def get_detalle_pedido(db: Session, detalle_id: int):
-    return db.query(models.DetallePedido).filter(models.DetallePedido.id_detalle == detalle_id).first()
+    return db.get(models.DetallePedido, detalle_id)
 
 def actualizar_detalle_pedido(db: Session, detalle_id: int, detalle: schemas.DetallePedidoCreate):
     """
@@ -716,51 +1117,59 @@ def actualizar_detalle_pedido(db: Session, detalle_id: int, detalle: schemas.Det
     Raises:
         HTTPException: If product doesn't exist, is inactive, insufficient inventory, or order is in final state.
     """
-    db_detalle = get_detalle_pedido(db, detalle_id)
-    if not db_detalle:
-        return None
-    
-    # Validar que el pedido no esté en un estado final
-    pedido = get_pedido(db, detalle.id_pedido)
-    if pedido and pedido.estado in ["entregado", "cancelado"]:
-        raise HTTPException(
-            status_code=400,
-            detail=f"No se puede modificar un detalle de pedido cuando el pedido está en estado '{pedido.estado}'"
-        )
-    
-    # Validar producto si se está cambiando
-    if detalle.id_producto != db_detalle.id_producto:
-        producto = db.query(models.Producto).filter(models.Producto.id_producto == detalle.id_producto).first()
-        if not producto:
-            raise HTTPException(status_code=404, detail=f"Producto con ID {detalle.id_producto} no encontrado")
-        if producto.estado != "activo":
+    # SAVEPOINT: el ajuste de inventario y el cambio del detalle se confirman o deshacen juntos
+    with db.begin_nested():
+        # Bloquea la fila del detalle: dos actualizaciones simultáneas no pueden calcular la
+        # diferencia de inventario sobre la misma cantidad anterior
+        db_detalle = db.get(models.DetallePedido, detalle_id, with_for_update=True)
+        if not db_detalle:
+            return None
+        
+        # Validar que el pedido no esté en un estado final
+        pedido = get_pedido(db, detalle.id_pedido)
+        if pedido and pedido.estado in ["entregado", "cancelado"]:
             raise HTTPException(
                 status_code=400,
-                detail=f"El producto '{producto.nombre}' no está disponible"
+                detail=f"No se puede modificar un detalle de pedido cuando el pedido está en estado '{pedido.estado}'"
             )
-    
-    # Validar inventario si se está cambiando la cantidad
-    if detalle.cantidad != db_detalle.cantidad:
-        producto = db.query(models.Producto).filter(models.Producto.id_producto == detalle.id_producto).first()
-        if producto:
-            # Calcular cantidad disponible (sumar la cantidad actual del detalle)
-            cantidad_disponible = producto.cantidad + db_detalle.cantidad
-            if cantidad_disponible < detalle.cantidad:
+        
+        # El producto se lee como mucho una vez y se reutiliza en todas las validaciones
+        producto = None
+        
+        # Validar producto si se está cambiando
+        if detalle.id_producto != db_detalle.id_producto:
+            producto = get_producto(db, detalle.id_producto)
+            if not producto:
+                raise HTTPException(status_code=404, detail=f"Producto con ID {detalle.id_producto} no encontrado")
+            if producto.estado != "activo":
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Inventario insuficiente. Disponible: {cantidad_disponible}, Solicitado: {detalle.cantidad}"
+                    detail=f"El producto '{producto.nombre}' no está disponible"
                 )
-            # Actualizar inventario
-            producto.cantidad = cantidad_disponible - detalle.cantidad
-    
-    db_detalle.id_pedido = detalle.id_pedido
-    db_detalle.id_producto = detalle.id_producto
-    db_detalle.cantidad = detalle.cantidad
-    db_detalle.precio_unitario = detalle.precio_unitario
-    db_detalle.subtotal = detalle.cantidad * detalle.precio_unitario
-    db.commit()
-    db.refresh(db_detalle)
-    return db_detalle
+        
+        # Validar inventario si se está cambiando la cantidad
+        if detalle.cantidad != db_detalle.cantidad:
+            # Solo se descuenta la diferencia (negativa si se devuelven unidades), en un UPDATE atómico
+            diferencia = detalle.cantidad - db_detalle.cantidad
+            if _descontar_inventario(db, detalle.id_producto, diferencia) is None:
+                if producto is None:
+                    producto = get_producto(db, detalle.id_producto)
+                if producto:
+                    # Calcular cantidad disponible (sumar la cantidad actual del detalle)
+                    cantidad_disponible = producto.cantidad + db_detalle.cantidad
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Inventario insuficiente. Disponible: {cantidad_disponible}, Solicitado: {detalle.cantidad}"
+                    )
+        
+        db_detalle.id_pedido = detalle.id_pedido
+        db_detalle.id_producto = detalle.id_producto
+        db_detalle.cantidad = detalle.cantidad
+        db_detalle.precio_unitario = detalle.precio_unitario
+        db_detalle.subtotal = detalle.cantidad * detalle.precio_unitario
+        db.flush()
+        db.refresh(db_detalle)
+        return db_detalle
 
 def eliminar_detalle_pedido(db: Session, detalle_id: int):
     """
@@ -780,46 +1189,65 @@ def eliminar_detalle_pedido(db: Session, detalle_id: int):
         HTTPException: Si hay un error al eliminar el detalle.
     """
     try:
-        from sqlalchemy.orm import joinedload
-        
-        # Cargar el detalle con las relaciones pedido y producto ANTES de eliminar
-        db_detalle = db.query(models.DetallePedido)\
-            .options(
-                joinedload(models.DetallePedido.pedido),
-                joinedload(models.DetallePedido.producto)
-            )\
-            .filter(models.DetallePedido.id_detalle == detalle_id)\
-            .first()
-        
-        if not db_detalle:
-            return None
-        
-        # Separar el objeto de la sesión antes de eliminarlo
-        db.expunge(db_detalle)
-        
-        # Ahora eliminamos el detalle
-        db_detalle_to_delete = db.query(models.DetallePedido)\
-            .filter(models.DetallePedido.id_detalle == detalle_id)\
-            .first()
-        
-        if db_detalle_to_delete:
-            db.delete(db_detalle_to_delete)
-            db.commit()
-        
-        # Retornar el objeto expunged que tiene todos los datos en memoria
-        return db_detalle
+        # SAVEPOINT: un error deshace solo esta operación, no la transacción de la request
+        with db.begin_nested():
+            from sqlalchemy.orm import joinedload
+            
+            # Cargar el detalle con las relaciones pedido y producto ANTES de eliminar
+            db_detalle = db.query(models.DetallePedido)\
+                .options(
+                    joinedload(models.DetallePedido.pedido),
+                    joinedload(models.DetallePedido.producto)
+                )\
+                .filter(models.DetallePedido.id_detalle == detalle_id)\
+                .first()
+            
+            if not db_detalle:
+                return None
+            
+            # Separar el objeto de la sesión antes de eliminarlo
+            db.expunge(db_detalle)
+            
+            # Ahora eliminamos el detalle
+            db_detalle_to_delete = db.query(models.DetallePedido)\
+                .filter(models.DetallePedido.id_detalle == detalle_id)\
+                .first()
+            
+            if db_detalle_to_delete:
+                db.delete(db_detalle_to_delete)
+                db.flush()
+            
+            # Retornar el objeto expunged que tiene todos los datos en memoria
+            return db_detalle
     except Exception as e:
-        db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al eliminar detalle de pedido: {str(e)}"
         )
 
-def get_carritos(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Carrito).offset(skip).limit(limit).all()
+def get_carritos(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return paginar(db.query(models.Carrito).options(*CARGA_CARRITO), models.Carrito.id_carrito, skip, limit, after_id).all()
 
 def get_carrito(db: Session, carrito_id: int):
-    return db.query(models.Carrito).filter(models.Carrito.id_carrito == carrito_id).first()
+    return db.get(models.Carrito, carrito_id)
+
+def get_carrito_y_propietario(db: Session, carrito_id: int):
+    """
+    Loads a cart together with the user that owns it, in one query.
+
+    Args:
+        db (Session): Database session.
+        carrito_id (int): Cart ID.
+
+    Returns:
+        Row | None: (Carrito, id_usuario) with id_usuario None if the client is
+            missing, or None if the cart doesn't exist.
+    """
+    return db.execute(
+        select(models.Carrito, models.Cliente.id_usuario)
+        .outerjoin(models.Cliente, models.Cliente.id_cliente == models.Carrito.id_cliente)
+        .where(models.Carrito.id_carrito == carrito_id)
+    ).first()
 
 def crear_carrito(db: Session, carrito: schemas.CarritoCreate):
     """
@@ -842,23 +1270,16 @@ def crear_carrito(db: Session, carrito: schemas.CarritoCreate):
     
     db_carrito = models.Carrito(
         id_cliente=carrito.id_cliente,
-        estado=carrito.estado,
-        fecha_creacion=datetime.utcnow()
+        estado=carrito.estado
     )
     db.add(db_carrito)
-    db.commit()
+    db.flush()
     db.refresh(db_carrito)
     return db_carrito
 
-def actualizar_carrito(db: Session, carrito_id: int, carrito: schemas.CarritoCreate):
-    db_carrito = get_carrito(db, carrito_id)
-    if not db_carrito:
-        return None
-    db_carrito.id_cliente = carrito.id_cliente
-    db_carrito.estado = carrito.estado
-    db.commit()
-    db.refresh(db_carrito)
-    return db_carrito
+actualizar_carrito = _crear_actualizador(
+    models.Carrito, models.Carrito.id_carrito, ("id_cliente", "estado")
+)
 
 def eliminar_carrito(db: Session, carrito_id: int):
     """
@@ -878,45 +1299,66 @@ def eliminar_carrito(db: Session, carrito_id: int):
         HTTPException: Si hay un error al eliminar el carrito.
     """
     try:
-        from sqlalchemy.orm import joinedload
-        
-        # Cargar el carrito con la relación cliente ANTES de eliminar
-        # Esto es necesario porque el schema Carrito requiere el objeto Cliente completo
-        db_carrito = db.query(models.Carrito)\
-            .options(joinedload(models.Carrito.cliente))\
-            .filter(models.Carrito.id_carrito == carrito_id)\
-            .first()
-        
-        if not db_carrito:
-            return None
-        
-        # Separar el objeto de la sesión antes de eliminarlo
-        # Esto mantiene los datos en memoria para la serialización
-        db.expunge(db_carrito)
-        
-        # Ahora eliminamos el carrito
-        db_carrito_to_delete = db.query(models.Carrito)\
-            .filter(models.Carrito.id_carrito == carrito_id)\
-            .first()
-        
-        if db_carrito_to_delete:
-            db.delete(db_carrito_to_delete)
-            db.commit()
-        
-        # Retornar el objeto expunged que tiene todos los datos en memoria
-        return db_carrito
+        # SAVEPOINT: un error deshace solo esta operación, no la transacción de la request
+        with db.begin_nested():
+            from sqlalchemy.orm import joinedload
+            
+            # Cargar el carrito con la relación cliente ANTES de eliminar
+            # Esto es necesario porque el schema Carrito requiere el objeto Cliente completo
+            db_carrito = db.query(models.Carrito)\
+                .options(joinedload(models.Carrito.cliente))\
+                .filter(models.Carrito.id_carrito == carrito_id)\
+                .first()
+            
+            if not db_carrito:
+                return None
+            
+            # Separar el objeto de la sesión antes de eliminarlo
+            # Esto mantiene los datos en memoria para la serialización
+            db.expunge(db_carrito)
+            
+            # Ahora eliminamos el carrito
+            db_carrito_to_delete = db.query(models.Carrito)\
+                .filter(models.Carrito.id_carrito == carrito_id)\
+                .first()
+            
+            if db_carrito_to_delete:
+                db.delete(db_carrito_to_delete)
+                db.flush()
+            
+            # Retornar el objeto expunged que tiene todos los datos en memoria
+            return db_carrito
     except Exception as e:
-        db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al eliminar carrito: {str(e)}"
         )
 
-def get_detalles_carrito(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.DetalleCarrito).offset(skip).limit(limit).all()
+def get_productos_de_carrito(db: Session, carrito_id: int):
+    """
+    Returns the products of a cart's details with a single JOIN.
+
+    Only the products are loaded: the detail rows are not hydrated as ORM objects.
+
+    Args:
+        db (Session): Database session.
+        carrito_id (int): Cart ID.
+
+    Returns:
+        list[models.Producto]: One product per detail (repeated if two details share it).
+    """
+    return db.execute(
+        select(models.Producto)
+        .join(models.DetalleCarrito, models.DetalleCarrito.id_producto == models.Producto.id_producto)
+        .where(models.DetalleCarrito.id_carrito == carrito_id)
+        .options(*CARGA_PRODUCTO)
+    ).scalars().all()
+
+def get_detalles_carrito(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return paginar(db.query(models.DetalleCarrito).options(*CARGA_DETALLE_CARRITO), models.DetalleCarrito.id_detalle_carrito, skip, limit, after_id).all()
 
 def get_detalle_carrito(db: Session, detalle_id: int):
-    return db.query(models.DetalleCarrito).filter(models.DetalleCarrito.id_detalle_carrito == detalle_id).first()
+    return db.get(models.DetalleCarrito, detalle_id)
 
 def crear_detalle_carrito(db: Session, detalle: schemas.DetalleCarritoCreate):
     """
@@ -933,58 +1375,58 @@ def crear_detalle_carrito(db: Session, detalle: schemas.DetalleCarritoCreate):
         HTTPException: If cart/product doesn't exist or insufficient inventory.
     """
     try:
-        # Validar que el carrito existe
-        carrito = get_carrito(db, detalle.id_carrito)
-        if not carrito:
-            raise HTTPException(status_code=404, detail=f"Carrito con ID {detalle.id_carrito} no encontrado")
-        
-        # Validar que el producto existe
-        producto = db.query(models.Producto).filter(models.Producto.id_producto == detalle.id_producto).first()
-        if not producto:
-            raise HTTPException(status_code=404, detail=f"Producto con ID {detalle.id_producto} no encontrado")
-        
-        # Validar que el producto esté activo
-        if producto.estado != "activo":
-            raise HTTPException(
-                status_code=400,
-                detail=f"El producto '{producto.nombre}' no está disponible (estado: {producto.estado})"
-            )
-        
-        # Validar que el carrito esté activo
-        if carrito.estado != "activo":
-            raise HTTPException(
-                status_code=400,
-                detail=f"No se pueden agregar productos a un carrito con estado '{carrito.estado}'"
-            )
-        
-        # Validar inventario suficiente (para carrito, verificamos pero no descontamos aún)
-        if producto.cantidad < detalle.cantidad:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Inventario insuficiente para el producto {producto.nombre}. Disponible: {producto.cantidad}, Solicitado: {detalle.cantidad}"
+        # SAVEPOINT: un error deshace solo esta operación, no la transacción de la request
+        with db.begin_nested():
+            # Validar que el carrito existe
+            carrito = get_carrito(db, detalle.id_carrito)
+            if not carrito:
+                raise HTTPException(status_code=404, detail=f"Carrito con ID {detalle.id_carrito} no encontrado")
+            
+            # Validar que el producto existe
+            producto = get_producto(db, detalle.id_producto)
+            if not producto:
+                raise HTTPException(status_code=404, detail=f"Producto con ID {detalle.id_producto} no encontrado")
+            
+            # Validar que el producto esté activo
+            if producto.estado != "activo":
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"El producto '{producto.nombre}' no está disponible (estado: {producto.estado})"
+                )
+            
+            # Validar que el carrito esté activo
+            if carrito.estado != "activo":
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"No se pueden agregar productos a un carrito con estado '{carrito.estado}'"
+                )
+            
+            # Validar inventario suficiente (para carrito, verificamos pero no descontamos aún)
+            if producto.cantidad < detalle.cantidad:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Inventario insuficiente para el producto {producto.nombre}. Disponible: {producto.cantidad}, Solicitado: {detalle.cantidad}"
+                )
+            
+            # Las validaciones de cantidad y precio ya están en el schema de Pydantic
+            
+            # Calcular subtotal si no se proporciona
+            subtotal = detalle.subtotal if detalle.subtotal else (detalle.cantidad * detalle.precio_unitario)
+            
+            db_detalle = models.DetalleCarrito(
+                id_carrito=detalle.id_carrito,
+                id_producto=detalle.id_producto,
+                cantidad=detalle.cantidad,
+                precio_unitario=detalle.precio_unitario,
+                subtotal=subtotal
             )
-        
-        # Las validaciones de cantidad y precio ya están en el schema de Pydantic
-        
-        # Calcular subtotal si no se proporciona
-        subtotal = detalle.subtotal if detalle.subtotal else (detalle.cantidad * detalle.precio_unitario)
-        
-        db_detalle = models.DetalleCarrito(
-            id_carrito=detalle.id_carrito,
-            id_producto=detalle.id_producto,
-            cantidad=detalle.cantidad,
-            precio_unitario=detalle.precio_unitario,
-            subtotal=subtotal
-        )
-        db.add(db_detalle)
-        db.commit()
-        db.refresh(db_detalle)
-        return db_detalle
+            db.add(db_detalle)
+            db.flush()
+            db.refresh(db_detalle)
+            return db_detalle
     except HTTPException:
-        db.rollback()
         raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Error al crear detalle de carrito: {str(e)}")
 
 def actualizar_detalle_carrito(db: Session, detalle_id: int, detalle: schemas.DetalleCarritoCreate):
@@ -1014,9 +1456,13 @@ def actualizar_detalle_carrito(db: Session, detalle_id: int, detalle: schemas.De
             detail=f"No se puede modificar un detalle de carrito cuando el carrito está en estado '{carrito.estado}'"
         )
     
+    # Un solo SELECT del producto para todas las validaciones
+    producto = None
+    if detalle.id_producto != db_detalle.id_producto or detalle.cantidad != db_detalle.cantidad:
+        producto = get_producto(db, detalle.id_producto)
+    
     # Validar producto si se está cambiando
     if detalle.id_producto != db_detalle.id_producto:
-        producto = db.query(models.Producto).filter(models.Producto.id_producto == detalle.id_producto).first()
         if not producto:
             raise HTTPException(status_code=404, detail=f"Producto con ID {detalle.id_producto} no encontrado")
         if producto.estado != "activo":
@@ -1027,7 +1473,6 @@ def actualizar_detalle_carrito(db: Session, detalle_id: int, detalle: schemas.De
     
     # Validar inventario si se está cambiando la cantidad
     if detalle.cantidad != db_detalle.cantidad:
-        producto = db.query(models.Producto).filter(models.Producto.id_producto == detalle.id_producto).first()
         if producto and producto.cantidad < detalle.cantidad:
             raise HTTPException(
                 status_code=400,
@@ -1039,7 +1484,7 @@ def actualizar_detalle_carrito(db: Session, detalle_id: int, detalle: schemas.De
         # Si se proporciona subtotal, validar que coincida; si no, calcularlo
         if detalle.subtotal:
             calculado = detalle.cantidad * detalle.precio_unitario
-            if abs(detalle.subtotal - calculado) > 0.01:
+            if detalle.subtotal != calculado:
                 raise HTTPException(
                     status_code=400,
                     detail=f"El subtotal debe ser igual a cantidad × precio_unitario ({calculado:.2f})"
@@ -1052,7 +1497,7 @@ def actualizar_detalle_carrito(db: Session, detalle_id: int, detalle: schemas.De
     db_detalle.cantidad = detalle.cantidad
     db_detalle.precio_unitario = detalle.precio_unitario
     db_detalle.subtotal = detalle.subtotal
-    db.commit()
+    db.flush()
     db.refresh(db_detalle)
     return db_detalle
 
@@ -1074,43 +1519,62 @@ def eliminar_detalle_carrito(db: Session, detalle_id: int):
         HTTPException: Si hay un error al eliminar el detalle.
     """
     try:
-        from sqlalchemy.orm import joinedload
-        
-        # Cargar el detalle con las relaciones carrito y producto ANTES de eliminar
-        db_detalle = db.query(models.DetalleCarrito)\
-            .options(
-                joinedload(models.DetalleCarrito.carrito),
-                joinedload(models.DetalleCarrito.producto)
-            )\
-            .filter(models.DetalleCarrito.id_detalle_carrito == detalle_id)\
-            .first()
-        
-        if not db_detalle:
-            return None
-        
-        # Separar el objeto de la sesión antes de eliminarlo
-        db.expunge(db_detalle)
-        
-        # Ahora eliminamos el detalle
-        db_detalle_to_delete = db.query(models.DetalleCarrito)\
-            .filter(models.DetalleCarrito.id_detalle_carrito == detalle_id)\
-            .first()
-        
-        if db_detalle_to_delete:
-            db.delete(db_detalle_to_delete)
-            db.commit()
-        
-        # Retornar el objeto expunged que tiene todos los datos en memoria
-        return db_detalle
+        # SAVEPOINT: un error deshace solo esta operación, no la transacción de la request
+        with db.begin_nested():
+            from sqlalchemy.orm import joinedload
+            
+            # Cargar el detalle con las relaciones carrito y producto ANTES de eliminar
+            db_detalle = db.query(models.DetalleCarrito)\
+                .options(
+                    joinedload(models.DetalleCarrito.carrito),
+                    joinedload(models.DetalleCarrito.producto)
+                )\
+                .filter(models.DetalleCarrito.id_detalle_carrito == detalle_id)\
+                .first()
+            
+            if not db_detalle:
+                return None
+            
+            # Separar el objeto de la sesión antes de eliminarlo
+            db.expunge(db_detalle)
+            
+            # Ahora eliminamos el detalle
+            db_detalle_to_delete = db.query(models.DetalleCarrito)\
+                .filter(models.DetalleCarrito.id_detalle_carrito == detalle_id)\
+                .first()
+            
+            if db_detalle_to_delete:
+                db.delete(db_detalle_to_delete)
+                db.flush()
+            
+            # Retornar el objeto expunged que tiene todos los datos en memoria
+            return db_detalle
     except Exception as e:
-        db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al eliminar detalle de carrito: {str(e)}"
         )
 
 def get_cliente_por_id_usuario(db: Session, id_usuario: int):
-    return db.query(models.Cliente).filter(models.Cliente.id_usuario == id_usuario).first()
+    return db.execute(SELECT_CLIENTE_POR_USUARIO, {"id_usuario": id_usuario}).scalar_one_or_none()
+
+# Columnas de schemas.AuditLog: los logs son de solo lectura, así que se devuelven filas
+# (Row, con acceso por atributo) sin crear objetos ORM ni registrarlos en el identity map
+COLUMNAS_AUDIT_LOG = (
+    models.AuditLog.id_audit,
+    models.AuditLog.tabla_nombre,
+    models.AuditLog.registro_id,
+    models.AuditLog.accion,
+    models.AuditLog.usuario_id,
+    models.AuditLog.usuario_email,
+    models.AuditLog.ip_address,
+    models.AuditLog.endpoint,
+    models.AuditLog.fecha_accion,
+    models.AuditLog.datos_anteriores,
+    models.AuditLog.datos_nuevos,
+    models.AuditLog.cambios,
+    models.AuditLog.metadatos_extra,
+)
 
 def get_audit_logs(
     db: Session,
@@ -1120,36 +1584,82 @@ def get_audit_logs(
     registro_id: Optional[int] = None,
     accion: Optional[str] = None,
     usuario_id: Optional[int] = None,
-    fecha_desde: Optional[datetime] = None,
-    fecha_hasta: Optional[datetime] = None
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    after_id: Optional[int] = None
 ):
     """
     Obtiene logs de auditoría con filtros.
     Solo accesible para administradores.
+    Con after_id (último id_audit recibido) pagina por cursor en lugar de OFFSET.
+    fecha_desde y fecha_hasta aceptan date o datetime; fecha_hasta como date incluye el día completo.
     """
-    from datetime import datetime
-    query = db.query(models.AuditLog)
-    
+    # Los valores viajan como parámetros enlazados: cada combinación de filtros
+    # compila una sola vez y se reutiliza desde la caché de SQL del engine
+    condiciones = []
     if tabla_nombre:
-        query = query.filter(models.AuditLog.tabla_nombre == tabla_nombre)
+        condiciones.append(models.AuditLog.tabla_nombre == tabla_nombre)
     if registro_id:
-        query = query.filter(models.AuditLog.registro_id == registro_id)
+        condiciones.append(models.AuditLog.registro_id == registro_id)
     if accion:
-        query = query.filter(models.AuditLog.accion == accion)
+        condiciones.append(models.AuditLog.accion == accion)
     if usuario_id:
-        query = query.filter(models.AuditLog.usuario_id == usuario_id)
+        condiciones.append(models.AuditLog.usuario_id == usuario_id)
     if fecha_desde:
-        query = query.filter(models.AuditLog.fecha_accion >= fecha_desde)
+        if not isinstance(fecha_desde, datetime):
+            fecha_desde = datetime.combine(fecha_desde, time.min)
+        condiciones.append(models.AuditLog.fecha_accion >= fecha_desde)
     if fecha_hasta:
-        query = query.filter(models.AuditLog.fecha_accion <= fecha_hasta)
+        if isinstance(fecha_hasta, datetime):
+            condiciones.append(models.AuditLog.fecha_accion <= fecha_hasta)
+        else:
+            # Rango semiabierto [.., día siguiente): incluye todo el día y sigue siendo un
+            # rango sobre la columna sin envolverla en DATE(), así que usa los índices
+            condiciones.append(
+                models.AuditLog.fecha_accion < datetime.combine(fecha_hasta + timedelta(days=1), time.min)
+            )
     
-    return query.order_by(models.AuditLog.fecha_accion.desc()).offset(skip).limit(limit).all()
+    # Un solo where() en lugar de un Select nuevo por cada filtro
+    query = select(*COLUMNAS_AUDIT_LOG).where(*condiciones)
+    
+    if after_id is not None:
+        # Cursor: los logs van del más reciente al más antiguo, así que la página
+        # siguiente son los id_audit menores que el último recibido
+        query = query.where(models.AuditLog.id_audit < after_id)\
+            .order_by(models.AuditLog.id_audit.desc()).limit(limit)
+    else:
+        query = query.order_by(models.AuditLog.fecha_accion.desc()).offset(skip).limit(limit)
+    return db.execute(query).all()
 
 
 # ============================================
 # FUNCIONES PARA CONFIRMACIÓN Y RECUPERACIÓN
 # ============================================
 
+# Correos de cuentas ya confirmadas: los reintentos de confirmar_cuenta (doble envío del
+# cliente) responden "ya confirmada" sin consultar la BD. Caché por proceso; solo se añade un
+# correo cuando la confirmación está en la BD (leída o tras el COMMIT).
+CONFIRMADOS_CACHE_MAXSIZE = 10_000
+CONFIRMADOS_CACHE_TTL = 60
+_confirmados_cache = TTLCache(maxsize=CONFIRMADOS_CACHE_MAXSIZE, ttl=CONFIRMADOS_CACHE_TTL)
+_confirmados_cache_lock = threading.Lock()
+
+def _marcar_confirmado(correo: str):
+    """Registra un correo como confirmado en la caché."""
+    with _confirmados_cache_lock:
+        _confirmados_cache[correo] = True
+
+def _olvidar_confirmado(correo: str):
+    """Elimina un correo de la caché de cuentas confirmadas."""
+    with _confirmados_cache_lock:
+        _confirmados_cache.pop(correo, None)
+
+def limpiar_cache_confirmados():
+    """Vacía la caché de cuentas confirmadas."""
+    with _confirmados_cache_lock:
+        _confirmados_cache.clear()
+
+
 def confirmar_cuenta(db: Session, correo: str, pin: str) -> models.Usuario:
     """
     Confirma la cuenta de un usuario usando el correo y PIN de confirmación.
@@ -1165,15 +1675,21 @@ def confirmar_cuenta(db: Session, correo: str, pin: str) -> models.Usuario:
     Raises:
         HTTPException: Si el PIN es inválido, expirado o la cuenta ya está confirmada
     """
+    with _confirmados_cache_lock:
+        confirmado = correo in _confirmados_cache
+    if confirmado:
+        raise HTTPException(status_code=400, detail="La cuenta ya está confirmada")
+    
     usuario = get_usuario_por_correo(db, correo)
     
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     if usuario.email_verificado == "S":
+        _marcar_confirmado(correo)
         raise HTTPException(status_code=400, detail="La cuenta ya está confirmada")
     
-    if not usuario.token_confirmacion or usuario.token_confirmacion != pin:
+    if not _pin_coincide(usuario.token_confirmacion, pin):
         raise HTTPException(status_code=400, detail="PIN de confirmación inválido")
     
     # Validar expiración del PIN
@@ -1183,12 +1699,14 @@ def confirmar_cuenta(db: Session, correo: str, pin: str) -> models.Usuario:
     usuario.email_verificado = "S"
     usuario.token_confirmacion = None  # Invalidar PIN después de usar
     usuario.token_confirmacion_expira = None
-    db.commit()
-    db.refresh(usuario)
+    # Sin refresh: ninguna de las columnas escritas tiene valores generados por la base de datos
+    db.flush()
+    # Si el COMMIT de la request falla, el correo no llega a la caché
+    event.listen(db, "after_commit", lambda session: _marcar_confirmado(correo), once=True)
     return usuario
 
 
-def generar_pin_recuperacion(db: Session, correo: str) -> str:
+def generar_pin_recuperacion(db: Session, correo: str) -> models.Usuario:
     """
     Genera un PIN de 6 dígitos para recuperación de contraseña.
     
@@ -1197,7 +1715,7 @@ def generar_pin_recuperacion(db: Session, correo: str) -> str:
         correo: Correo del usuario
     
     Returns:
-        str: PIN generado
+        models.Usuario: Usuario con el PIN generado en token_reset (evita volver a buscarlo por correo)
     
     Raises:
         HTTPException: Si el usuario no existe
@@ -1211,14 +1729,26 @@ def generar_pin_recuperacion(db: Session, correo: str) -> str:
         )
     
     # Generar PIN de 6 dígitos
-    pin = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
+    pin = _generar_pin()
     
     # Guardar PIN y expiración (15 minutos)
     usuario.token_reset = pin
     usuario.token_reset_expira = datetime.utcnow() + timedelta(minutes=15)
-    db.commit()
+    db.flush()
+    
+    return usuario
+
+
+def _pin_recuperacion_valido(usuario: Optional[models.Usuario], pin: str) -> bool:
+    """Comprueba el PIN de recuperación de un usuario ya cargado (existencia, valor y expiración)."""
+    if not usuario or not usuario.token_reset_expira:
+        return False
+    
+    # La expiración no depende del PIN recibido: se descarta antes de compararlo
+    if datetime.utcnow() > usuario.token_reset_expira:
+        return False
     
-    return pin
+    return _pin_coincide(usuario.token_reset, pin)
 
 
 def validar_pin_recuperacion(db: Session, correo: str, pin: str) -> bool:
@@ -1233,20 +1763,7 @@ def validar_pin_recuperacion(db: Session, correo: str, pin: str) -> bool:
     Returns:
         bool: True si el PIN es válido, False en caso contrario
     """
-    usuario = get_usuario_por_correo(db, correo)
-    if not usuario:
-        return False
-    
-    if not usuario.token_reset or not usuario.token_reset_expira:
-        return False
-    
-    if usuario.token_reset != pin:
-        return False
-    
-    if datetime.utcnow() > usuario.token_reset_expira:
-        return False
-    
-    return True
+    return _pin_recuperacion_valido(get_usuario_por_correo(db, correo), pin)
 
 
 def cambiar_contraseña_con_pin(db: Session, correo: str, pin: str, nueva_contraseña: str) -> models.Usuario:
@@ -1265,18 +1782,18 @@ def cambiar_contraseña_con_pin(db: Session, correo: str, pin: str, nueva_contra
     Raises:
         HTTPException: Si el PIN es inválido o expiró
     """
-    if not validar_pin_recuperacion(db, correo, pin):
+    # Una sola consulta: el usuario validado es el mismo que se actualiza
+    usuario = get_usuario_por_correo(db, correo)
+    if not _pin_recuperacion_valido(usuario, pin):
         raise HTTPException(
             status_code=400,
             detail="PIN inválido o expirado. Solicita un nuevo PIN."
         )
     
-    usuario = get_usuario_por_correo(db, correo)
     usuario.contraseña = hash_password(nueva_contraseña)
     usuario.token_reset = None  # Invalidar PIN después de usar
     usuario.token_reset_expira = None
-    db.commit()
-    db.refresh(usuario)
+    db.flush()
     return usuario
 
 
@@ -1306,12 +1823,27 @@ def cambiar_contraseña_usuario(db: Session, usuario_id: int, contraseña_actual
         raise HTTPException(status_code=400, detail="Contraseña actual incorrecta")
     
     usuario.contraseña = hash_password(nueva_contraseña)
-    db.commit()
-    db.refresh(usuario)
+    db.flush()
     return usuario
 
 
-def regenerar_token_confirmacion(db: Session, correo: str) -> str:
+def actualizar_hash_contraseña(db: Session, usuario_id: int, contraseña_hash: str):
+    """
+    Reemplaza el hash guardado de la contraseña (migración de bcrypt a Argon2id en el login).
+    
+    Args:
+        db: Sesión de base de datos
+        usuario_id: ID del usuario
+        contraseña_hash: Nuevo hash ya calculado
+    """
+    db.execute(
+        update(models.Usuario)
+        .where(models.Usuario.id_usuario == usuario_id)
+        .values(contraseña=contraseña_hash)
+    )
+
+
+def regenerar_token_confirmacion(db: Session, correo: str) -> models.Usuario:
     """
     Regenera el PIN de confirmación para un usuario.
     
@@ -1320,26 +1852,29 @@ def regenerar_token_confirmacion(db: Session, correo: str) -> str:
         correo: Correo del usuario
     
     Returns:
-        str: Nuevo PIN de confirmación de 6 dígitos
+        models.Usuario: Usuario con el nuevo PIN en token_confirmacion (evita volver a buscarlo por correo)
     
     Raises:
         HTTPException: Si el usuario no existe o ya está confirmado
     """
-    usuario = get_usuario_por_correo(db, correo)
-    if not usuario:
-        # Por seguridad, no revelamos si el email existe
-        raise HTTPException(
-            status_code=404,
-            detail="Si el correo existe y no está confirmado, se enviará un nuevo PIN"
-        )
+    # Generar nuevo PIN de 6 dígitos con expiración de 15 minutos.
+    # Un solo UPDATE ... RETURNING: la condición de cuenta no confirmada va en el WHERE
+    usuario = _actualizar_returning(
+        db, models.Usuario,
+        models.Usuario.correo == correo,
+        models.Usuario.email_verificado != "S",
+        token_confirmacion=_generar_pin(),
+        token_confirmacion_expira=datetime.utcnow() + timedelta(minutes=15)
+    )
+    if usuario:
+        return usuario
     
-    if usuario.email_verificado == "S":
+    # Sin fila actualizada: solo entonces se consulta el motivo
+    if get_usuario_por_correo(db, correo):
         raise HTTPException(status_code=400, detail="La cuenta ya está confirmada")
     
-    # Generar nuevo PIN de 6 dígitos con expiración de 15 minutos
-    nuevo_pin = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
-    usuario.token_confirmacion = nuevo_pin
-    usuario.token_confirmacion_expira = datetime.utcnow() + timedelta(minutes=15)
-    db.commit()
-    
-    return nuevo_pin
+    # Por seguridad, no revelamos si el email existe
+    raise HTTPException(
+        status_code=404,
+        detail="Si el correo existe y no está confirmado, se enviará un nuevo PIN"
+    )
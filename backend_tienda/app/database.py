@@ -9,6 +9,7 @@ Database configuration for the application.
 import os
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -31,16 +32,43 @@ max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "5"))
 pool_timeout = int(os.getenv("DB_POOL_TIMEOUT", "30"))
 pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "3600"))  # Reciclar conexiones cada hora
 
+# Opciones comunes a cualquier base de datos
+engine_kwargs = {
+    "pool_pre_ping": True,  # Verificar conexiones antes de usarlas (importante para Aurora)
+    "echo": False,  # Cambiar a True para debug de queries SQL
+    "query_cache_size": 1200,  # Caché de SQL compilado por SQLAlchemy (por defecto 500)
+}
+
+database_url = make_url(SQLALCHEMY_DATABASE_URL)
+
+if database_url.get_backend_name() == "postgresql":
+    # Pool de conexiones optimizado para Aurora
+    engine_kwargs.update(
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        # LIFO: se reutilizan siempre las conexiones más recientes; las sobrantes quedan
+        # inactivas y pool_recycle/pool_pre_ping las renuevan en lugar de rotar por todas
+        pool_use_lifo=True,
+    )
+
+if database_url.get_driver_name() == "psycopg2":
+    # executemany de psycopg2: INSERT multi-VALUES y execute_batch para UPDATE/DELETE
+    engine_kwargs.update(
+        executemany_mode="values_plus_batch",
+        insertmanyvalues_page_size=500,
+        executemany_batch_page_size=500,
+    )
+elif database_url.get_driver_name() == "psycopg":
+    # psycopg 3: preparar en el servidor las sentencias desde su primera repetición
+    engine_kwargs["connect_args"] = {"prepare_threshold": 1}
+
 # Crear engine con configuración de pool optimizada para Aurora
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_size=pool_size,
-    max_overflow=max_overflow,
-    pool_timeout=pool_timeout,
-    pool_recycle=pool_recycle,
-    pool_pre_ping=True,  # Verificar conexiones antes de usarlas (importante para Aurora)
-    echo=False  # Cambiar a True para debug de queries SQL
-)
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# (SQLite, usado en los tests, no acepta las opciones de pool ni de psycopg2)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_kwargs)
+
+# expire_on_commit=False: los objetos devueltos tras el commit no vuelven a hacer
+# SELECT al leer sus atributos (al serializar la respuesta). Cada request usa su propia sesión.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
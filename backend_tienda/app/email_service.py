@@ -8,17 +8,23 @@ Incluye funciones para:
 Dependencias:
 - smtplib (estándar de Python)
 - email (estándar de Python)
+- jinja2 (plantillas en app/templates/emails)
 """
 
+import atexit
+import logging
 import os
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import threading
+from email.message import EmailMessage
 from typing import Optional
 from dotenv import load_dotenv
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuración SMTP desde variables de entorno
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
@@ -26,10 +32,90 @@ SMTP_USER = os.getenv("SMTP_USER")  # Email del remitente
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")  # Clave de aplicación
 SMTP_FROM_EMAIL = os.getenv("SMTP_FROM_EMAIL", SMTP_USER)
 SMTP_FROM_NAME = os.getenv("SMTP_FROM_NAME", "Rosaline Bakery")
+SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_REMITENTE = f"{SMTP_FROM_NAME} <{SMTP_FROM_EMAIL}>"
 
 # URL base del frontend para links
 FRONTEND_URL = os.getenv("FRONTEND_URL", "https://rosalinebakery.me")
 
+# Plantillas compiladas una sola vez al importar el módulo.
+# Autoescape en .html: el nombre lo escribe el usuario y no debe inyectar HTML.
+_plantillas = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates", "emails")),
+    autoescape=select_autoescape(["html"]),
+    keep_trailing_newline=True,
+)
+_CONFIRMACION_HTML = _plantillas.get_template("confirmacion.html")
+_CONFIRMACION_TEXTO = _plantillas.get_template("confirmacion.txt")
+_RECUPERACION_HTML = _plantillas.get_template("recuperacion.html")
+_RECUPERACION_TEXTO = _plantillas.get_template("recuperacion.txt")
+
+
+# Conexión SMTP reutilizada entre envíos del worker: STARTTLS + LOGIN solo al conectar.
+# El lock serializa los envíos (smtplib.SMTP no es seguro entre hilos).
+_smtp_conexion: Optional[smtplib.SMTP] = None
+_smtp_lock = threading.Lock()
+
+
+def _conectar_smtp() -> smtplib.SMTP:
+    """Abre una conexión SMTP autenticada."""
+    servidor = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    try:
+        servidor.starttls()
+        servidor.login(SMTP_USER, SMTP_PASSWORD)
+    except Exception:
+        servidor.close()
+        raise
+    return servidor
+
+
+def _descartar_conexion():
+    """Cierra el socket de la conexión actual sin intentar QUIT (llamar con el lock tomado)."""
+    global _smtp_conexion
+    if _smtp_conexion is not None:
+        _smtp_conexion.close()
+        _smtp_conexion = None
+
+
+def _enviar_mensaje(mensaje: EmailMessage):
+    """
+    Envía un mensaje por la conexión compartida.
+    
+    Si el servidor cerró la conexión inactiva, reconecta y reintenta una vez.
+    """
+    global _smtp_conexion
+    with _smtp_lock:
+        if _smtp_conexion is not None:
+            try:
+                _smtp_conexion.send_message(mensaje)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                _descartar_conexion()
+        
+        _smtp_conexion = _conectar_smtp()
+        try:
+            _smtp_conexion.send_message(mensaje)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            _descartar_conexion()
+            raise
+
+
+def cerrar_conexion_smtp():
+    """Cierra la conexión SMTP compartida (QUIT) si está abierta."""
+    global _smtp_conexion
+    with _smtp_lock:
+        if _smtp_conexion is None:
+            return
+        try:
+            _smtp_conexion.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        finally:
+            _descartar_conexion()
+
+
+atexit.register(cerrar_conexion_smtp)
+
 
 def enviar_email(
     destinatario: str,
@@ -50,36 +136,30 @@ def enviar_email(
         bool: True si se envió correctamente, False en caso contrario
     """
     if not SMTP_USER or not SMTP_PASSWORD:
-        print(f"⚠️  SMTP no configurado. No se puede enviar email a {destinatario}")
+        logger.warning("SMTP no configurado. No se puede enviar email a %s", destinatario)
         return False
     
     try:
-        # Crear mensaje
-        mensaje = MIMEMultipart("alternative")
+        # Crear mensaje (multipart/alternative solo si hay texto plano)
+        mensaje = EmailMessage()
         mensaje["Subject"] = asunto
-        mensaje["From"] = f"{SMTP_FROM_NAME} <{SMTP_FROM_EMAIL}>"
+        mensaje["From"] = SMTP_REMITENTE
         mensaje["To"] = destinatario
         
-        # Agregar cuerpo en texto plano si se proporciona
         if cuerpo_texto:
-            parte_texto = MIMEText(cuerpo_texto, "plain", "utf-8")
-            mensaje.attach(parte_texto)
-        
-        # Agregar cuerpo en HTML
-        parte_html = MIMEText(cuerpo_html, "html", "utf-8")
-        mensaje.attach(parte_html)
+            mensaje.set_content(cuerpo_texto)
+            mensaje.add_alternative(cuerpo_html, subtype="html")
+        else:
+            mensaje.set_content(cuerpo_html, subtype="html")
         
         # Enviar email
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as servidor:
-            servidor.starttls()
-            servidor.login(SMTP_USER, SMTP_PASSWORD)
-            servidor.send_message(mensaje)
+        _enviar_mensaje(mensaje)
         
-        print(f"✅ Email enviado a {destinatario}")
+        logger.info("Email enviado a %s", destinatario)
         return True
     
-    except Exception as e:
-        print(f"❌ Error al enviar email a {destinatario}: {e}")
+    except Exception:
+        logger.exception("Error al enviar email a %s", destinatario)
         return False
 
 
@@ -97,63 +177,8 @@ def enviar_email_confirmacion(destinatario: str, nombre: str, pin: str) -> bool:
     """
     asunto = "Confirma tu cuenta - Rosaline Bakery"
     
-    cuerpo_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ background-color: #d4a574; color: white; padding: 20px; text-align: center; }}
-            .content {{ padding: 20px; background-color: #f9f9f9; }}
-            .pin-box {{ background-color: #fff; border: 2px solid #d4a574; border-radius: 8px; padding: 20px; text-align: center; margin: 20px 0; }}
-            .pin {{ font-size: 32px; font-weight: bold; color: #d4a574; letter-spacing: 8px; font-family: 'Courier New', monospace; }}
-            .footer {{ text-align: center; padding: 20px; color: #666; font-size: 12px; }}
-            .warning {{ background-color: #fff3cd; border-left: 4px solid #ffc107; padding: 10px; margin: 15px 0; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🍪 Rosaline Bakery</h1>
-            </div>
-            <div class="content">
-                <h2>¡Bienvenido, {nombre}!</h2>
-                <p>Gracias por registrarte en Rosaline Bakery. Para completar tu registro, ingresa el siguiente PIN de confirmación en la página de registro:</p>
-                <div class="pin-box">
-                    <p style="margin: 0 0 10px 0; color: #666;">Tu PIN de confirmación:</p>
-                    <div class="pin">{pin}</div>
-                </div>
-                <div class="warning">
-                    <strong>⚠️ Importante:</strong> Este PIN expirará en 15 minutos. Si no lo usas a tiempo, puedes solicitar uno nuevo.
-                </div>
-                <p>Ingresa este PIN en la página donde te registraste para confirmar tu cuenta.</p>
-                <p>Si no creaste esta cuenta, puedes ignorar este correo.</p>
-            </div>
-            <div class="footer">
-                <p>© 2025 Rosaline Bakery. Todos los derechos reservados.</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    cuerpo_texto = f"""
-    ¡Bienvenido, {nombre}!
-    
-    Gracias por registrarte en Rosaline Bakery. Para completar tu registro, ingresa el siguiente PIN de confirmación en la página de registro:
-    
-    PIN: {pin}
-    
-    Este PIN expirará en 15 minutos. Si no lo usas a tiempo, puedes solicitar uno nuevo.
-    
-    Ingresa este PIN en la página donde te registraste para confirmar tu cuenta.
-    
-    Si no creaste esta cuenta, puedes ignorar este correo.
-    
-    © 2025 Rosaline Bakery. Todos los derechos reservados.
-    """
+    cuerpo_html = _CONFIRMACION_HTML.render(nombre=nombre, pin=pin)
+    cuerpo_texto = _CONFIRMACION_TEXTO.render(nombre=nombre, pin=pin)
     
     return enviar_email(destinatario, asunto, cuerpo_html, cuerpo_texto)
 
@@ -172,61 +197,8 @@ def enviar_email_recuperacion(destinatario: str, nombre: str, pin: str) -> bool:
     """
     asunto = "Recuperación de contraseña - Rosaline Bakery"
     
-    cuerpo_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ background-color: #d4a574; color: white; padding: 20px; text-align: center; }}
-            .content {{ padding: 20px; background-color: #f9f9f9; }}
-            .pin-box {{ background-color: #fff; border: 2px solid #d4a574; padding: 20px; text-align: center; margin: 20px 0; border-radius: 5px; }}
-            .pin {{ font-size: 32px; font-weight: bold; color: #d4a574; letter-spacing: 10px; }}
-            .footer {{ text-align: center; padding: 20px; color: #666; font-size: 12px; }}
-            .warning {{ background-color: #fff3cd; border-left: 4px solid #ffc107; padding: 10px; margin: 20px 0; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🔐 Recuperación de Contraseña</h1>
-            </div>
-            <div class="content">
-                <h2>Hola, {nombre}</h2>
-                <p>Recibimos una solicitud para restablecer la contraseña de tu cuenta. Usa el siguiente PIN para continuar:</p>
-                <div class="pin-box">
-                    <div class="pin">{pin}</div>
-                </div>
-                <div class="warning">
-                    <strong>⚠️ Importante:</strong> Este PIN expirará en 15 minutos. Si no solicitaste este cambio, ignora este correo.
-                </div>
-                <p>Ingresa este PIN en la página de recuperación de contraseña para continuar.</p>
-            </div>
-            <div class="footer">
-                <p>© 2025 Rosaline Bakery. Todos los derechos reservados.</p>
-                <p>Por seguridad, nunca compartas este PIN con nadie.</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    cuerpo_texto = f"""
-    Hola, {nombre}
-    
-    Recibimos una solicitud para restablecer la contraseña de tu cuenta. Usa el siguiente PIN para continuar:
-    
-    PIN: {pin}
-    
-    ⚠️ IMPORTANTE: Este PIN expirará en 15 minutos. Si no solicitaste este cambio, ignora este correo.
-    
-    Ingresa este PIN en la página de recuperación de contraseña para continuar.
-    
-    © 2025 Rosaline Bakery. Todos los derechos reservados.
-    Por seguridad, nunca compartas este PIN con nadie.
-    """
+    cuerpo_html = _RECUPERACION_HTML.render(nombre=nombre, pin=pin)
+    cuerpo_texto = _RECUPERACION_TEXTO.render(nombre=nombre, pin=pin)
     
     return enviar_email(destinatario, asunto, cuerpo_html, cuerpo_texto)
 
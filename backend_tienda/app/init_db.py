@@ -0,0 +1,36 @@
+"""
+Creación de tablas para desarrollo, fuera del arranque de los workers.
+
+Uso (una sola vez, desde backend_tienda):
+    python -m app.init_db
+
+En producción el esquema se gestiona con `alembic upgrade head`; si la base de datos
+ya tiene la tabla alembic_version no se crea nada.
+"""
+
+import logging
+
+from sqlalchemy import inspect
+
+from . import models
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+
+def crear_tablas(bind=engine) -> bool:
+    """Crea las tablas de los modelos si la base de datos no está gestionada por Alembic.
+
+    Devuelve True si se ejecutó create_all.
+    """
+    if "alembic_version" in inspect(bind).get_table_names():
+        logger.info("La base de datos usa migraciones de Alembic: no se crean tablas")
+        return False
+    models.Base.metadata.create_all(bind=bind)
+    logger.warning("Tablas creadas automáticamente. En producción, usa 'alembic upgrade head'")
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    crear_tablas()
@@ -6,43 +6,42 @@ FastAPI application entry point.
 - Main dependencies: FastAPI, SQLAlchemy, local modules (models, schemas, crud, auth, database)
 """
 
+import logging
 import os
-from fastapi import FastAPI, Depends, HTTPException, Body, Request, Query, Path, status
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import anyio
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Body, Request, Query, Path, status
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
-from typing import Optional
-from datetime import datetime
+from typing import Optional, Union
+from datetime import date, datetime
 from . import models, schemas, crud
-from .database import SessionLocal, engine
-from .auth import crear_token_de_acceso, get_current_user, verify_password, require_admin, require_super_admin, require_cliente_or_admin, verify_resource_owner, verificar_token
-from .audit import set_audit_context, clear_audit_context
+from .database import SessionLocal
+from .auth import crear_token_de_acceso, get_current_user, hash_password, hash_password_async, password_needs_rehash, verify_password_async, require_admin, require_super_admin, require_cliente_or_admin, verify_resource_owner, verificar_token
+from .audit import set_audit_context, clear_audit_context, get_audit_context, publicar_contexto_auditoria
 
 # Cargar variables de entorno
 load_dotenv()
 
-# En producción, usar migraciones de Alembic en lugar de create_all()
-# Solo crear tablas automáticamente en desarrollo si no hay migraciones
-ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
-if ENVIRONMENT == "development":
-    # Solo en desarrollo: crear tablas si no existen
-    # En producción, siempre usar: alembic upgrade head
+logger = logging.getLogger(__name__)
+
+# Las tablas se crean con `alembic upgrade head` o, en desarrollo, con `python -m app.init_db`.
+# AUTO_CREATE_TABLES=true lo hace al importar la app (cada worker inspecciona la BD al arrancar).
+if os.getenv("AUTO_CREATE_TABLES", "false").lower() in ("1", "true", "yes"):
+    from .init_db import crear_tablas
     try:
-        # Verificar si existe la tabla de versiones de Alembic
-        from sqlalchemy import inspect
-        inspector = inspect(engine)
-        if "alembic_version" not in inspector.get_table_names():
-            # Si no hay migraciones, crear tablas (solo desarrollo)
-            models.Base.metadata.create_all(bind=engine)
-            print("Advertencia: Tablas creadas automáticamente. En producción, usa 'alembic upgrade head'")
+        crear_tablas()
     except Exception as e:
-        print(f"Advertencia: No se pudieron crear las tablas automáticamente: {e}")
-        print("En producción, asegúrate de ejecutar: alembic upgrade head")
-
-# Importar audit para registrar los event listeners
-from . import audit  # noqa: F401
+        logger.warning(
+            "No se pudieron crear las tablas automáticamente: %s. "
+            "En producción, asegúrate de ejecutar: alembic upgrade head", e
+        )
 
 # Configuración de metadatos para Swagger/OpenAPI
 tags_metadata = [
@@ -84,6 +83,19 @@ tags_metadata = [
     },
 ]
 
+# Hilos del threadpool de AnyIO: ahí corren las rutas síncronas (sesión de BD).
+# El hash de contraseñas usa su propio pool (auth.PASSWORD_HASH_CONCURRENCY)
+THREADPOOL_MAX_WORKERS = int(os.getenv("THREADPOOL_MAX_WORKERS", "64"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Configura el threadpool al arrancar la aplicación y cierra la conexión SMTP al apagarla."""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_MAX_WORKERS
+    yield
+    # QUIT ordenado de la conexión SMTP reutilizada (puede esperar al servidor: fuera del event loop)
+    from . import email_service
+    await run_in_threadpool(email_service.cerrar_conexion_smtp)
+
 app = FastAPI(
     title="API Rosaline Bakery",
     description="""
@@ -124,6 +136,7 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
     openapi_url="/openapi.json",
+    lifespan=lifespan,
 )
 
 # Configurar CORS desde variables de entorno
@@ -139,14 +152,44 @@ else:
     # Con orígenes específicos, se pueden usar credenciales
     ALLOW_CREDENTIALS = True
 
+# Métodos que expone la API y cabeceras que envía el frontend (las simples de CORS ya están permitidas)
+CORS_ALLOW_METHODS = ["GET", "POST", "PUT", "DELETE"]
+CORS_ALLOW_HEADERS = ["Authorization", "Content-Type"]
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ORIGINS,
     allow_credentials=ALLOW_CREDENTIALS,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=CORS_ALLOW_METHODS,
+    allow_headers=CORS_ALLOW_HEADERS,
 )
 
+# Cabeceras CORS de las respuestas de error construidas en los exception handlers,
+# calculadas una sola vez; el origen se comprueba contra un conjunto
+_CORS_PERMITE_TODOS = CORS_ORIGINS == ["*"]
+_CORS_ORIGENES = frozenset(CORS_ORIGINS)
+_CORS_CABECERAS_FIJAS = {
+    "Access-Control-Allow-Methods": ", ".join(CORS_ALLOW_METHODS),
+    "Access-Control-Allow-Headers": ", ".join(CORS_ALLOW_HEADERS),
+}
+
+def cabeceras_cors(request: Request) -> dict:
+    """Cabeceras CORS para una respuesta construida fuera de CORSMiddleware (vacías si el origen no está permitido)."""
+    origin = request.headers.get("origin")
+    if not origin:
+        return {}
+    if _CORS_PERMITE_TODOS:
+        return {"Access-Control-Allow-Origin": "*", **_CORS_CABECERAS_FIJAS}
+    if origin not in _CORS_ORIGENES:
+        return {}
+    headers = {"Access-Control-Allow-Origin": origin, "Vary": "Origin", **_CORS_CABECERAS_FIJAS}
+    if ALLOW_CREDENTIALS:
+        headers["Access-Control-Allow-Credentials"] = "true"
+    return headers
+
+# Comprimir respuestas JSON de 1 KB o más (listados de productos, pedidos, carritos)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Configurar esquema de seguridad para Swagger
 def custom_openapi():
     if app.openapi_schema:
@@ -207,20 +250,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
             "type": error_type
         })
     
-    # Obtener el origen de la request para CORS
-    origin = request.headers.get("origin")
-    headers = {}
-    
-    # Si hay un origen y está en la lista permitida, agregar headers CORS
-    if origin:
-        if CORS_ORIGINS == ["*"]:
-            headers["Access-Control-Allow-Origin"] = "*"
-        elif origin in CORS_ORIGINS:
-            headers["Access-Control-Allow-Origin"] = origin
-            if ALLOW_CREDENTIALS:
-                headers["Access-Control-Allow-Credentials"] = "true"
-        headers["Access-Control-Allow-Methods"] = "*"
-        headers["Access-Control-Allow-Headers"] = "*"
+    headers = cabeceras_cors(request)
     
     return JSONResponse(
         status_code=422,
@@ -242,20 +272,7 @@ async def global_exception_handler(request: Request, exc: Exception):
     print(f"Error no controlado: {exc}")
     print(traceback.format_exc())
     
-    # Obtener el origen de la request para CORS
-    origin = request.headers.get("origin")
-    headers = {}
-    
-    # Si hay un origen y está en la lista permitida, agregar headers CORS
-    if origin:
-        if CORS_ORIGINS == ["*"]:
-            headers["Access-Control-Allow-Origin"] = "*"
-        elif origin in CORS_ORIGINS:
-            headers["Access-Control-Allow-Origin"] = origin
-            if ALLOW_CREDENTIALS:
-                headers["Access-Control-Allow-Credentials"] = "true"
-        headers["Access-Control-Allow-Methods"] = "*"
-        headers["Access-Control-Allow-Headers"] = "*"
+    headers = cabeceras_cors(request)
     
     return JSONResponse(
         status_code=500,
@@ -293,12 +310,19 @@ def health_check():
         "service": "backend-tienda"
     }
 
+class RequestSession:
+    """Sesión de BD de una request: se abre al primer Depends(get_db) y la cierra el middleware."""
+    __slots__ = ("db",)
+
+    def __init__(self):
+        self.db = None
+
+# Cada request (tarea asyncio) ve su propio contenedor de sesión
+_request_session: ContextVar[Optional[RequestSession]] = ContextVar("request_session", default=None)
+
 @app.middleware("http")
 async def audit_middleware(request: Request, call_next):
-    """Middleware para capturar contexto de auditoría."""
-    # Limpiar contexto anterior
-    clear_audit_context()
-    
+    """Middleware para capturar contexto de auditoría y confirmar y cerrar la sesión de BD de la request."""
     # Obtener información de la request
     ip_address = request.client.host if request.client else None
     endpoint = f"{request.method} {request.url.path}"
@@ -306,6 +330,8 @@ async def audit_middleware(request: Request, call_next):
     # Intentar obtener usuario del token si existe
     user_id = None
     user_email = None
+    # get_current_user reutiliza este payload en lugar de volver a verificar el token
+    request.state.user = None
     
     try:
         # Solo si el endpoint requiere autenticación
@@ -315,33 +341,56 @@ async def audit_middleware(request: Request, call_next):
                 token = auth_header.replace("Bearer ", "")
                 payload = verificar_token(token)
                 if payload:
+                    request.state.user = payload
                     user_id = payload.get("id_usuario")
                     user_email = payload.get("sub")
     except:
         pass  # Si falla, continuar sin contexto de usuario
     
-    # Establecer contexto
-    set_audit_context(
+    # Establecer contexto (ContextVar: aislado por request, sin estado global compartido)
+    token = set_audit_context(
         user_id=user_id,
         user_email=user_email,
         ip_address=ip_address,
         endpoint=endpoint
     )
     
-    # Continuar con la request
-    response = await call_next(request)
+    request_session = RequestSession()
+    session_token = _request_session.set(request_session)
     
-    # Limpiar contexto después de la request
-    clear_audit_context()
-    
-    return response
-
-def get_db():
-    db = SessionLocal()
     try:
-        yield db
+        response = await call_next(request)
+        # Un único COMMIT por request: las funciones de crud solo hacen flush.
+        # Las respuestas de error no confirman nada (close() hace ROLLBACK).
+        if request_session.db is not None and response.status_code < 400:
+            try:
+                await run_in_threadpool(request_session.db.commit)
+            except Exception as exc:
+                response = await global_exception_handler(request, exc)
+        return response
     finally:
-        db.close()
+        # Restaurar el contexto anterior al terminar la request
+        clear_audit_context(token)
+        _request_session.reset(session_token)
+        # close() devuelve la conexión al pool (ROLLBACK incluido): fuera del event loop
+        if request_session.db is not None:
+            await run_in_threadpool(request_session.db.close)
+
+async def get_db():
+    """
+    Devuelve la sesión de BD de la request actual, abriéndola en el primer uso.
+
+    Todas las dependencias de la request comparten la misma sesión; el COMMIT y el cierre
+    los hace audit_middleware al terminar, así que no hace falta un generador por dependencia.
+    """
+    request_session = _request_session.get()
+    if request_session is None:
+        raise RuntimeError("get_db solo se puede usar dentro de una request HTTP")
+    if request_session.db is None:
+        request_session.db = SessionLocal()
+        # Publicar el contexto de auditoría en las transacciones de esta sesión
+        publicar_contexto_auditoria(request_session.db, get_audit_context())
+    return request_session.db
 
 @app.post(
     "/usuarios/", 
@@ -355,7 +404,7 @@ def get_db():
         422: {"description": "Error de validación"}
     }
 )
-def crear_usuario(usuario: schemas.UsuarioCreate, db: Session = Depends(get_db)):
+def crear_usuario(usuario: schemas.UsuarioCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """
     Crea un nuevo usuario y envía email de confirmación con PIN.
     
@@ -364,11 +413,15 @@ def crear_usuario(usuario: schemas.UsuarioCreate, db: Session = Depends(get_db))
     
     El usuario se crea con rol "cliente" por defecto.
     """
-    db_usuario = crud.get_usuario_por_correo(db, correo=usuario.correo)
-    if db_usuario:
-        raise HTTPException(status_code=400, detail="Correo ya registrado")
+    # Argon2id (decenas de ms de CPU) antes de la primera consulta: la sesión toma la conexión del
+    # pool en su primera consulta y la retendría, inactiva, mientras se calcula el hash
+    contraseña_hash = hash_password(usuario.contraseña)
     
-    nuevo_usuario = crud.crear_usuario(db=db, usuario=usuario)
+    nuevo_usuario = crud.crear_usuario(db=db, usuario=usuario, contraseña_hash=contraseña_hash)
+    if nuevo_usuario is None:
+        raise HTTPException(status_code=400, detail="Correo ya registrado")
+    # Confirmar antes de enviar el correo: el PIN enviado debe existir en la BD
+    db.commit()
     
     # Enviar email de confirmación con PIN
     from . import email_service
@@ -378,7 +431,9 @@ def crear_usuario(usuario: schemas.UsuarioCreate, db: Session = Depends(get_db))
     if cliente:
         nombre = f"{cliente.nombre} {cliente.apellido}"
     
-    email_service.enviar_email_confirmacion(
+    # El envío SMTP se hace después de responder
+    background_tasks.add_task(
+        email_service.enviar_email_confirmacion,
         destinatario=nuevo_usuario.correo,
         nombre=nombre,
         pin=nuevo_usuario.token_confirmacion
@@ -400,7 +455,7 @@ def crear_usuario(usuario: schemas.UsuarioCreate, db: Session = Depends(get_db))
 )
 def crear_cliente(
     cliente: schemas.ClienteCreate, 
-    current_user: dict = Depends(require_cliente_or_admin()),
+    current_user: dict = Depends(require_cliente_or_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -435,7 +490,8 @@ def crear_cliente(
 def listar_clientes(
     skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
     limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
-    current_user: dict = Depends(require_admin()),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -443,7 +499,7 @@ def listar_clientes(
     
     **Solo accesible para administradores.**
     """
-    return crud.get_clientes(db, skip=skip, limit=limit)
+    return crud.get_clientes(db, skip=skip, limit=limit, after_id=after_id)
 
 @app.get(
     "/clientes/usuario/{id_usuario}",
@@ -529,7 +585,7 @@ def obtener_cliente(
 )
 def crear_categoria(
     categoria: schemas.CategoriaCreate, 
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -549,6 +605,7 @@ def crear_categoria(
 def listar_categorias(
     skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
     limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     db: Session = Depends(get_db)
 ):
     """
@@ -556,7 +613,7 @@ def listar_categorias(
     
     Este endpoint es **público** y no requiere autenticación.
     """
-    return crud.get_categorias(db, skip=skip, limit=limit)
+    return crud.get_categorias(db, skip=skip, limit=limit, after_id=after_id)
 
 @app.get(
     "/categorias/{categoria_id}",
@@ -597,7 +654,7 @@ def obtener_categoria(
 )
 def crear_producto(
     producto: schemas.ProductoCreate, 
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -617,6 +674,7 @@ def crear_producto(
 def listar_productos(
     skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
     limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     db: Session = Depends(get_db)
 ):
     """
@@ -624,7 +682,7 @@ def listar_productos(
     
     Este endpoint es **público** y no requiere autenticación.
     """
-    return crud.get_productos(db, skip=skip, limit=limit)
+    return crud.get_productos(db, skip=skip, limit=limit, after_id=after_id)
 
 @app.get(
     "/productos/{producto_id}",
@@ -665,7 +723,7 @@ def obtener_producto(
 )
 def crear_pedido(
     pedido: schemas.PedidoCreate, 
-    current_user: dict = Depends(require_cliente_or_admin()),
+    current_user: dict = Depends(require_cliente_or_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -704,6 +762,7 @@ def crear_pedido(
 def listar_pedidos(
     skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
     limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -717,18 +776,17 @@ def listar_pedidos(
     
     # Si es admin o super_admin, devolver todos los pedidos
     if user_role in ["admin", "super_admin"]:
-        return crud.get_pedidos(db, skip=skip, limit=limit)
+        return crud.get_pedidos(db, skip=skip, limit=limit, after_id=after_id)
     
     # Si es cliente, filtrar solo sus pedidos
     cliente = db.query(models.Cliente).filter(models.Cliente.id_usuario == user_id).first()
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
     
-    return db.query(models.Pedido)\
-        .filter(models.Pedido.id_cliente == cliente.id_cliente)\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
+    query = db.query(models.Pedido)\
+        .options(*crud.CARGA_PEDIDO)\
+        .filter(models.Pedido.id_cliente == cliente.id_cliente)
+    return crud.paginar(query, models.Pedido.id_pedido, skip, limit, after_id).all()
 
 @app.post(
     "/detalle_pedidos/",
@@ -739,7 +797,7 @@ def listar_pedidos(
 )
 def crear_detalle_pedido(
     detalle: schemas.DetallePedidoCreate, 
-    current_user: dict = Depends(require_cliente_or_admin()),
+    current_user: dict = Depends(require_cliente_or_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -751,12 +809,12 @@ def crear_detalle_pedido(
     
     # Validar que el pedido pertenezca al usuario si es cliente
     if user_role not in ["admin", "super_admin"]:
-        pedido = crud.get_pedido(db, detalle.id_pedido)
-        if not pedido:
+        # Pedido y dueño en una sola consulta; crud reutiliza el pedido desde la sesión
+        propietario = crud.get_pedido_y_propietario(db, detalle.id_pedido)
+        if not propietario:
             raise HTTPException(status_code=404, detail="Pedido no encontrado")
         
-        cliente = crud.get_cliente(db, pedido.id_cliente)
-        if not cliente or cliente.id_usuario != user_id:
+        if propietario.id_usuario != user_id:
             raise HTTPException(
                 status_code=403,
                 detail="Solo puedes agregar detalles a tus propios pedidos"
@@ -764,6 +822,41 @@ def crear_detalle_pedido(
     
     return crud.crear_detalle_pedido(db=db, detalle=detalle)
 
+@app.post(
+    "/detalle_pedidos/lote",
+    tags=["Pedidos"],
+    summary="Crear varios detalles de un pedido",
+    response_model=list[schemas.DetallePedido],
+    status_code=status.HTTP_201_CREATED
+)
+def crear_detalles_pedido_lote(
+    detalles: list[schemas.DetallePedidoCreate] = Body(..., min_length=1, max_length=100),
+    current_user: dict = Depends(require_cliente_or_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Crear todos los detalles de un pedido en una sola transacción.
+    Todos los detalles deben pertenecer al mismo pedido; si alguno falla no se crea ninguno.
+    Los clientes solo pueden agregar detalles a sus propios pedidos.
+    """
+    user_id = current_user.get("id_usuario")
+    user_role = current_user.get("rol")
+    
+    # Validar que el pedido pertenezca al usuario si es cliente
+    if user_role not in ["admin", "super_admin"]:
+        # Pedido y dueño en una sola consulta; crud reutiliza el pedido desde la sesión
+        propietario = crud.get_pedido_y_propietario(db, detalles[0].id_pedido)
+        if not propietario:
+            raise HTTPException(status_code=404, detail="Pedido no encontrado")
+        
+        if propietario.id_usuario != user_id:
+            raise HTTPException(
+                status_code=403,
+                detail="Solo puedes agregar detalles a tus propios pedidos"
+            )
+    
+    return crud.crear_detalles_pedido_bulk(db=db, detalles=detalles)
+
 @app.get(
     "/detalle_pedidos/",
     tags=["Pedidos"],
@@ -771,8 +864,9 @@ def crear_detalle_pedido(
     response_model=list[schemas.DetallePedido]
 )
 def listar_detalles_pedido(
-    skip: int = 0, 
-    limit: int = 100,
+    skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
+    limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     pedido_id: Optional[int] = Query(None, description="ID del pedido para filtrar detalles"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -786,7 +880,7 @@ def listar_detalles_pedido(
     user_id = current_user.get("id_usuario")
     user_role = current_user.get("rol")
     
-    query = db.query(models.DetallePedido)
+    query = db.query(models.DetallePedido).options(*crud.CARGA_DETALLE_PEDIDO)
     
     # Si es cliente, filtrar solo sus pedidos
     if user_role not in ["admin", "super_admin"]:
@@ -822,7 +916,7 @@ def listar_detalles_pedido(
                 )
         query = query.filter(models.DetallePedido.id_pedido == pedido_id)
     
-    return query.offset(skip).limit(limit).all()
+    return crud.paginar(query, models.DetallePedido.id_detalle, skip, limit, after_id).all()
 
 @app.get(
     "/usuarios/",
@@ -838,10 +932,11 @@ def listar_detalles_pedido(
 def listar_usuarios(
     skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
     limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     rol: Optional[str] = Query(None, description="Filtrar por rol (cliente, admin, super_admin)"),
     correo: Optional[str] = Query(None, description="Filtrar por correo (búsqueda parcial)"),
     email_verificado: Optional[str] = Query(None, description="Filtrar por estado de verificación (S, N)"),
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -863,7 +958,8 @@ def listar_usuarios(
         limit=limit,
         rol=rol,
         correo=correo,
-        email_verificado=email_verificado
+        email_verificado=email_verificado,
+        after_id=after_id
     )
 
 @app.get(
@@ -898,7 +994,7 @@ def leer_usuarios_me(current_user: dict = Depends(get_current_user)):
 )
 def obtener_usuario(
     usuario_id: int = Path(..., description="ID del usuario"),
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -936,7 +1032,7 @@ def obtener_usuario(
 def actualizar_usuario(
     usuario_id: int = Path(..., description="ID del usuario"),
     usuario: schemas.UsuarioUpdate = Body(...), 
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -1006,7 +1102,7 @@ def actualizar_usuario(
 )
 def eliminar_usuario(
     usuario_id: int = Path(..., description="ID del usuario"),
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -1090,7 +1186,7 @@ def actualizar_cliente(
 )
 def eliminar_cliente(
     cliente_id: int, 
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Eliminar cliente. Solo accesible para administradores."""
@@ -1116,7 +1212,7 @@ def eliminar_cliente(
 def actualizar_categoria(
     categoria_id: int, 
     categoria: schemas.CategoriaCreate, 
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Actualizar categoría. Solo accesible para administradores."""
@@ -1133,7 +1229,7 @@ def actualizar_categoria(
 )
 def eliminar_categoria(
     categoria_id: int, 
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Eliminar categoría. Solo accesible para administradores."""
@@ -1151,7 +1247,7 @@ def eliminar_categoria(
 def actualizar_producto(
     producto_id: int, 
     producto: schemas.ProductoCreate, 
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Actualizar producto. Solo accesible para administradores."""
@@ -1167,7 +1263,7 @@ def actualizar_producto(
 )
 def eliminar_producto(
     id: int, 
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Eliminar producto. Solo accesible para administradores."""
@@ -1259,7 +1355,7 @@ def actualizar_pedido(
 )
 def eliminar_pedido(
     pedido_id: int, 
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Eliminar pedido. Solo accesible para administradores."""
@@ -1354,30 +1450,24 @@ def productos_de_pedido(
     Obtiene los productos de un pedido específico.
     Los clientes solo pueden ver productos de sus propios pedidos.
     Los administradores pueden ver productos de cualquier pedido.
-    Optimizado para evitar queries N+1 usando joinedload.
+    Los productos se cargan con un único JOIN desde los detalles.
     """
     user_id = current_user.get("id_usuario")
     user_role = current_user.get("rol")
     
-    # Validar propiedad del recurso si es cliente
+    # Validar propiedad del recurso si es cliente (pedido y propietario en una sola consulta)
     if user_role not in ["admin", "super_admin"]:
-        pedido = crud.get_pedido(db, pedido_id)
-        if not pedido:
+        propietario = crud.get_pedido_y_propietario(db, pedido_id)
+        if not propietario:
             raise HTTPException(status_code=404, detail="Pedido no encontrado")
         
-        cliente = crud.get_cliente(db, pedido.id_cliente)
-        if not cliente or cliente.id_usuario != user_id:
+        if propietario.id_usuario != user_id:
             raise HTTPException(
                 status_code=403,
                 detail="Solo puedes ver productos de tus propios pedidos"
             )
     
-    from sqlalchemy.orm import joinedload
-    detalles = db.query(models.DetallePedido)\
-        .options(joinedload(models.DetallePedido.producto))\
-        .filter(models.DetallePedido.id_pedido == pedido_id).all()
-    productos = [d.producto for d in detalles if d.producto]
-    return productos
+    return crud.get_productos_de_pedido(db, pedido_id)
 
 @app.get(
     "/categorias/{categoria_id}/productos",
@@ -1392,6 +1482,9 @@ def productos_de_pedido(
 )
 def productos_de_categoria(
     categoria_id: int = Path(..., description="ID de la categoría"),
+    skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
+    limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     db: Session = Depends(get_db)
 ):
     """
@@ -1399,7 +1492,8 @@ def productos_de_categoria(
     
     Este endpoint es **público** y no requiere autenticación.
     """
-    return db.query(models.Producto).filter(models.Producto.id_categoria == categoria_id).all()
+    query = db.query(models.Producto).options(*crud.CARGA_PRODUCTO).filter(models.Producto.id_categoria == categoria_id)
+    return crud.paginar(query, models.Producto.id_producto, skip, limit, after_id).all()
 
 @app.get(
     "/clientes/{cliente_id}/pedidos",
@@ -1409,6 +1503,9 @@ def productos_de_categoria(
 )
 def pedidos_de_cliente(
     cliente_id: int, 
+    skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
+    limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -1432,7 +1529,8 @@ def pedidos_de_cliente(
                 detail="Solo puedes ver tus propios pedidos"
             )
     
-    return db.query(models.Pedido).filter(models.Pedido.id_cliente == cliente_id).all()
+    query = db.query(models.Pedido).options(*crud.CARGA_PEDIDO).filter(models.Pedido.id_cliente == cliente_id)
+    return crud.paginar(query, models.Pedido.id_pedido, skip, limit, after_id).all()
 
 @app.get(
     "/pedidos/estado/{estado}",
@@ -1442,6 +1540,9 @@ def pedidos_de_cliente(
 )
 def listar_pedidos_por_estado(
     estado: str, 
+    skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
+    limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -1453,17 +1554,16 @@ def listar_pedidos_por_estado(
     user_id = current_user.get("id_usuario")
     user_role = current_user.get("rol")
     
-    if user_role in ["admin", "super_admin"]:
-        return db.query(models.Pedido).filter(models.Pedido.estado == estado).all()
-    else:
+    query = db.query(models.Pedido).options(*crud.CARGA_PEDIDO).filter(models.Pedido.estado == estado)
+    if user_role not in ["admin", "super_admin"]:
         # Cliente solo ve sus propios pedidos
         cliente = crud.get_cliente_por_id_usuario(db, user_id)
         if not cliente:
             raise HTTPException(status_code=404, detail="Cliente no encontrado")
         
-        return db.query(models.Pedido)\
-            .filter(models.Pedido.id_cliente == cliente.id_cliente)\
-            .filter(models.Pedido.estado == estado).all()
+        query = query.filter(models.Pedido.id_cliente == cliente.id_cliente)
+    
+    return crud.paginar(query, models.Pedido.id_pedido, skip, limit, after_id).all()
 
 @app.post(
     "/carritos/",
@@ -1479,7 +1579,7 @@ def listar_pedidos_por_estado(
 )
 def crear_carrito(
     carrito: schemas.CarritoCreate, 
-    current_user: dict = Depends(require_cliente_or_admin()),
+    current_user: dict = Depends(require_cliente_or_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -1511,13 +1611,14 @@ def crear_carrito(
     response_model=list[schemas.Carrito]
 )
 def listar_carritos(
-    skip: int = 0, 
-    limit: int = 100, 
-    current_user: dict = Depends(require_admin()),
+    skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
+    limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Listar todos los carritos. Solo accesible para administradores."""
-    return crud.get_carritos(db, skip=skip, limit=limit)
+    return crud.get_carritos(db, skip=skip, limit=limit, after_id=after_id)
 
 @app.put(
     "/carritos/{carrito_id}",
@@ -1595,7 +1696,7 @@ def eliminar_carrito(
 )
 def crear_detalle_carrito(
     detalle: schemas.DetalleCarritoCreate, 
-    current_user: dict = Depends(require_cliente_or_admin()),
+    current_user: dict = Depends(require_cliente_or_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -1607,12 +1708,12 @@ def crear_detalle_carrito(
     
     # Validar que el carrito pertenezca al usuario si es cliente
     if user_role not in ["admin", "super_admin"]:
-        carrito = crud.get_carrito(db, detalle.id_carrito)
-        if not carrito:
+        # Carrito y dueño en una sola consulta; crud reutiliza el carrito desde la sesión
+        propietario = crud.get_carrito_y_propietario(db, detalle.id_carrito)
+        if not propietario:
             raise HTTPException(status_code=404, detail="Carrito no encontrado")
         
-        cliente = crud.get_cliente(db, carrito.id_cliente)
-        if not cliente or cliente.id_usuario != user_id:
+        if propietario.id_usuario != user_id:
             raise HTTPException(
                 status_code=403,
                 detail="Solo puedes agregar productos a tus propios carritos"
@@ -1627,8 +1728,9 @@ def crear_detalle_carrito(
     response_model=list[schemas.DetalleCarrito]
 )
 def listar_detalles_carrito(
-    skip: int = 0, 
-    limit: int = 100,
+    skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
+    limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     carrito_id: Optional[int] = Query(None, description="ID del carrito para filtrar detalles"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -1642,7 +1744,7 @@ def listar_detalles_carrito(
     user_id = current_user.get("id_usuario")
     user_role = current_user.get("rol")
     
-    query = db.query(models.DetalleCarrito)
+    query = db.query(models.DetalleCarrito).options(*crud.CARGA_DETALLE_CARRITO)
     
     # Si es cliente, filtrar solo sus carritos
     if user_role not in ["admin", "super_admin"]:
@@ -1678,7 +1780,7 @@ def listar_detalles_carrito(
                 )
         query = query.filter(models.DetalleCarrito.id_carrito == carrito_id)
     
-    return query.offset(skip).limit(limit).all()
+    return crud.paginar(query, models.DetalleCarrito.id_detalle_carrito, skip, limit, after_id).all()
 
 @app.put(
     "/detalle_carrito/{detalle_id}",
@@ -1758,6 +1860,9 @@ def eliminar_detalle_carrito(
 )
 def carritos_de_cliente(
     cliente_id: int, 
+    skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
+    limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -1781,7 +1886,8 @@ def carritos_de_cliente(
                 detail="Solo puedes ver tus propios carritos"
             )
     
-    return db.query(models.Carrito).filter(models.Carrito.id_cliente == cliente_id).all()
+    query = db.query(models.Carrito).options(*crud.CARGA_CARRITO).filter(models.Carrito.id_cliente == cliente_id)
+    return crud.paginar(query, models.Carrito.id_carrito, skip, limit, after_id).all()
 
 @app.get(
     "/carritos/{carrito_id}/productos",
@@ -1798,30 +1904,24 @@ def productos_de_carrito(
     Obtiene los productos de un carrito específico.
     Los clientes solo pueden ver productos de sus propios carritos.
     Los administradores pueden ver productos de cualquier carrito.
-    Optimizado para evitar queries N+1 usando joinedload.
+    Los productos se cargan con un único JOIN desde los detalles.
     """
     user_id = current_user.get("id_usuario")
     user_role = current_user.get("rol")
     
-    # Validar propiedad del recurso si es cliente
+    # Validar propiedad del recurso si es cliente (carrito y propietario en una sola consulta)
     if user_role not in ["admin", "super_admin"]:
-        carrito = crud.get_carrito(db, carrito_id)
-        if not carrito:
+        propietario = crud.get_carrito_y_propietario(db, carrito_id)
+        if not propietario:
             raise HTTPException(status_code=404, detail="Carrito no encontrado")
         
-        cliente = crud.get_cliente(db, carrito.id_cliente)
-        if not cliente or cliente.id_usuario != user_id:
+        if propietario.id_usuario != user_id:
             raise HTTPException(
                 status_code=403,
                 detail="Solo puedes ver productos de tus propios carritos"
             )
     
-    from sqlalchemy.orm import joinedload
-    detalles = db.query(models.DetalleCarrito)\
-        .options(joinedload(models.DetalleCarrito.producto))\
-        .filter(models.DetalleCarrito.id_carrito == carrito_id).all()
-    productos = [d.producto for d in detalles if d.producto]
-    return productos
+    return crud.get_productos_de_carrito(db, carrito_id)
 
 @app.post(
     "/login",
@@ -1860,13 +1960,17 @@ def productos_de_carrito(
             "description": "Error de validación",
             "content": {
                 "application/json": {
-                    "example": {"detail": "Se requieren correo y contraseña"}
+                    "example": {
+                        "detail": "Error de validación",
+                        "errors": [{"field": "contraseña", "message": "Field required", "type": "missing"}],
+                        "message": "Se encontraron 1 error(es) de validación"
+                    }
                 }
             }
         }
     }
 )
-def login(datos: dict = Body(..., example={"correo": "usuario@ejemplo.com", "contraseña": "miPassword123"}), db: Session = Depends(get_db)):
+async def login(datos: schemas.LoginRequest, db: Session = Depends(get_db)):
     """
     Inicia sesión con correo y contraseña.
     
@@ -1884,15 +1988,12 @@ def login(datos: dict = Body(..., example={"correo": "usuario@ejemplo.com", "con
     - `id_usuario`: ID del usuario
     - `rol`: Rol del usuario (cliente, admin o super_admin)
     """
-    correo = datos.get("correo")
-    contraseña = datos.get("contraseña")
-    
-    # Validar que se proporcionaron ambos campos
-    if not correo or not contraseña:
-        raise HTTPException(status_code=422, detail="Se requieren correo y contraseña")
+    correo = datos.correo
+    contraseña = datos.contraseña
     
-    usuario = crud.get_usuario_por_correo(db, correo=correo)
-    if not usuario or not verify_password(contraseña, usuario.contraseña):
+    # Endpoint async: la consulta y el hash se ejecutan en el threadpool para no bloquear el event loop
+    usuario = await run_in_threadpool(crud.get_usuario_por_correo, db, correo)
+    if not usuario or not await verify_password_async(contraseña, usuario.contraseña):
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
     
     # Validar que la cuenta esté confirmada
@@ -1902,6 +2003,11 @@ def login(datos: dict = Body(..., example={"correo": "usuario@ejemplo.com", "con
             detail="Debes confirmar tu cuenta antes de iniciar sesión. Revisa tu correo para obtener el PIN de confirmación o solicita uno nuevo."
         )
     
+    # Hash bcrypt heredado o Argon2 con otros parámetros: se reemplaza ahora que se conoce la contraseña
+    if password_needs_rehash(usuario.contraseña):
+        nuevo_hash = await hash_password_async(contraseña)
+        await run_in_threadpool(crud.actualizar_hash_contraseña, db, usuario.id_usuario, nuevo_hash)
+    
     # Crear el token
     token = crear_token_de_acceso({"sub": usuario.correo, "id_usuario": usuario.id_usuario, "rol": usuario.rol})
     return {
@@ -1956,6 +2062,7 @@ def confirmar_cuenta(
 )
 def reenviar_confirmacion(
     request: schemas.ReenviarConfirmacionRequest,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """
@@ -1964,17 +2071,20 @@ def reenviar_confirmacion(
     Útil si no recibiste el email inicial o el PIN expiró.
     El nuevo PIN expirará en 15 minutos.
     """
-    nuevo_pin = crud.regenerar_token_confirmacion(db, request.correo)
+    usuario = crud.regenerar_token_confirmacion(db, request.correo)
+    nuevo_pin = usuario.token_confirmacion
+    # Confirmar antes de enviar el correo: el PIN enviado debe existir en la BD
+    db.commit()
     
     # Enviar email
     from . import email_service
-    usuario = crud.get_usuario_por_correo(db, request.correo)
     nombre = request.correo.split("@")[0]
     cliente = crud.get_cliente_por_id_usuario(db, usuario.id_usuario)
     if cliente:
         nombre = f"{cliente.nombre} {cliente.apellido}"
     
-    email_service.enviar_email_confirmacion(
+    background_tasks.add_task(
+        email_service.enviar_email_confirmacion,
         destinatario=request.correo,
         nombre=nombre,
         pin=nuevo_pin
@@ -1993,6 +2103,7 @@ def reenviar_confirmacion(
 )
 def solicitar_recuperacion(
     request: schemas.SolicitarRecuperacionRequest,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """
@@ -2002,17 +2113,20 @@ def solicitar_recuperacion(
     El PIN expira después de un tiempo determinado.
     """
     try:
-        pin = crud.generar_pin_recuperacion(db, request.correo)
+        usuario = crud.generar_pin_recuperacion(db, request.correo)
+        pin = usuario.token_reset
+        # Confirmar antes de enviar el correo: el PIN enviado debe existir en la BD
+        db.commit()
         
         # Enviar email con PIN
         from . import email_service
-        usuario = crud.get_usuario_por_correo(db, request.correo)
         nombre = request.correo.split("@")[0]
         cliente = crud.get_cliente_por_id_usuario(db, usuario.id_usuario)
         if cliente:
             nombre = f"{cliente.nombre} {cliente.apellido}"
         
-        email_service.enviar_email_recuperacion(
+        background_tasks.add_task(
+            email_service.enviar_email_recuperacion,
             destinatario=request.correo,
             nombre=nombre,
             pin=pin
@@ -2136,13 +2250,14 @@ def cambiar_contraseña_autenticado(
 def listar_audit_logs(
     skip: int = Query(0, ge=0, description="Número de registros a saltar (paginación)"),
     limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a retornar"),
+    after_id: Optional[int] = Query(None, gt=0, description="ID del último registro recibido (paginación por cursor; ignora skip)"),
     tabla_nombre: Optional[str] = Query(None, description="Filtrar por nombre de tabla"),
     registro_id: Optional[int] = Query(None, description="Filtrar por ID de registro específico"),
     accion: Optional[str] = Query(None, description="Filtrar por tipo de acción (INSERT, UPDATE, DELETE)"),
     usuario_id: Optional[int] = Query(None, description="Filtrar por usuario que realizó la acción"),
-    fecha_desde: Optional[datetime] = Query(None, description="Filtrar desde una fecha específica"),
-    fecha_hasta: Optional[datetime] = Query(None, description="Filtrar hasta una fecha específica"),
-    current_user: dict = Depends(require_admin()),
+    fecha_desde: Optional[Union[date, datetime]] = Query(None, description="Filtrar desde una fecha específica"),
+    fecha_hasta: Optional[Union[date, datetime]] = Query(None, description="Filtrar hasta una fecha específica (sin hora incluye el día completo)"),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -2156,7 +2271,7 @@ def listar_audit_logs(
     - **accion**: Filtrar por tipo de acción (INSERT, UPDATE, DELETE)
     - **usuario_id**: Filtrar por usuario que realizó la acción
     - **fecha_desde**: Filtrar desde una fecha específica
-    - **fecha_hasta**: Filtrar hasta una fecha específica
+    - **fecha_hasta**: Filtrar hasta una fecha específica; una fecha sin hora incluye el día completo
     """
     return crud.get_audit_logs(
         db=db,
@@ -2167,7 +2282,8 @@ def listar_audit_logs(
         accion=accion,
         usuario_id=usuario_id,
         fecha_desde=fecha_desde,
-        fecha_hasta=fecha_hasta
+        fecha_hasta=fecha_hasta,
+        after_id=after_id
     )
 
 @app.get(
@@ -2184,7 +2300,7 @@ def listar_audit_logs(
 def obtener_historial_registro(
     tabla_nombre: str = Path(..., description="Nombre de la tabla (ej: productos, usuarios)"),
     registro_id: int = Path(..., description="ID del registro"),
-    current_user: dict = Depends(require_admin()),
+    current_user: dict = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -2192,6 +2308,10 @@ def obtener_historial_registro(
     
     **Solo accesible para administradores.**
     
+    Los registros INSERT traen la fila completa en `datos_nuevos` y los DELETE en
+    `datos_anteriores`; los UPDATE solo traen `cambios` (campos modificados), por lo que
+    el estado en un momento dado se obtiene aplicando los cambios en orden sobre el INSERT.
+    
     Ejemplos:
     - `GET /audit/productos/123` -> Historial completo del producto con ID 123
     - `GET /audit/usuarios/456` -> Historial completo del usuario con ID 456
@@ -7,17 +7,35 @@ Main dependency: SQLAlchemy
 
 from sqlalchemy import Column, Integer, String, Text, Numeric, ForeignKey, TIMESTAMP, Computed, CheckConstraint, UniqueConstraint, Index
 from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql.expression import FunctionElement
 from .database import Base
 
 
+class AhoraUTC(FunctionElement):
+    """Hora actual en UTC calculada por la base de datos, para columnas TIMESTAMP sin zona."""
+    type = TIMESTAMP()
+    inherit_cache = True
+
+@compiles(AhoraUTC)
+def _ahora_utc(element, compiler, **kw):
+    # En SQLite (tests) CURRENT_TIMESTAMP ya está en UTC
+    return "CURRENT_TIMESTAMP"
+
+@compiles(AhoraUTC, "postgresql")
+def _ahora_utc_postgresql(element, compiler, **kw):
+    # now() sigue la zona horaria de la sesión; las fechas se guardan en UTC como hacía datetime.utcnow()
+    return "timezone('utc', now())"
+
+
 class Usuario(Base):
     __tablename__ = "usuarios"
     id_usuario = Column(Integer, primary_key=True, index=True)
     correo = Column(String(255), unique=True, nullable=False, index=True)
     contraseña = Column(String(255), nullable=False)
     rol = Column(String(50), nullable=False, default="cliente")
-    fecha_creacion = Column(TIMESTAMP, nullable=False)
+    fecha_creacion = Column(TIMESTAMP, nullable=False, server_default=AhoraUTC())
     email_verificado = Column(String(1), default="N", nullable=False)  # 'S' o 'N'
     token_confirmacion = Column(String(6), nullable=True, index=True)  # PIN de 6 dígitos para confirmar email
     token_confirmacion_expira = Column(TIMESTAMP, nullable=True)  # Expiración del PIN (15 minutos)
@@ -37,7 +55,7 @@ class Cliente(Base):
     apellido = Column(String(255), nullable=False)
     telefono = Column(String(15))
     direccion = Column(Text)
-    fecha_registro = Column(TIMESTAMP)
+    fecha_registro = Column(TIMESTAMP, server_default=AhoraUTC())
     usuario = relationship("Usuario")
 
 class Categoria(Base):
@@ -77,7 +95,7 @@ class Pedido(Base):
     id_cliente = Column(Integer, ForeignKey("clientes.id_cliente", ondelete="CASCADE"), nullable=False, index=True)
     estado = Column(String(20), default="pendiente", index=True)
     direccion_envio = Column(Text, nullable=False)
-    fecha_pedido = Column(TIMESTAMP, index=True)
+    fecha_pedido = Column(TIMESTAMP, index=True, server_default=AhoraUTC())
     metodo_pago = Column(String(50), default="PayPal")
     cliente = relationship("Cliente")
     
@@ -92,7 +110,7 @@ class DetallePedido(Base):
     __tablename__ = "detalle_pedidos"
     id_detalle = Column(Integer, primary_key=True, index=True)
     id_pedido = Column(Integer, ForeignKey("pedidos.id_pedido", ondelete="CASCADE"), nullable=False, index=True)
-    id_producto = Column(Integer, ForeignKey("productos.id_producto"), nullable=False)
+    id_producto = Column(Integer, ForeignKey("productos.id_producto"), nullable=False, index=True)
     cantidad = Column(Integer, nullable=False, default=1)
     precio_unitario = Column(Numeric(10, 2), nullable=False)
     subtotal = Column(Numeric(10, 2))
@@ -111,7 +129,7 @@ class Carrito(Base):
     __tablename__ = "carrito"
     id_carrito = Column(Integer, primary_key=True, index=True)
     id_cliente = Column(Integer, ForeignKey("clientes.id_cliente", ondelete="CASCADE"), nullable=False, index=True)
-    fecha_creacion = Column(TIMESTAMP)
+    fecha_creacion = Column(TIMESTAMP, server_default=AhoraUTC())
     estado = Column(String(20), default="activo", index=True)
     cliente = relationship("Cliente")
     
@@ -124,7 +142,7 @@ class DetalleCarrito(Base):
     __tablename__ = "detalle_carrito"
     id_detalle_carrito = Column(Integer, primary_key=True, index=True)
     id_carrito = Column(Integer, ForeignKey("carrito.id_carrito", ondelete="CASCADE"), nullable=False, index=True)
-    id_producto = Column(Integer, ForeignKey("productos.id_producto"), nullable=False)
+    id_producto = Column(Integer, ForeignKey("productos.id_producto"), nullable=False, index=True)
     cantidad = Column(Integer, nullable=False, default=1)
     precio_unitario = Column(Numeric(10, 2), nullable=False)
     subtotal = Column(Numeric(10, 2))
@@ -152,7 +170,21 @@ class AuditLog(Base):
     datos_anteriores = Column(JSONB, nullable=True)
     datos_nuevos = Column(JSONB, nullable=True)
     cambios = Column(JSONB, nullable=True)  # Solo campos que cambiaron
+    # Clave de partición (particiones mensuales). En PostgreSQL la PK es (id_audit, fecha_accion);
+    # el ORM identifica las filas solo por id_audit, que sigue siendo único (secuencia).
     fecha_accion = Column(TIMESTAMP, nullable=False, index=True)
     metadatos_extra = Column("metadata", JSONB, nullable=True)  # Información adicional (nombre columna DB: metadata)
     
-    usuario = relationship("Usuario", foreign_keys=[usuario_id])
+    # Los listados de auditoría no cargan el usuario: un acceso perezoso sería una consulta por log
+    usuario = relationship("Usuario", foreign_keys=[usuario_id], lazy="raise")
+
+    __table_args__ = (
+        # Historial de un registro (GET /audit/{tabla}/{id}) ya ordenado por fecha, sin Sort
+        Index("ix_audit_lookup", "tabla_nombre", "registro_id", fecha_accion.desc(), postgresql_include=["accion", "id_audit"]),
+        # Rangos de fechas sobre una tabla append-only: BRIN ocupa unas pocas páginas
+        Index("ix_audit_fecha_brin", "fecha_accion", postgresql_using="brin"),
+        # Filtros de GET /audit con ORDER BY fecha_accion DESC LIMIT: Index Scan que se detiene en `limit` filas
+        Index("ix_audit_usuario_fecha", "usuario_id", fecha_accion.desc()),
+        Index("ix_audit_accion_fecha", "accion", fecha_accion.desc()),
+        Index("ix_audit_tabla_fecha", "tabla_nombre", fecha_accion.desc()),
+    )
@@ -5,11 +5,15 @@ Includes the models for user, client, category, product, order, cart, and their
 Main dependencies: Pydantic, typing, datetime
 """
 
-from pydantic import BaseModel, EmailStr, Field, validator, constr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field, PlainSerializer, validator, constr
+from typing import Annotated, Optional
 from datetime import datetime
+from decimal import Decimal
 from enum import Enum
 
+# Importes con dos decimales exactos (como Numeric(10, 2) en la BD); en JSON siguen siendo números
+Dinero = Annotated[Decimal, PlainSerializer(float, return_type=float, when_used="json")]
+
 class UsuarioBase(BaseModel):
     correo: EmailStr = Field(..., description="Correo electrónico del usuario")
     rol: Optional[str] = Field(default="cliente")
@@ -87,6 +91,19 @@ class Usuario(UsuarioBase):
     class Config:
         from_attributes = True
 
+# Schema de inicio de sesión
+class LoginRequest(BaseModel):
+    correo: EmailStr = Field(..., description="Correo electrónico del usuario")
+    contraseña: constr(min_length=1) = Field(..., description="Contraseña del usuario")
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "correo": "usuario@ejemplo.com",
+                "contraseña": "miPassword123"
+            }
+        }
+
 # Schemas para confirmación de cuenta
 class ConfirmarCuentaRequest(BaseModel):
     correo: EmailStr = Field(..., description="Correo electrónico del usuario")
@@ -218,7 +235,7 @@ class ProductoBase(BaseModel):
     nombre: constr(min_length=1, max_length=255, strip_whitespace=True)
     descripcion: constr(min_length=1, max_length=2000)
     cantidad: int = Field(ge=0, description="Cantidad en inventario")
-    precio: float = Field(gt=0, le=999999.99, description="Precio del producto")
+    precio: Dinero = Field(gt=0, le=999999.99, description="Precio del producto")
     imagen_url: Optional[constr(max_length=500)] = None
     estado: Optional[str] = Field(default="activo", pattern="^(activo|inactivo)$")
     
@@ -330,7 +347,7 @@ class DetallePedidoBase(BaseModel):
     id_pedido: int = Field(gt=0, description="ID del pedido")
     id_producto: int = Field(gt=0, description="ID del producto")
     cantidad: int = Field(gt=0, le=1000, description="Cantidad del producto")
-    precio_unitario: float = Field(gt=0, le=999999.99, description="Precio unitario")
+    precio_unitario: Dinero = Field(gt=0, le=999999.99, description="Precio unitario")
     
     @validator('cantidad')
     def validar_cantidad(cls, v):
@@ -361,7 +378,7 @@ class DetallePedidoCreate(DetallePedidoBase):
 
 class DetallePedido(DetallePedidoBase):
     id_detalle: int
-    subtotal: float
+    subtotal: Dinero
     pedido: Pedido
     producto: Producto
     class Config:
@@ -398,8 +415,8 @@ class DetalleCarritoBase(BaseModel):
     id_carrito: int = Field(gt=0, description="ID del carrito")
     id_producto: int = Field(gt=0, description="ID del producto")
     cantidad: int = Field(gt=0, le=1000, description="Cantidad del producto")
-    precio_unitario: float = Field(gt=0, le=999999.99, description="Precio unitario")
-    subtotal: float = Field(ge=0, description="Subtotal calculado")
+    precio_unitario: Dinero = Field(gt=0, le=999999.99, description="Precio unitario")
+    subtotal: Dinero = Field(ge=0, description="Subtotal calculado")
     
     @validator('cantidad')
     def validar_cantidad(cls, v):
@@ -423,15 +440,19 @@ class DetalleCarritoBase(BaseModel):
         cantidad = values.get('cantidad')
         precio_unitario = values.get('precio_unitario')
         
+        if v is not None:
+            v = round(v, 2)
+        
         if cantidad is not None and precio_unitario is not None:
+            # precio_unitario ya tiene dos decimales: el producto es exacto y se compara sin tolerancia
             calculado = cantidad * precio_unitario
-            if abs(v - calculado) > 0.01:  # Tolerancia para errores de punto flotante
+            if v != calculado:
                 raise ValueError(f'El subtotal debe ser igual a cantidad × precio_unitario ({calculado:.2f})')
         
         if v is not None and v < 0:
             raise ValueError('El subtotal no puede ser negativo')
         
-        return round(v, 2) if v is not None else v
+        return v
 
 class DetalleCarritoCreate(DetalleCarritoBase):
     class Config:
@@ -447,7 +468,7 @@ class DetalleCarritoCreate(DetalleCarritoBase):
 
 class DetalleCarrito(DetalleCarritoBase):
     id_detalle_carrito: int
-    subtotal: float
+    subtotal: Dinero
     carrito: Carrito
     producto: Producto
     class Config:
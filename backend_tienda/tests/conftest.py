@@ -13,6 +13,7 @@ os.environ["CORS_ORIGINS"] = "http://localhost:3000,http://test.local"
 from app.database import Base
 from app.main import app, get_db
 from app import models
+from app.crud import limpiar_cache_categorias, limpiar_cache_confirmados
 
 # Crear engine de prueba con SQLite en memoria
 engine = create_engine(
@@ -21,7 +22,7 @@ engine = create_engine(
     poolclass=StaticPool,
 )
 
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 
 @pytest.fixture(scope="function")
@@ -38,6 +39,9 @@ def db_session():
         db.close()
         # Limpiar tablas después de cada prueba
         Base.metadata.drop_all(bind=engine)
+        # Los IDs y correos se reutilizan entre pruebas: las cachés no deben sobrevivirlas
+        limpiar_cache_categorias()
+        limpiar_cache_confirmados()
 
 
 @pytest.fixture(scope="function")
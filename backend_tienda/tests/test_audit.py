@@ -0,0 +1,421 @@
+"""
+Tests para el sistema de auditoría (audit.py).
+
+Los triggers de PostgreSQL no existen en SQLite; aquí se prueba la parte de la
+aplicación: normalización del contexto y publicación en la sesión de la request.
+Las pruebas que necesitan PostgreSQL se ejecutan solo si TEST_POSTGRES_URL está definida.
+"""
+
+import importlib.util
+import os
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from app import models
+import contextvars
+from app.audit import (
+    AuditContext,
+    normalizar_user_id,
+    publicar_contexto_auditoria,
+    set_audit_context,
+    clear_audit_context,
+    get_audit_context,
+)
+
+
+class TestContextoAuditoria:
+    """Pruebas para el contexto de auditoría."""
+
+    def test_contexto_vacio(self):
+        """Prueba que un contexto sin datos se considera vacío."""
+        assert AuditContext().is_empty()
+        assert not AuditContext(endpoint="GET /productos/").is_empty()
+
+    @pytest.mark.parametrize("valor, esperado", [
+        (5, 5),
+        ("7", 7),
+        (None, None),
+        ("abc", None),
+        ({"id": 1}, None),
+        (True, None),
+    ])
+    def test_normalizar_user_id(self, valor, esperado):
+        """Prueba que un id_usuario no entero del token se descarta."""
+        assert normalizar_user_id(valor) == esperado
+
+
+class TestContextVarAuditoria:
+    """Pruebas para el aislamiento del contexto por request (ContextVar)."""
+
+    def test_set_y_clear_restauran_el_contexto(self):
+        """Prueba que clear_audit_context restaura el valor anterior."""
+        assert get_audit_context() is None
+        token = set_audit_context(user_id=1, endpoint="GET /")
+        try:
+            assert get_audit_context().user_id == 1
+        finally:
+            clear_audit_context(token)
+        assert get_audit_context() is None
+
+    def test_contextos_aislados(self):
+        """Prueba que un contexto establecido en otra request no es visible aquí."""
+        def otra_request():
+            set_audit_context(user_id=99, user_email="otro@example.com")
+            return get_audit_context().user_id
+
+        assert contextvars.copy_context().run(otra_request) == 99
+        assert get_audit_context() is None
+
+
+class TestPublicarContexto:
+    """Pruebas para la publicación del contexto en la sesión."""
+
+    def test_no_ejecuta_nada_fuera_de_postgresql(self, db_session):
+        """Prueba que en SQLite la sesión funciona sin emitir set_config()."""
+        sentencias = []
+
+        def capturar(conn, cursor, statement, parameters, context, executemany):
+            sentencias.append(statement)
+
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", capturar)
+        try:
+            publicar_contexto_auditoria(
+                db_session,
+                AuditContext(user_id=1, user_email="a@b.com", ip_address="127.0.0.1", endpoint="GET /")
+            )
+            assert db_session.execute(text("SELECT 1")).scalar() == 1
+        finally:
+            event.remove(engine, "before_cursor_execute", capturar)
+
+        assert not any("set_config" in s for s in sentencias)
+
+    def test_contexto_vacio_no_registra_listener(self, db_session):
+        """Prueba que sin contexto no se registra ningún listener en la sesión."""
+        publicar_contexto_auditoria(db_session, AuditContext())
+        publicar_contexto_auditoria(db_session, None)
+
+        assert len(db_session.dispatch.before_flush) == 0
+        assert len(db_session.dispatch.do_orm_execute) == 0
+
+    def test_publica_una_vez_por_transaccion(self, db_session):
+        """Prueba que varios flush en la misma transacción publican el contexto una sola vez."""
+        publicar_contexto_auditoria(db_session, AuditContext(user_id=1, endpoint="POST /categorias/"))
+
+        db_session.add(models.Categoria(nombre="A", descripcion_corta="a", descripcion_larga="a", estado="activo"))
+        db_session.flush()
+        transaccion = db_session.info.get("audit_transaccion")
+        assert transaccion is db_session.get_transaction()
+
+        db_session.add(models.Categoria(nombre="B", descripcion_corta="b", descripcion_larga="b", estado="activo"))
+        db_session.flush()
+        assert db_session.info.get("audit_transaccion") is transaccion
+
+    def test_lectura_no_publica_contexto(self, db_session):
+        """Prueba que una transacción de solo lectura no publica el contexto."""
+        publicar_contexto_auditoria(db_session, AuditContext(user_id=1, endpoint="GET /categorias/"))
+
+        db_session.query(models.Categoria).all()
+
+        assert "audit_transaccion" not in db_session.info
+
+    def test_sin_listeners_de_mapper(self):
+        """Prueba que la auditoría no registra listeners por modelo (lo hace el trigger)."""
+        for model in (models.Usuario, models.Cliente, models.Categoria, models.Producto,
+                      models.Pedido, models.DetallePedido, models.Carrito, models.DetalleCarrito):
+            mapper = model.__mapper__
+            assert len(mapper.dispatch.after_insert) == 0
+            assert len(mapper.dispatch.after_update) == 0
+            assert len(mapper.dispatch.after_delete) == 0
+
+
+
+class TestConsultaAuditLogs:
+    """Pruebas de crud.get_audit_logs."""
+
+    def test_filtra_y_ordena_por_fecha(self, db_session):
+        """Prueba que los filtros se combinan y el resultado sale del más reciente al más antiguo."""
+        from datetime import datetime
+        from app.crud import get_audit_logs
+
+        for dia, tabla, accion in ((1, "productos", "INSERT"), (2, "productos", "UPDATE"), (3, "pedidos", "UPDATE")):
+            db_session.add(models.AuditLog(
+                tabla_nombre=tabla, registro_id=1, accion=accion, fecha_accion=datetime(2025, 1, dia)
+            ))
+        db_session.commit()
+
+        logs = get_audit_logs(db_session, accion="UPDATE")
+        assert [log.tabla_nombre for log in logs] == ["pedidos", "productos"]
+
+        logs = get_audit_logs(db_session, tabla_nombre="productos", fecha_desde=datetime(2025, 1, 2))
+        assert [log.accion for log in logs] == ["UPDATE"]
+
+    def test_fecha_hasta_sin_hora_incluye_el_dia(self, db_session):
+        """Prueba que fecha_hasta como date incluye los registros de todo ese día."""
+        from datetime import date, datetime
+        from app.crud import get_audit_logs
+
+        for fecha in (datetime(2025, 1, 2, 23, 59), datetime(2025, 1, 3, 0, 0)):
+            db_session.add(models.AuditLog(
+                tabla_nombre="productos", registro_id=1, accion="UPDATE", fecha_accion=fecha
+            ))
+        db_session.commit()
+
+        logs = get_audit_logs(db_session, fecha_desde=date(2025, 1, 2), fecha_hasta=date(2025, 1, 2))
+        assert [log.fecha_accion for log in logs] == [datetime(2025, 1, 2, 23, 59)]
+
+        logs = get_audit_logs(db_session, fecha_hasta=datetime(2025, 1, 2, 12, 0))
+        assert logs == []
+
+    def test_after_id_pagina_hacia_atras(self, db_session):
+        """Prueba que after_id devuelve los logs anteriores al último recibido."""
+        from datetime import datetime
+        from app.crud import get_audit_logs
+
+        for dia in range(1, 4):
+            db_session.add(models.AuditLog(
+                tabla_nombre="productos", registro_id=dia, accion="INSERT", fecha_accion=datetime(2025, 1, dia)
+            ))
+        db_session.commit()
+
+        primera = get_audit_logs(db_session, limit=2)
+        segunda = get_audit_logs(db_session, limit=2, after_id=primera[-1].id_audit)
+        assert [log.registro_id for log in primera] == [3, 2]
+        assert [log.registro_id for log in segunda] == [1]
+
+    def test_valores_como_parametros(self, db_session):
+        """Prueba que cambiar el valor de un filtro no cambia el SQL emitido."""
+        from sqlalchemy import event
+        from app.crud import get_audit_logs
+
+        sentencias = []
+
+        def capturar(conn, cursor, statement, parameters, context, executemany):
+            sentencias.append(statement)
+
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", capturar)
+        try:
+            get_audit_logs(db_session, tabla_nombre="productos", usuario_id=1)
+            get_audit_logs(db_session, tabla_nombre="pedidos", usuario_id=2)
+        finally:
+            event.remove(engine, "before_cursor_execute", capturar)
+
+        assert len(sentencias) == 2
+        assert sentencias[0] == sentencias[1]
+
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "alembic" / "versions"
+
+TABLAS_AUDITADAS = {
+    model.__tablename__
+    for model in (models.Usuario, models.Cliente, models.Categoria, models.Producto,
+                  models.Pedido, models.DetallePedido, models.Carrito, models.DetalleCarrito)
+}
+
+
+class OpRecorder:
+    """Sustituto de alembic.op que guarda el SQL ejecutado."""
+
+    def __init__(self):
+        self.sql = []
+
+    def execute(self, sql):
+        self.sql.append(" ".join(str(sql).split()))
+
+
+# Diff de los UPDATE: claves de hstore(n) - hstore(o), valores de to_jsonb(n)
+DIFF_TO_JSONB = "SELECT jsonb_object_agg(k, to_jsonb(n)->k) FROM unnest(akeys(hstore(n) - hstore(o))) k"
+
+
+def cargar_migracion(nombre_archivo, monkeypatch):
+    """Carga un archivo de migración y sustituye su `op` por un OpRecorder."""
+    spec = importlib.util.spec_from_file_location(nombre_archivo, MIGRATIONS_DIR / nombre_archivo)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    recorder = OpRecorder()
+    monkeypatch.setattr(modulo, "op", recorder)
+    return modulo, recorder
+
+
+class TestMigracionTriggersPorSentencia:
+    """Pruebas estáticas de la migración a triggers FOR EACH STATEMENT."""
+
+    ARCHIVO = "d94e6b0c7a15_audit_statement_level_triggers.py"
+
+    def test_cubre_todas_las_tablas_auditadas(self, monkeypatch):
+        """Prueba que la migración cubre exactamente las tablas de los modelos auditados."""
+        modulo, _ = cargar_migracion(self.ARCHIVO, monkeypatch)
+        assert set(modulo.AUDITED_TABLES) == TABLAS_AUDITADAS
+
+    def test_upgrade_reemplaza_trigger_por_fila(self, monkeypatch):
+        """Prueba que cada tabla pierde audit_trigger y gana los tres triggers por sentencia."""
+        modulo, recorder = cargar_migracion(self.ARCHIVO, monkeypatch)
+        modulo.upgrade()
+        sql = "\n".join(recorder.sql)
+
+        for tabla in TABLAS_AUDITADAS:
+            assert f"DROP TRIGGER IF EXISTS audit_trigger ON {tabla};" in sql
+            assert (f"CREATE TRIGGER audit_trigger_insert AFTER INSERT ON {tabla} "
+                    f"REFERENCING NEW TABLE AS nt FOR EACH STATEMENT") in sql
+            assert (f"CREATE TRIGGER audit_trigger_update AFTER UPDATE ON {tabla} "
+                    f"REFERENCING OLD TABLE AS ot NEW TABLE AS nt FOR EACH STATEMENT") in sql
+            assert (f"CREATE TRIGGER audit_trigger_delete AFTER DELETE ON {tabla} "
+                    f"REFERENCING OLD TABLE AS ot FOR EACH STATEMENT") in sql
+        assert "FOR EACH ROW" not in sql
+
+    def test_update_no_depende_de_pk_estable(self, monkeypatch):
+        """Prueba que las filas de un UPDATE se emparejan con FULL JOIN (cambios de PK incluidos)."""
+        modulo, recorder = cargar_migracion(self.ARCHIVO, monkeypatch)
+        modulo.upgrade()
+        funcion = recorder.sql[0]
+
+        assert "FULL JOIN ot o ON o.%I = n.%I" in funcion
+        assert "COALESCE(n.%I, o.%I)" in funcion
+
+    def test_downgrade_restaura_trigger_por_fila(self, monkeypatch):
+        """Prueba que el downgrade elimina los triggers por sentencia y recrea audit_trigger."""
+        modulo, recorder = cargar_migracion(self.ARCHIVO, monkeypatch)
+        modulo.downgrade()
+        sql = "\n".join(recorder.sql)
+
+        for tabla in TABLAS_AUDITADAS:
+            for sufijo in ("insert", "update", "delete"):
+                assert f"DROP TRIGGER IF EXISTS audit_trigger_{sufijo} ON {tabla};" in sql
+            assert (f"CREATE TRIGGER audit_trigger AFTER INSERT OR UPDATE OR DELETE ON {tabla} "
+                    f"FOR EACH ROW") in sql
+
+
+class TestMigracionDiffHstore:
+    """Pruebas estáticas de la migración que calcula `cambios` con hstore."""
+
+    ARCHIVO = "e27b5f3a8c60_audit_hstore_diff.py"
+
+    def test_diff_conserva_tipos_json(self, monkeypatch):
+        """Prueba que el diff toma de hstore solo las claves y lee los valores de to_jsonb(n)."""
+        modulo, recorder = cargar_migracion(self.ARCHIVO, monkeypatch)
+        modulo.upgrade()
+        sql = "\n".join(recorder.sql)
+
+        assert "CREATE EXTENSION IF NOT EXISTS hstore" in sql
+        assert DIFF_TO_JSONB in sql
+        assert "hstore_to_jsonb" not in sql
+
+    @pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="Requiere PostgreSQL con hstore (TEST_POSTGRES_URL)")
+    def test_string_con_digitos_sigue_siendo_string(self):
+        """Prueba en PostgreSQL que `cambios` conserva el tipo y formato de datos_nuevos."""
+        spec = importlib.util.spec_from_file_location(self.ARCHIVO, MIGRATIONS_DIR / self.ARCHIVO)
+        modulo = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(modulo)
+
+        engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+        with engine.connect() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS hstore"))
+            conn.execute(text(
+                "CREATE TEMP TABLE fila_auditada "
+                "(id INTEGER, telefono TEXT, activo TEXT, fecha TIMESTAMP, precio NUMERIC(10, 2))"
+            ))
+            cambios, datos_nuevos = conn.execute(text(f"""
+                SELECT {modulo.DIFF_HSTORE}, to_jsonb(n)
+                FROM (
+                    SELECT (1, '123', 'x', TIMESTAMP '2025-01-01 09:00', 10.00)::fila_auditada AS o,
+                           (1, '987654321', 't', TIMESTAMP '2025-01-01 10:00', 10.50)::fila_auditada AS n
+                ) filas
+            """)).one()
+            conn.rollback()
+        engine.dispose()
+
+        assert set(cambios) == {"telefono", "activo", "fecha", "precio"}
+        assert cambios["telefono"] == "987654321"
+        assert cambios["activo"] == "t"
+        assert cambios == {clave: datos_nuevos[clave] for clave in cambios}
+
+
+class TestMigracionSoloDiff:
+    """Pruebas estáticas de la migración que guarda solo `cambios` en los UPDATE."""
+
+    ARCHIVO = "f5a0c6d2e813_audit_update_store_only_diff.py"
+
+    def test_update_sin_filas_completas(self, monkeypatch):
+        """Prueba que los UPDATE solo guardan la fila completa cuando no hay pareja por PK."""
+        modulo, recorder = cargar_migracion(self.ARCHIVO, monkeypatch)
+        modulo.upgrade()
+        funcion = recorder.sql[0]
+        bloque_update = funcion[funcion.index("'UPDATE', $1, $2"):funcion.index("ELSIF TG_OP = 'DELETE'")]
+
+        assert "CASE WHEN n IS NULL THEN to_jsonb(o) END" in bloque_update
+        assert "CASE WHEN o IS NULL THEN to_jsonb(n) END" in bloque_update
+        assert DIFF_TO_JSONB in bloque_update
+
+
+class TestMigracionPkMap:
+    """Pruebas estáticas de la migración que introduce audit_pk_map."""
+
+    ARCHIVO = "2d7f1b8c4e06_audit_pk_map_table.py"
+
+    def test_pk_map_cubre_las_tablas_auditadas(self, monkeypatch):
+        """Prueba que audit_pk_map se siembra con la PK real de cada modelo auditado."""
+        modulo, recorder = cargar_migracion(self.ARCHIVO, monkeypatch)
+        modulo.upgrade()
+        sql = "\n".join(recorder.sql)
+
+        for model in (models.Usuario, models.Cliente, models.Categoria, models.Producto,
+                      models.Pedido, models.DetallePedido, models.Carrito, models.DetalleCarrito):
+            pk = model.__mapper__.primary_key[0].name
+            assert f"('{model.__tablename__}', '{pk}')" in sql
+        assert "pk_col := audit_pk_column(TG_TABLE_NAME);" in sql
+        assert "WITH pk_map" not in sql
+
+
+class TestMigracionColumnasExcluidas:
+    """Pruebas estáticas de la migración que excluye columnas del payload de auditoría."""
+
+    ARCHIVO = "3e9a5c1d7b82_audit_excluded_columns.py"
+
+    def test_columnas_excluidas_existen_en_los_modelos(self, monkeypatch):
+        """Prueba que las columnas sembradas en audit_config existen en cada modelo."""
+        modulo, recorder = cargar_migracion(self.ARCHIVO, monkeypatch)
+        modulo.upgrade()
+        sql = "\n".join(recorder.sql)
+
+        columnas = {
+            models.Usuario: ("contraseña", "token_confirmacion", "token_reset"),
+            models.Producto: ("descripcion", "imagen_url"),
+        }
+        for model, excluidas in columnas.items():
+            for columna in excluidas:
+                assert columna in model.__table__.columns
+            lista = ", ".join(f"'{c}'" for c in excluidas)
+            assert f"('{model.__tablename__}', ARRAY[{lista}])" in sql
+
+    def test_payload_resta_columnas_excluidas(self, monkeypatch):
+        """Prueba que to_jsonb y el diff hstore restan las columnas excluidas."""
+        modulo, recorder = cargar_migracion(self.ARCHIVO, monkeypatch)
+        modulo.upgrade()
+        funcion = recorder.sql[-1]
+
+        assert "excluded_cols := audit_excluded_cols(TG_TABLE_NAME);" in funcion
+        assert "to_jsonb(n) - $5" in funcion
+        assert "to_jsonb(o) - $5" in funcion
+        assert "FROM unnest(akeys((hstore(n) - hstore(o)) - $5)) k" in funcion
+        assert funcion.count("USING ctx_user_id, ctx_user_email, ctx_ip, ctx_endpoint, excluded_cols;") == 3
+
+    def test_devuelve_filas_sin_objetos_orm(self, db_session):
+        """Prueba que los logs se devuelven como filas con las columnas del esquema, sin entrar en la sesión."""
+        from datetime import datetime
+        from app import schemas
+        from app.crud import get_audit_logs
+
+        db_session.add(models.AuditLog(
+            tabla_nombre="productos", registro_id=1, accion="UPDATE",
+            fecha_accion=datetime(2025, 1, 1), cambios={"precio": 10}
+        ))
+        db_session.commit()
+        db_session.expunge_all()
+
+        logs = get_audit_logs(db_session)
+        assert len(db_session.identity_map) == 0
+        log = schemas.AuditLog.model_validate(logs[0])
+        assert log.cambios == {"precio": 10}
+        assert log.metadatos_extra is None
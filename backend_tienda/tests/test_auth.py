@@ -4,14 +4,21 @@ Tests unitarios para el módulo de autenticación (auth.py).
 Prueba las funciones de hash de contraseñas, creación y verificación de tokens JWT.
 """
 
+import asyncio
 import pytest
 from datetime import timedelta
 from app.auth import (
     hash_password,
     verify_password,
+    hash_password_async,
+    verify_password_async,
     crear_token_de_acceso,
     verificar_token,
+    require_role,
+    require_admin,
+    verify_resource_owner,
 )
+from app.auth_cache import token_cache_key
 
 
 class TestPasswordHashing:
@@ -49,6 +56,123 @@ class TestPasswordHashing:
         hashed = hash_password(password)
         
         assert verify_password(wrong_password, hashed) is False
+    
+    def test_hash_formato_argon2id(self):
+        """Prueba que los hashes nuevos usan Argon2id con el coste configurado."""
+        from app.auth import ARGON2_MEMORY_COST, ARGON2_TIME_COST, ARGON2_PARALLELISM
+        hashed = hash_password("test_password_123")
+        
+        assert hashed.startswith(
+            f"$argon2id$v=19$m={ARGON2_MEMORY_COST},t={ARGON2_TIME_COST},p={ARGON2_PARALLELISM}$"
+        )
+    
+    def test_hash_bcrypt_necesita_rehash(self):
+        """Prueba que solo los hashes heredados o con otros parámetros se marcan para rehash."""
+        import bcrypt
+        from app.auth import password_needs_rehash
+        heredado = bcrypt.hashpw(b"test_password_123", bcrypt.gensalt(rounds=4)).decode("utf-8")
+        
+        assert password_needs_rehash(heredado) is True
+        assert password_needs_rehash(hash_password("test_password_123")) is False
+    
+    def test_verify_password_argon2_malformado(self):
+        """Prueba que un hash Argon2 corrupto se rechaza sin lanzar excepción."""
+        assert verify_password("test_password_123", "$argon2id$corrupto") is False
+    
+    def test_verify_password_hash_con_otro_coste(self):
+        """Prueba que los hashes existentes con coste 12 se siguen verificando."""
+        import bcrypt
+        hashed = bcrypt.hashpw(b"test_password_123", bcrypt.gensalt(rounds=12)).decode("utf-8")
+        
+        assert verify_password("test_password_123", hashed) is True
+    
+    def test_verify_password_variante_2y(self):
+        """Prueba que los hashes bcrypt con prefijo $2y$ (PHP/otras librerías) se verifican."""
+        import bcrypt
+        hashed = bcrypt.hashpw(b"test_password_123", bcrypt.gensalt(rounds=4)).decode("utf-8")
+        legacy = "$2y$" + hashed[4:]
+        
+        assert verify_password("test_password_123", legacy) is True
+    
+    def test_verify_password_hash_malformado(self):
+        """Prueba que un hash no bcrypt se rechaza sin lanzar excepción."""
+        assert verify_password("test_password_123", "no-es-un-hash") is False
+    
+    def test_password_larga_se_trunca_a_72_bytes(self):
+        """Prueba que contraseñas de más de 72 bytes se pueden hashear y verificar."""
+        password = "a" * 100
+        hashed = hash_password(password)
+        
+        assert verify_password(password, hashed) is True
+    
+    def test_hash_y_verify_async(self):
+        """Prueba que las versiones async (threadpool) son compatibles con las síncronas."""
+        password = "test_password_123"
+        hashed = asyncio.run(hash_password_async(password))
+        
+        assert verify_password(password, hashed) is True
+        assert asyncio.run(verify_password_async(password, hashed)) is True
+        assert asyncio.run(verify_password_async("wrong_password", hashed)) is False
+    
+    def test_hashes_simultaneos_limitados(self, monkeypatch):
+        """Prueba que no se ejecutan más hashes a la vez que PASSWORD_HASH_CONCURRENCY."""
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from app import auth
+        
+        en_curso = []
+        maximo = []
+        lock = threading.Lock()
+        
+        class HasherLento:
+            def hash(self, password):
+                with lock:
+                    en_curso.append(password)
+                    maximo.append(len(en_curso))
+                time.sleep(0.02)
+                with lock:
+                    en_curso.remove(password)
+                return "$argon2id$falso"
+        
+        monkeypatch.setattr(auth, "_password_hasher", HasherLento())
+        monkeypatch.setattr(auth, "_hash_executor", ThreadPoolExecutor(max_workers=2))
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(auth.hash_password, [f"password{i}" for i in range(8)]))
+        
+        assert max(maximo) <= 2
+    
+    def test_hashes_en_espera_no_ocupan_el_threadpool(self, monkeypatch):
+        """Prueba que los logins que esperan turno de hash no bloquean hilos del threadpool de las rutas."""
+        import time
+        import anyio
+        from concurrent.futures import ThreadPoolExecutor
+        from fastapi.concurrency import run_in_threadpool
+        from app import auth
+        
+        terminados = []
+        
+        class HasherLento:
+            def hash(self, password):
+                time.sleep(0.05)
+                terminados.append(password)
+                return "$argon2id$falso"
+        
+        monkeypatch.setattr(auth, "_password_hasher", HasherLento())
+        monkeypatch.setattr(auth, "_hash_executor", ThreadPoolExecutor(max_workers=1))
+        
+        async def escenario():
+            # Un solo hilo para rutas síncronas: con los hashes esperando en él, la ruta esperaría
+            anyio.to_thread.current_default_thread_limiter().total_tokens = 1
+            hashes = [asyncio.create_task(hash_password_async(f"password{i}")) for i in range(3)]
+            await asyncio.sleep(0)
+            completados_antes_de_la_ruta = await run_in_threadpool(lambda: len(terminados))
+            await asyncio.gather(*hashes)
+            return completados_antes_de_la_ruta
+        
+        assert asyncio.run(escenario()) < 3
+        assert len(terminados) == 3
 
 
 class TestTokenCreation:
@@ -71,6 +195,17 @@ class TestTokenCreation:
         
         assert token is not None
     
+    def test_exp_es_epoch_entero(self):
+        """Prueba que exp se guarda como segundos epoch enteros según la expiración pedida."""
+        import time
+        antes = int(time.time())
+        token = crear_token_de_acceso({"sub": "exp@example.com"}, expires_delta=timedelta(minutes=30))
+        
+        exp = verificar_token(token)["exp"]
+        
+        assert isinstance(exp, int)
+        assert antes + 30 * 60 <= exp <= int(time.time()) + 30 * 60
+    
     def test_verificar_token_valido(self):
         """Prueba que verificar_token valida correctamente un token válido."""
         data = {"sub": "test@example.com", "id_usuario": 1, "rol": "cliente"}
@@ -84,6 +219,14 @@ class TestTokenCreation:
         assert payload["rol"] == "cliente"
         assert "exp" in payload
     
+    def test_verificar_token_sin_exp(self):
+        """Prueba que un token firmado sin exp se rechaza."""
+        import jwt
+        from app import auth
+        token = jwt.encode({"sub": "sin_exp@example.com"}, auth._SIGNING_KEY, algorithm=auth.ALGORITHM)
+        
+        assert verificar_token(token) is None
+    
     def test_verificar_token_invalido(self):
         """Prueba que verificar_token rechaza un token inválido."""
         invalid_token = "invalid_token_string"
@@ -108,3 +251,68 @@ class TestTokenCreation:
         assert payload["id_usuario"] == 1
         assert payload["rol"] == "admin"
         assert payload["extra_data"] == "test"
+
+
+class TestTokenCache:
+    """Pruebas para la caché de tokens validados."""
+    
+    def test_token_valido_se_cachea(self):
+        """Prueba que un token válido queda en caché y devuelve el mismo payload."""
+        from app import auth_cache
+        data = {"sub": "cache@example.com", "id_usuario": 2, "rol": "cliente"}
+        token = crear_token_de_acceso(data)
+        
+        primero = verificar_token(token)
+        segundo = verificar_token(token)
+        
+        assert primero == segundo
+        assert token_cache_key(token) in auth_cache._token_cache
+    
+    def test_payload_cacheado_no_se_comparte(self):
+        """Prueba que modificar el payload devuelto no altera la caché."""
+        data = {"sub": "cache2@example.com", "id_usuario": 3, "rol": "cliente"}
+        token = crear_token_de_acceso(data)
+        
+        verificar_token(token)["rol"] = "admin"
+        
+        assert verificar_token(token)["rol"] == "cliente"
+    
+    def test_entrada_expirada_en_cache_no_se_usa(self):
+        """Prueba que un payload cacheado con exp vencido no se devuelve."""
+        from app import auth_cache
+        token = "token.que.no.es.valido"
+        clave = token_cache_key(token)
+        auth_cache._token_cache[clave] = {"sub": "viejo@example.com", "exp": 0}
+        
+        assert verificar_token(token) is None
+        assert clave not in auth_cache._token_cache
+    
+    def test_token_invalido_no_se_cachea(self):
+        """Prueba que los tokens inválidos no se guardan en caché."""
+        from app import auth_cache
+        token = "otro_token_invalido"
+        
+        assert verificar_token(token) is None
+        assert token_cache_key(token) not in auth_cache._token_cache
+
+
+class TestRoleCheckers:
+    """Pruebas para las dependencias de validación de rol."""
+    
+    def test_mismos_roles_comparten_dependencia(self):
+        """Prueba que el mismo conjunto de roles devuelve la misma función."""
+        assert require_role(["super_admin", "admin"]) is require_admin
+        assert require_role(["cliente"]) is not require_admin
+        assert require_admin.__name__ == "role_checker_admin_super_admin"
+    
+    def test_verify_resource_owner(self):
+        """Prueba que el dueño y los administradores acceden al recurso, y otro usuario no."""
+        from fastapi import HTTPException
+        dueño = {"id_usuario": 5, "rol": "cliente"}
+        admin = {"id_usuario": 1, "rol": "admin"}
+        
+        assert verify_resource_owner(5, current_user=dueño) is dueño
+        assert verify_resource_owner(5, current_user=admin) is admin
+        with pytest.raises(HTTPException) as exc_info:
+            verify_resource_owner(6, current_user=dueño)
+        assert exc_info.value.status_code == 403
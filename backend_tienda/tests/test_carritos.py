@@ -50,6 +50,15 @@ class TestCarritoEndpoints:
         data = response.json()
         assert isinstance(data, list)
     
+    def test_listados_limitados_a_100(self, client, token_admin_test):
+        """Prueba que los listados de carritos y sus detalles rechazan limit > 100 y skip negativo."""
+        headers = get_auth_headers(token_admin_test)
+        
+        for ruta in ["/carritos/", "/detalle_carrito/"]:
+            assert client.get(ruta, params={"limit": 101}, headers=headers).status_code == 422
+            assert client.get(ruta, params={"skip": -1}, headers=headers).status_code == 422
+            assert client.get(ruta, params={"limit": 100}, headers=headers).status_code == 200
+    
     def test_carritos_de_cliente(self, client, cliente_test, token_test):
         """Prueba obtener carritos de un cliente."""
         # Crear carrito
@@ -234,3 +243,160 @@ class TestDetalleCarritoEndpoints:
         response_data = response.json()
         assert "mensaje" in response_data or "id_detalle_carrito" in response_data
 
+
+
+class TestActualizarDetalleCarrito:
+    """Pruebas de crud.actualizar_detalle_carrito."""
+    
+    def test_un_solo_select_de_producto(self, db_session, cliente_test, producto_test, categoria_test):
+        """Prueba que cambiar producto y cantidad lee el producto nuevo una sola vez."""
+        from sqlalchemy import event
+        from app import models
+        from app.crud import crear_carrito, crear_detalle_carrito, actualizar_detalle_carrito
+        from app.schemas import CarritoCreate, DetalleCarritoCreate
+        
+        carrito = crear_carrito(db_session, CarritoCreate(id_cliente=cliente_test.id_cliente))
+        detalle = crear_detalle_carrito(db_session, DetalleCarritoCreate(
+            id_carrito=carrito.id_carrito,
+            id_producto=producto_test.id_producto,
+            cantidad=1,
+            precio_unitario=10.0,
+            subtotal=10.0
+        ))
+        otro = models.Producto(
+            id_categoria=categoria_test.id_categoria, nombre="Otro", descripcion="Otro producto",
+            cantidad=5, precio=10.0, estado="activo"
+        )
+        db_session.add(otro)
+        db_session.commit()
+        # Fuera del identity map: db.get debe leerlo de la BD exactamente una vez
+        id_otro = otro.id_producto
+        db_session.expunge(otro)
+        
+        selects = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and "FROM productos" in statement:
+                selects.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            actualizado = actualizar_detalle_carrito(db_session, detalle.id_detalle_carrito, DetalleCarritoCreate(
+                id_carrito=carrito.id_carrito,
+                id_producto=id_otro,
+                cantidad=2,
+                precio_unitario=10.0,
+                subtotal=20.0
+            ))
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        
+        assert actualizado.id_producto == id_otro
+        assert len(selects) == 1
+    
+    def test_producto_en_sesion_no_consulta(self, db_session, producto_test):
+        """Prueba que get_producto reutiliza el identity map de la sesión."""
+        from sqlalchemy import event
+        from app.crud import get_producto
+        
+        sentencias = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            sentencias.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            producto = get_producto(db_session, producto_test.id_producto)
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        
+        assert producto is producto_test
+        assert sentencias == []
+
+
+class TestActualizarCarrito:
+    """Pruebas de crud.actualizar_carrito."""
+    
+    def test_actualiza_campos(self, db_session, cliente_test):
+        """Prueba que se copian los campos del esquema al carrito."""
+        from app.crud import crear_carrito, actualizar_carrito
+        from app.schemas import CarritoCreate
+        
+        carrito = crear_carrito(db_session, CarritoCreate(id_cliente=cliente_test.id_cliente))
+        actualizado = actualizar_carrito(
+            db_session, carrito.id_carrito,
+            CarritoCreate(id_cliente=cliente_test.id_cliente, estado="completado")
+        )
+        
+        assert actualizado.id_carrito == carrito.id_carrito
+        assert actualizado.estado == "completado"
+    
+    def test_carrito_inexistente(self, db_session, cliente_test):
+        """Prueba que un carrito inexistente devuelve None."""
+        from app.crud import actualizar_carrito
+        from app.schemas import CarritoCreate
+        
+        assert actualizar_carrito(db_session, 999, CarritoCreate(id_cliente=cliente_test.id_cliente)) is None
+
+
+class TestPropietarioCarrito:
+    """Pruebas de crud.get_carrito_y_propietario."""
+    
+    def test_una_consulta_y_carrito_en_sesion(self, db_session, cliente_test):
+        """Prueba que devuelve el dueño y deja el carrito en la sesión para get_carrito."""
+        from sqlalchemy import event
+        from app.crud import crear_carrito, get_carrito, get_carrito_y_propietario
+        from app.schemas import CarritoCreate
+        
+        id_carrito = crear_carrito(db_session, CarritoCreate(id_cliente=cliente_test.id_cliente)).id_carrito
+        db_session.expunge_all()
+        
+        sentencias = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            sentencias.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            propietario = get_carrito_y_propietario(db_session, id_carrito)
+            carrito = get_carrito(db_session, id_carrito)
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        
+        assert propietario.id_usuario == cliente_test.id_usuario
+        assert carrito is propietario.Carrito
+        assert len(sentencias) == 1
+    
+    def test_carrito_inexistente(self, db_session):
+        """Prueba que un carrito inexistente devuelve None."""
+        from app.crud import get_carrito_y_propietario
+        
+        assert get_carrito_y_propietario(db_session, 999) is None
+
+
+class TestImportesDetalleCarrito:
+    """Pruebas de los importes exactos del esquema DetalleCarritoCreate."""
+    
+    def datos(self, subtotal):
+        return {"id_carrito": 1, "id_producto": 1, "cantidad": 3, "precio_unitario": 0.1, "subtotal": subtotal}
+    
+    def test_subtotal_exacto(self):
+        """Prueba que 3 × 0.10 = 0.30 se acepta sin tolerancia de punto flotante."""
+        from decimal import Decimal
+        from app.schemas import DetalleCarritoCreate
+        
+        detalle = DetalleCarritoCreate(**self.datos(0.3))
+        
+        assert detalle.subtotal == Decimal("0.30")
+        assert detalle.model_dump(mode="json")["subtotal"] == 0.3
+    
+    def test_subtotal_con_un_centavo_de_diferencia(self):
+        """Prueba que un subtotal que difiere en un centavo se rechaza."""
+        from pydantic import ValidationError
+        from app.schemas import DetalleCarritoCreate
+        
+        with pytest.raises(ValidationError):
+            DetalleCarritoCreate(**self.datos(0.31))
@@ -0,0 +1,136 @@
+"""
+Tests para el envío de correos.
+"""
+import smtplib
+
+import pytest
+
+from app import email_service
+
+
+class SMTPFalso:
+    """Servidor SMTP en memoria que registra conexiones y mensajes."""
+
+    conexiones = []
+
+    def __init__(self, host, port, timeout=None):
+        self.enviados = []
+        self.mensajes = []
+        self.desconectado = False
+        SMTPFalso.conexiones.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, usuario, contraseña):
+        pass
+
+    def send_message(self, mensaje):
+        if self.desconectado:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.enviados.append(mensaje["To"])
+        self.mensajes.append(mensaje)
+
+    def quit(self):
+        self.desconectado = True
+
+    def close(self):
+        self.desconectado = True
+
+
+class TestConexionSMTP:
+    """Pruebas de la reutilización de la conexión SMTP."""
+
+    @pytest.fixture(autouse=True)
+    def smtp_falso(self, monkeypatch):
+        """Sustituye smtplib.SMTP y configura credenciales de prueba."""
+        SMTPFalso.conexiones = []
+        monkeypatch.setattr(email_service.smtplib, "SMTP", SMTPFalso)
+        monkeypatch.setattr(email_service, "SMTP_USER", "remitente@test.com")
+        monkeypatch.setattr(email_service, "SMTP_PASSWORD", "clave")
+        email_service.cerrar_conexion_smtp()
+        yield
+        email_service.cerrar_conexion_smtp()
+
+    def test_reutiliza_la_conexion(self):
+        """Prueba que varios envíos comparten una sola conexión (un solo STARTTLS + LOGIN)."""
+        assert email_service.enviar_email("a@test.com", "Asunto", "<p>Hola</p>") is True
+        assert email_service.enviar_email("b@test.com", "Asunto", "<p>Hola</p>") is True
+
+        assert len(SMTPFalso.conexiones) == 1
+        assert SMTPFalso.conexiones[0].enviados == ["a@test.com", "b@test.com"]
+
+    def test_reconecta_si_el_servidor_cierra(self):
+        """Prueba que se reconecta cuando el servidor cerró la conexión inactiva."""
+        email_service.enviar_email("a@test.com", "Asunto", "<p>Hola</p>")
+        SMTPFalso.conexiones[0].desconectado = True
+
+        assert email_service.enviar_email("b@test.com", "Asunto", "<p>Hola</p>") is True
+        assert len(SMTPFalso.conexiones) == 2
+        assert SMTPFalso.conexiones[1].enviados == ["b@test.com"]
+
+    def test_mensaje_texto_y_html(self):
+        """Prueba que el mensaje lleva el texto plano y el HTML como alternativas."""
+        email_service.enviar_email("a@test.com", "Asunto ñ", "<p>Hola</p>", "Hola")
+
+        mensaje = SMTPFalso.conexiones[0].mensajes[0]
+        assert mensaje.get_content_type() == "multipart/alternative"
+        assert mensaje["Subject"] == "Asunto ñ"
+        assert mensaje["From"] == email_service.SMTP_REMITENTE
+        partes = [(parte.get_content_type(), parte.get_content().strip()) for parte in mensaje.iter_parts()]
+        assert partes == [("text/plain", "Hola"), ("text/html", "<p>Hola</p>")]
+
+    def test_mensaje_solo_html(self):
+        """Prueba que sin texto plano se envía solo el HTML."""
+        email_service.enviar_email("a@test.com", "Asunto", "<p>Hola</p>")
+
+        mensaje = SMTPFalso.conexiones[0].mensajes[0]
+        assert mensaje.get_content_type() == "text/html"
+
+    def test_error_de_envio_se_registra(self, monkeypatch, caplog):
+        """Prueba que un fallo de SMTP devuelve False y queda en el log con la traza."""
+        def rechazar(mensaje):
+            raise smtplib.SMTPRecipientsRefused({"a@test.com": (550, b"No existe")})
+
+        email_service.enviar_email("b@test.com", "Asunto", "<p>Hola</p>")
+        monkeypatch.setattr(SMTPFalso.conexiones[0], "send_message", rechazar)
+
+        with caplog.at_level("INFO", logger="app.email_service"):
+            assert email_service.enviar_email("a@test.com", "Asunto", "<p>Hola</p>") is False
+
+        registro = caplog.records[-1]
+        assert registro.levelname == "ERROR"
+        assert registro.getMessage() == "Error al enviar email a a@test.com"
+        assert registro.exc_info is not None
+
+
+class TestPlantillas:
+    """Pruebas del contenido de los correos."""
+
+    @pytest.fixture
+    def enviados(self, monkeypatch):
+        """Captura los cuerpos que se enviarían en lugar de enviarlos."""
+        capturados = []
+        monkeypatch.setattr(
+            email_service, "enviar_email",
+            lambda destinatario, asunto, cuerpo_html, cuerpo_texto=None: capturados.append((cuerpo_html, cuerpo_texto)) or True
+        )
+        return capturados
+
+    def test_confirmacion_incluye_nombre_y_pin(self, enviados):
+        """Prueba que el correo de confirmación contiene el nombre y el PIN en ambos formatos."""
+        email_service.enviar_email_confirmacion("a@test.com", "Ana Pérez", "012345")
+
+        cuerpo_html, cuerpo_texto = enviados[0]
+        assert "¡Bienvenido, Ana Pérez!" in cuerpo_html
+        assert '<div class="pin">012345</div>' in cuerpo_html
+        assert "PIN: 012345" in cuerpo_texto
+
+    def test_nombre_escapado_solo_en_html(self, enviados):
+        """Prueba que el nombre no puede inyectar HTML y que el texto plano no se escapa."""
+        email_service.enviar_email_recuperacion("a@test.com", "<b>Ana</b> & Co", "123456")
+
+        cuerpo_html, cuerpo_texto = enviados[0]
+        assert "&lt;b&gt;Ana&lt;/b&gt; &amp; Co" in cuerpo_html
+        assert "<b>Ana</b>" not in cuerpo_html
+        assert "Hola, <b>Ana</b> & Co" in cuerpo_texto
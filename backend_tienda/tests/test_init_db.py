@@ -0,0 +1,32 @@
+"""
+Tests para la creación de tablas de desarrollo (app.init_db).
+"""
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import StaticPool
+
+from app.init_db import crear_tablas
+
+
+def _engine_vacio():
+    return create_engine("sqlite:///:memory:", poolclass=StaticPool)
+
+
+class TestCrearTablas:
+    """Pruebas de crear_tablas."""
+
+    def test_crea_tablas_sin_alembic(self):
+        """Prueba que en una base de datos vacía se crean las tablas de los modelos."""
+        engine = _engine_vacio()
+
+        assert crear_tablas(engine) is True
+        assert "usuarios" in inspect(engine).get_table_names()
+
+    def test_no_toca_bd_gestionada_por_alembic(self):
+        """Prueba que si existe alembic_version no se crea ninguna tabla."""
+        engine = _engine_vacio()
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)"))
+
+        assert crear_tablas(engine) is False
+        assert inspect(engine).get_table_names() == ["alembic_version"]
@@ -69,6 +69,48 @@ class TestClienteEndpoints:
         assert data["id_cliente"] == cliente_test.id_cliente
 
 
+class TestValidacionCliente:
+    """Pruebas de las validaciones de crud.crear_cliente y crud.actualizar_cliente."""
+    
+    def datos(self, id_usuario):
+        from app.schemas import ClienteCreate
+        
+        return ClienteCreate(
+            id_usuario=id_usuario,
+            nombre="Ana",
+            apellido="Gómez",
+            telefono="987654321",
+            direccion="Calle Test 456"
+        )
+    
+    def test_usuario_inexistente(self, db_session):
+        """Prueba que crear un cliente para un usuario inexistente devuelve 404."""
+        from fastapi import HTTPException
+        from app.crud import crear_cliente
+        
+        with pytest.raises(HTTPException) as exc_info:
+            crear_cliente(db_session, self.datos(999))
+        assert exc_info.value.status_code == 404
+    
+    def test_usuario_con_perfil_de_cliente(self, db_session, cliente_test, usuario_test):
+        """Prueba que un usuario no puede tener dos perfiles de cliente."""
+        from fastapi import HTTPException
+        from app.crud import crear_cliente
+        
+        with pytest.raises(HTTPException) as exc_info:
+            crear_cliente(db_session, self.datos(usuario_test.id_usuario))
+        assert exc_info.value.status_code == 400
+    
+    def test_actualizar_a_usuario_inexistente(self, db_session, cliente_test):
+        """Prueba que reasignar un cliente a un usuario inexistente devuelve 404."""
+        from fastapi import HTTPException
+        from app.crud import actualizar_cliente
+        
+        with pytest.raises(HTTPException) as exc_info:
+            actualizar_cliente(db_session, cliente_test.id_cliente, self.datos(999))
+        assert exc_info.value.status_code == 404
+
+
 class TestPedidoEndpoints:
     """Pruebas para endpoints de pedidos."""
     
@@ -144,6 +186,13 @@ class TestPedidoEndpoints:
 class TestDetallePedidoEndpoints:
     """Pruebas para endpoints de detalles de pedidos."""
     
+    def test_listar_detalles_limitado_a_100(self, client, token_admin_test):
+        """Prueba que el listado de detalles de pedidos rechaza limit > 100."""
+        headers = get_auth_headers(token_admin_test)
+        
+        assert client.get("/detalle_pedidos/", params={"limit": 101}, headers=headers).status_code == 422
+        assert client.get("/detalle_pedidos/", params={"limit": 100}, headers=headers).status_code == 200
+    
     def test_crear_detalle_pedido_exitoso(self, client, cliente_test, producto_test, token_test):
         """Prueba crear detalle de pedido exitosamente."""
         # Crear pedido primero
@@ -294,3 +343,337 @@ class TestDetallePedidoEndpoints:
         assert isinstance(data, list)
         assert len(data) >= 1
 
+
+
+class TestInventarioDetallePedido:
+    """Pruebas del descuento atómico de inventario al crear detalles de pedido."""
+    
+    @pytest.fixture
+    def pedido_test(self, db_session, cliente_test):
+        """Crea un pedido pendiente de prueba."""
+        from app.crud import crear_pedido
+        from app.schemas import PedidoCreate
+        
+        return crear_pedido(
+            db_session,
+            PedidoCreate(id_cliente=cliente_test.id_cliente, direccion_envio="Calle Test 123")
+        )
+    
+    def test_producto_inactivo_no_descuenta(self, db_session, pedido_test, producto_test):
+        """Prueba que un producto inactivo se rechaza con 400 sin tocar el inventario."""
+        from fastapi import HTTPException
+        from app.crud import crear_detalle_pedido
+        from app.schemas import DetallePedidoCreate
+        
+        producto_test.estado = "inactivo"
+        db_session.commit()
+        cantidad_inicial = producto_test.cantidad
+        
+        with pytest.raises(HTTPException) as exc_info:
+            crear_detalle_pedido(
+                db_session,
+                DetallePedidoCreate(
+                    id_pedido=pedido_test.id_pedido,
+                    id_producto=producto_test.id_producto,
+                    cantidad=1,
+                    precio_unitario=10.0
+                )
+            )
+        
+        assert exc_info.value.status_code == 400
+        assert "no está disponible" in exc_info.value.detail
+        db_session.refresh(producto_test)
+        assert producto_test.cantidad == cantidad_inicial
+    
+    def test_stock_exacto_se_agota(self, db_session, pedido_test, producto_test):
+        """Prueba que se puede pedir exactamente el stock disponible y el siguiente pedido falla."""
+        from fastapi import HTTPException
+        from app.crud import crear_detalle_pedido
+        from app.schemas import DetallePedidoCreate
+        
+        def detalle(cantidad):
+            return DetallePedidoCreate(
+                id_pedido=pedido_test.id_pedido,
+                id_producto=producto_test.id_producto,
+                cantidad=cantidad,
+                precio_unitario=10.0
+            )
+        
+        crear_detalle_pedido(db_session, detalle(producto_test.cantidad))
+        db_session.refresh(producto_test)
+        assert producto_test.cantidad == 0
+        
+        with pytest.raises(HTTPException) as exc_info:
+            crear_detalle_pedido(db_session, detalle(1))
+        assert exc_info.value.status_code == 400
+        assert "Inventario insuficiente" in exc_info.value.detail
+    
+    def test_bulk_descuenta_suma_por_producto(self, db_session, pedido_test, producto_test):
+        """Prueba que el lote crea todas las líneas y descuenta la suma de cada producto."""
+        from app.crud import crear_detalles_pedido_bulk
+        from app.schemas import DetallePedidoCreate
+        
+        detalles = [
+            DetallePedidoCreate(
+                id_pedido=pedido_test.id_pedido,
+                id_producto=producto_test.id_producto,
+                cantidad=cantidad,
+                precio_unitario=10.0
+            )
+            for cantidad in (3, 2)
+        ]
+        creados = crear_detalles_pedido_bulk(db_session, detalles)
+        
+        assert [d.cantidad for d in creados] == [3, 2]
+        assert [float(d.subtotal) for d in creados] == [30.0, 20.0]
+        db_session.refresh(producto_test)
+        assert producto_test.cantidad == 45
+    
+    def test_bulk_sin_stock_no_crea_nada(self, db_session, pedido_test, producto_test):
+        """Prueba que si la suma supera el stock no se crea ningún detalle ni se descuenta inventario."""
+        from fastapi import HTTPException
+        from app import models
+        from app.crud import crear_detalles_pedido_bulk
+        from app.schemas import DetallePedidoCreate
+        
+        detalles = [
+            DetallePedidoCreate(
+                id_pedido=pedido_test.id_pedido,
+                id_producto=producto_test.id_producto,
+                cantidad=30,
+                precio_unitario=10.0
+            )
+            for _ in range(2)
+        ]
+        with pytest.raises(HTTPException) as exc_info:
+            crear_detalles_pedido_bulk(db_session, detalles)
+        
+        assert exc_info.value.status_code == 400
+        assert "Inventario insuficiente" in exc_info.value.detail
+        db_session.refresh(producto_test)
+        assert producto_test.cantidad == 50
+        assert db_session.query(models.DetallePedido).count() == 0
+    
+    def test_bulk_rechaza_pedidos_distintos(self, db_session, pedido_test, producto_test):
+        """Prueba que todos los detalles del lote deben pertenecer al mismo pedido."""
+        from fastapi import HTTPException
+        from app.crud import crear_detalles_pedido_bulk
+        from app.schemas import DetallePedidoCreate
+        
+        detalles = [
+            DetallePedidoCreate(
+                id_pedido=id_pedido,
+                id_producto=producto_test.id_producto,
+                cantidad=1,
+                precio_unitario=10.0
+            )
+            for id_pedido in (pedido_test.id_pedido, pedido_test.id_pedido + 1)
+        ]
+        with pytest.raises(HTTPException) as exc_info:
+            crear_detalles_pedido_bulk(db_session, detalles)
+        assert exc_info.value.status_code == 400
+
+
+class TestCargaListados:
+    """Pruebas de la carga de relaciones en los listados."""
+    
+    def test_get_pedidos_sin_n_mas_1(self, db_session, cliente_test):
+        """Prueba que listar y serializar pedidos usa un número fijo de consultas."""
+        from sqlalchemy import event
+        from app import schemas
+        from app.crud import crear_pedido, get_pedidos
+        from app.schemas import PedidoCreate
+        
+        for _ in range(3):
+            crear_pedido(
+                db_session,
+                PedidoCreate(id_cliente=cliente_test.id_cliente, direccion_envio="Calle Test 123")
+            )
+        db_session.expunge_all()
+        
+        consultas = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            consultas.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            pedidos = get_pedidos(db_session)
+            serializados = [schemas.Pedido.model_validate(p) for p in pedidos]
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        
+        assert len(serializados) == 3
+        assert serializados[0].cliente.usuario.correo == "test@example.com"
+        # pedidos, clientes y usuarios: una consulta por nivel
+        assert len(consultas) == 3
+
+    
+    def test_productos_de_pedido_un_join(self, db_session, cliente_test, producto_test):
+        """Prueba que los productos de un pedido se obtienen con un JOIN más la carga de categorías."""
+        from sqlalchemy import event
+        from app import models, schemas
+        from app.crud import crear_pedido, get_productos_de_pedido
+        from app.schemas import PedidoCreate
+        
+        pedido = crear_pedido(
+            db_session,
+            PedidoCreate(id_cliente=cliente_test.id_cliente, direccion_envio="Calle Test 123")
+        )
+        for cantidad in (1, 2):
+            db_session.add(models.DetallePedido(
+                id_pedido=pedido.id_pedido, id_producto=producto_test.id_producto,
+                cantidad=cantidad, precio_unitario=producto_test.precio,
+                subtotal=producto_test.precio * cantidad
+            ))
+        db_session.commit()
+        pedido_id = pedido.id_pedido
+        db_session.expunge_all()
+        
+        consultas = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            consultas.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            productos = get_productos_de_pedido(db_session, pedido_id)
+            serializados = [schemas.Producto.model_validate(p) for p in productos]
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        
+        # Un producto por detalle, como antes
+        assert [p.id_producto for p in serializados] == [producto_test.id_producto] * 2
+        # productos JOIN detalles y categorías; las columnas del detalle no se cargan
+        assert len(consultas) == 2
+        assert "detalle_pedidos.cantidad" not in consultas[0]
+
+
+class TestActualizarDetallePedido:
+    """Pruebas del ajuste de inventario en crud.actualizar_detalle_pedido."""
+    
+    @pytest.fixture
+    def detalle_test(self, db_session, cliente_test, producto_test):
+        """Crea un pedido con un detalle de 2 unidades."""
+        from app.crud import crear_pedido, crear_detalle_pedido
+        from app.schemas import PedidoCreate, DetallePedidoCreate
+        
+        pedido = crear_pedido(
+            db_session,
+            PedidoCreate(id_cliente=cliente_test.id_cliente, direccion_envio="Calle Test 123")
+        )
+        return crear_detalle_pedido(db_session, DetallePedidoCreate(
+            id_pedido=pedido.id_pedido, id_producto=producto_test.id_producto,
+            cantidad=2, precio_unitario=10.0
+        ))
+    
+    def datos(self, detalle, cantidad):
+        from app.schemas import DetallePedidoCreate
+        
+        return DetallePedidoCreate(
+            id_pedido=detalle.id_pedido, id_producto=detalle.id_producto,
+            cantidad=cantidad, precio_unitario=10.0
+        )
+    
+    def test_descuenta_solo_la_diferencia(self, db_session, detalle_test, producto_test):
+        """Prueba que subir la cantidad descuenta solo las unidades añadidas."""
+        from app.crud import actualizar_detalle_pedido
+        
+        stock = producto_test.cantidad
+        actualizado = actualizar_detalle_pedido(db_session, detalle_test.id_detalle, self.datos(detalle_test, 5))
+        db_session.refresh(producto_test)
+        
+        assert actualizado.cantidad == 5
+        assert producto_test.cantidad == stock - 3
+    
+    def test_inventario_insuficiente_no_modifica_nada(self, db_session, detalle_test, producto_test):
+        """Prueba que un rechazo por inventario deja el detalle y el stock como estaban."""
+        from fastapi import HTTPException
+        from app.crud import actualizar_detalle_pedido
+        
+        stock = producto_test.cantidad
+        with pytest.raises(HTTPException) as exc_info:
+            actualizar_detalle_pedido(
+                db_session, detalle_test.id_detalle, self.datos(detalle_test, stock + 3)
+            )
+        db_session.refresh(producto_test)
+        db_session.refresh(detalle_test)
+        
+        assert exc_info.value.status_code == 400
+        assert producto_test.cantidad == stock
+        assert detalle_test.cantidad == 2
+
+
+class TestFechaPedido:
+    """Pruebas de la fecha de alta asignada por la base de datos."""
+    
+    def test_fecha_pedido_en_utc(self, db_session, cliente_test):
+        """Prueba que crear_pedido recibe la fecha UTC del servidor sin enviarla en el INSERT."""
+        from datetime import datetime
+        from app.crud import crear_pedido
+        from app.schemas import PedidoCreate
+        
+        pedido = crear_pedido(
+            db_session,
+            PedidoCreate(id_cliente=cliente_test.id_cliente, direccion_envio="Calle Test 123")
+        )
+        
+        assert pedido.fecha_pedido is not None
+        assert abs((datetime.utcnow() - pedido.fecha_pedido).total_seconds()) < 60
+
+
+class TestActualizarPedido:
+    """Pruebas de crud.actualizar_pedido (UPDATE ... RETURNING condicionado)."""
+    
+    @pytest.fixture
+    def pedido_test(self, db_session, cliente_test):
+        """Crea un pedido pendiente de prueba."""
+        from app.crud import crear_pedido
+        from app.schemas import PedidoCreate
+        
+        return crear_pedido(
+            db_session,
+            PedidoCreate(id_cliente=cliente_test.id_cliente, direccion_envio="Calle Test 123")
+        )
+    
+    def datos(self, id_cliente, estado="pendiente"):
+        from app.schemas import PedidoCreate
+        
+        return PedidoCreate(id_cliente=id_cliente, estado=estado, direccion_envio="Avenida Nueva 456")
+    
+    def test_actualiza_con_una_sentencia(self, db_session, pedido_test, cliente_test):
+        """Prueba que una actualización válida usa una sola sentencia."""
+        from sqlalchemy import event
+        from app.crud import actualizar_pedido
+        
+        sentencias = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            sentencias.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            actualizado = actualizar_pedido(db_session, pedido_test.id_pedido, self.datos(cliente_test.id_cliente))
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        
+        assert actualizado.direccion_envio == "Avenida Nueva 456"
+        assert len(sentencias) == 1
+    
+    def test_cliente_inexistente(self, db_session, pedido_test):
+        """Prueba que asignar un cliente inexistente devuelve 404."""
+        from fastapi import HTTPException
+        from app.crud import actualizar_pedido
+        
+        with pytest.raises(HTTPException) as exc_info:
+            actualizar_pedido(db_session, pedido_test.id_pedido, self.datos(999))
+        assert exc_info.value.status_code == 404
+    
+    def test_pedido_inexistente(self, db_session, cliente_test):
+        """Prueba que un pedido inexistente devuelve None."""
+        from app.crud import actualizar_pedido
+        
+        assert actualizar_pedido(db_session, 999, self.datos(cliente_test.id_cliente)) is None
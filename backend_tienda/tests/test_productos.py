@@ -45,6 +45,31 @@ class TestCategoriaEndpoints:
         assert isinstance(data, list)
         assert len(data) >= 1
 
+    
+    def test_productos_de_categoria_paginados(self, client, db_session, categoria_test):
+        """Prueba que los productos de una categoría se paginan con limit y after_id."""
+        from app.crud import crear_producto
+        from app.schemas import ProductoCreate
+        
+        ids = [
+            crear_producto(db_session, ProductoCreate(
+                id_categoria=categoria_test.id_categoria, nombre=f"Producto {i}",
+                descripcion="Prueba", cantidad=1, precio=10.0, estado="activo"
+            )).id_producto
+            for i in range(3)
+        ]
+        db_session.commit()
+        
+        primera = client.get(f"/categorias/{categoria_test.id_categoria}/productos", params={"limit": 2})
+        siguiente = client.get(
+            f"/categorias/{categoria_test.id_categoria}/productos",
+            params={"limit": 2, "after_id": ids[1]}
+        )
+        
+        assert [p["id_producto"] for p in primera.json()] == ids[:2]
+        assert [p["id_producto"] for p in siguiente.json()] == ids[2:]
+        assert client.get(f"/categorias/{categoria_test.id_categoria}/productos", params={"limit": 101}).status_code == 422
+
 
 class TestProductoEndpoints:
     """Pruebas para endpoints de productos."""
@@ -151,3 +176,157 @@ class TestProductoEndpoints:
         
         assert response.status_code == 404
 
+
+
+class TestSesionPorRequest:
+    """Pruebas para la sesión de BD que abre get_db y cierra el middleware."""
+    
+    @pytest.fixture
+    def sesiones(self, client, monkeypatch):
+        """Usa get_db real (sin override) con sesiones de prueba que registran su cierre."""
+        from app import main
+        from app.main import app, get_db
+        from tests.conftest import TestingSessionLocal
+        
+        creadas = []
+        
+        def fabrica():
+            sesion = TestingSessionLocal()
+            sesion.cerrada = False
+            sesion.commits = 0
+            cerrar = sesion.close
+            confirmar = sesion.commit
+            
+            def close():
+                sesion.cerrada = True
+                cerrar()
+            
+            def commit():
+                sesion.commits += 1
+                confirmar()
+            
+            sesion.close = close
+            sesion.commit = commit
+            creadas.append(sesion)
+            return sesion
+        
+        monkeypatch.setattr(main, "SessionLocal", fabrica)
+        app.dependency_overrides.pop(get_db, None)
+        return creadas
+    
+    def test_una_sesion_por_request_y_se_cierra(self, client, sesiones, categoria_test):
+        """Prueba que una request con BD abre una sola sesión y la cierra al terminar."""
+        response = client.get("/categorias/")
+        
+        assert response.status_code == 200
+        assert len(sesiones) == 1
+        assert sesiones[0].cerrada
+    
+    def test_request_sin_bd_no_abre_sesion(self, client, sesiones):
+        """Prueba que un endpoint sin Depends(get_db) no crea sesión."""
+        response = client.get("/health")
+        
+        assert response.status_code == 200
+        assert sesiones == []
+    
+    def test_commit_unico_al_terminar(self, client, sesiones, categoria_test):
+        """Prueba que el middleware confirma la sesión una vez si la respuesta es correcta."""
+        response = client.get(f"/categorias/{categoria_test.id_categoria}")
+        
+        assert response.status_code == 200
+        assert sesiones[0].commits == 1
+    
+    def test_respuesta_de_error_no_confirma(self, client, sesiones):
+        """Prueba que una respuesta 4xx no confirma la transacción de la request."""
+        response = client.get("/categorias/9999")
+        
+        assert response.status_code == 404
+        assert sesiones[0].commits == 0
+        assert sesiones[0].cerrada
+
+
+class TestCacheCategorias:
+    """Pruebas de la caché de categorías usada al validar productos."""
+    
+    def producto(self, categoria_id):
+        from app.schemas import ProductoCreate
+        
+        return ProductoCreate(
+            id_categoria=categoria_id,
+            nombre="Producto Cache",
+            descripcion="Test",
+            cantidad=1,
+            precio=10.0
+        )
+    
+    def test_segunda_validacion_no_consulta_categoria(self, db_session, categoria_test):
+        """Prueba que crear dos productos en la misma categoría la lee de la BD una sola vez."""
+        from sqlalchemy import event
+        from app.crud import crear_producto
+        
+        consultas = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and "FROM categorias" in statement:
+                consultas.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            crear_producto(db_session, self.producto(categoria_test.id_categoria))
+            crear_producto(db_session, self.producto(categoria_test.id_categoria))
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        
+        assert len(consultas) == 1
+    
+    def test_actualizar_categoria_invalida_cache(self, db_session, categoria_test):
+        """Prueba que desactivar la categoría se aplica al siguiente producto."""
+        from fastapi import HTTPException
+        from app.crud import crear_producto, actualizar_categoria
+        from app.schemas import CategoriaCreate
+        
+        crear_producto(db_session, self.producto(categoria_test.id_categoria))
+        actualizar_categoria(db_session, categoria_test.id_categoria, CategoriaCreate(
+            nombre=categoria_test.nombre,
+            descripcion_corta=categoria_test.descripcion_corta,
+            descripcion_larga=categoria_test.descripcion_larga,
+            estado="inactivo"
+        ))
+        
+        with pytest.raises(HTTPException) as exc_info:
+            crear_producto(db_session, self.producto(categoria_test.id_categoria))
+        assert exc_info.value.status_code == 400
+
+
+class TestPaginacionCursor:
+    """Pruebas de la paginación por cursor (after_id)."""
+    
+    def test_after_id_devuelve_la_pagina_siguiente(self, db_session):
+        """Prueba que after_id devuelve los registros siguientes ordenados por ID."""
+        from app.crud import crear_categoria, get_categorias
+        from app.schemas import CategoriaCreate
+        
+        ids = [
+            crear_categoria(db_session, CategoriaCreate(
+                nombre=f"Categoría {i}",
+                descripcion_corta="Test",
+                descripcion_larga="Test",
+                estado="activo"
+            )).id_categoria
+            for i in range(5)
+        ]
+        
+        primera = get_categorias(db_session, limit=2, after_id=0)
+        segunda = get_categorias(db_session, limit=2, after_id=primera[-1].id_categoria)
+        
+        assert [c.id_categoria for c in primera] == ids[:2]
+        assert [c.id_categoria for c in segunda] == ids[2:4]
+    
+    def test_endpoint_acepta_after_id(self, client, categoria_test):
+        """Prueba que el listado público de categorías acepta after_id."""
+        response = client.get("/categorias/", params={"after_id": categoria_test.id_categoria})
+        
+        assert response.status_code == 200
+        assert response.json() == []
+
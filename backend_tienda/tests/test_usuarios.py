@@ -62,6 +62,63 @@ class TestLogin:
         )
         
         assert response.status_code == 422
+    
+    def test_login_datos_invalidos(self, client):
+        """Prueba que el esquema de login rechaza contraseña vacía y correo mal formado."""
+        for datos, campo in (
+            ({"correo": "test@example.com", "contraseña": ""}, "contraseña"),
+            ({"correo": "no-es-un-correo", "contraseña": "password123"}, "correo"),
+        ):
+            response = client.post("/login", json=datos)
+            
+            assert response.status_code == 422
+            assert [error["field"] for error in response.json()["errors"]] == [campo]
+    
+    def test_login_migra_hash_bcrypt(self, client, db_session, usuario_test):
+        """Prueba que un login correcto con hash bcrypt heredado lo reemplaza por Argon2id."""
+        import bcrypt
+        from app.auth import verify_password
+        
+        usuario_test.contraseña = bcrypt.hashpw(b"password123", bcrypt.gensalt(rounds=4)).decode("utf-8")
+        usuario_test.email_verificado = "S"
+        db_session.commit()
+        
+        response = client.post(
+            "/login",
+            json={"correo": usuario_test.correo, "contraseña": "password123"}
+        )
+        db_session.refresh(usuario_test)
+        
+        assert response.status_code == 200
+        assert usuario_test.contraseña.startswith("$argon2id$")
+        assert verify_password("password123", usuario_test.contraseña) is True
+
+
+class TestCors:
+    """Pruebas de las cabeceras CORS."""
+    
+    def test_error_de_validacion_con_origen_permitido(self, client):
+        """Prueba que las respuestas de error llevan CORS solo para los orígenes configurados."""
+        permitido = client.post("/login", json={}, headers={"Origin": "http://test.local"})
+        ajeno = client.post("/login", json={}, headers={"Origin": "http://otro.example"})
+        
+        assert permitido.status_code == 422
+        assert permitido.headers["access-control-allow-origin"] == "http://test.local"
+        assert permitido.headers["access-control-allow-methods"] == "GET, POST, PUT, DELETE"
+        assert "origin" in permitido.headers["vary"].lower()
+        assert "access-control-allow-origin" not in ajeno.headers
+    
+    def test_preflight_metodos_y_cabeceras(self, client):
+        """Prueba que el preflight acepta los métodos y cabeceras de la API y rechaza otros."""
+        base = {"Origin": "http://test.local", "Access-Control-Request-Method": "PUT"}
+        
+        valido = client.options("/usuarios/1", headers={**base, "Access-Control-Request-Headers": "authorization, content-type"})
+        metodo = client.options("/usuarios/1", headers={**base, "Access-Control-Request-Method": "PATCH"})
+        cabecera = client.options("/usuarios/1", headers={**base, "Access-Control-Request-Headers": "x-desconocida"})
+        
+        assert valido.status_code == 200
+        assert metodo.status_code == 400
+        assert cabecera.status_code == 400
 
 
 class TestUsuarioEndpoints:
@@ -183,3 +240,294 @@ class TestUsuarioEndpoints:
         
         assert response.status_code == 401
 
+    
+    def test_get_usuarios_me_reutiliza_token_del_middleware(self, client, monkeypatch):
+        """Prueba que get_current_user usa el payload verificado por el middleware."""
+        from app import auth
+        token = auth.crear_token_de_acceso({"sub": "me@example.com", "id_usuario": 7, "rol": "cliente"})
+        
+        def no_llamar(_token):
+            raise AssertionError("el token ya fue verificado en el middleware")
+        
+        monkeypatch.setattr(auth, "verificar_token", no_llamar)
+        response = client.get("/usuarios/me", headers=get_auth_headers(token))
+        
+        assert response.status_code == 200
+        assert response.json()["id_usuario"] == 7
+
+
+class TestCrearUsuarioHash:
+    """Pruebas del hash de contraseña al crear usuarios."""
+    
+    def test_usa_hash_precalculado(self, db_session, monkeypatch):
+        """Prueba que crud.crear_usuario no vuelve a calcular un hash recibido."""
+        from app import crud
+        from app.auth import hash_password
+        from app.schemas import UsuarioCreate
+        
+        contraseña_hash = hash_password("password123")
+        
+        def no_llamar(password):
+            raise AssertionError("hash_password no debe llamarse")
+        
+        monkeypatch.setattr(crud, "hash_password", no_llamar)
+        usuario = crud.crear_usuario(
+            db_session,
+            UsuarioCreate(correo="hash@example.com", contraseña="password123", rol="cliente"),
+            contraseña_hash=contraseña_hash
+        )
+        
+        assert usuario.contraseña == contraseña_hash
+    
+    def test_correo_duplicado_devuelve_none(self, db_session, usuario_test):
+        """Prueba que el INSERT con correo repetido no crea fila y devuelve None."""
+        from app import crud
+        from app.schemas import UsuarioCreate
+        
+        usuario = crud.crear_usuario(
+            db_session,
+            UsuarioCreate(correo=usuario_test.correo, contraseña="password123", rol="cliente"),
+            contraseña_hash="hash"
+        )
+        
+        assert usuario is None
+
+
+class TestGenerarPin:
+    """Pruebas de la generación de PINs de confirmación y recuperación."""
+    
+    def test_seis_digitos_con_ceros_a_la_izquierda(self, monkeypatch):
+        """Prueba que el PIN siempre tiene 6 dígitos, incluso para valores pequeños."""
+        from app import crud
+        
+        monkeypatch.setattr(crud.secrets, "randbelow", lambda n: 42)
+        
+        assert crud._generar_pin() == "000042"
+    
+    def test_formato(self):
+        """Prueba que los PINs generados son cadenas de 6 dígitos."""
+        from app.crud import _generar_pin
+        
+        pines = {_generar_pin() for _ in range(50)}
+        
+        assert all(len(pin) == 6 and pin.isdigit() for pin in pines)
+        assert len(pines) > 1
+
+
+class TestConfirmarCuenta:
+    """Pruebas de la confirmación de cuenta con PIN."""
+    
+    @pytest.fixture
+    def usuario_sin_confirmar(self, db_session, usuario_test):
+        """Deja al usuario de prueba sin confirmar y con un PIN vigente."""
+        from datetime import datetime, timedelta
+        
+        usuario_test.email_verificado = "N"
+        usuario_test.token_confirmacion = "654321"
+        usuario_test.token_confirmacion_expira = datetime.utcnow() + timedelta(minutes=15)
+        db_session.commit()
+        return usuario_test
+    
+    def _contar_selects(self, db_session, funcion):
+        """Ejecuta `funcion` y devuelve los SELECT emitidos sobre usuarios."""
+        from sqlalchemy import event
+        
+        selects = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and "FROM usuarios" in statement:
+                selects.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            funcion()
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        return selects
+    
+    def test_reintento_no_consulta_la_bd(self, db_session, usuario_sin_confirmar):
+        """Prueba que repetir la confirmación ya confirmada responde sin consultar la BD."""
+        from fastapi import HTTPException
+        from app.crud import confirmar_cuenta
+        
+        correo = usuario_sin_confirmar.correo
+        confirmar_cuenta(db_session, correo, "654321")
+        db_session.commit()
+        
+        def reintentar():
+            with pytest.raises(HTTPException) as exc:
+                confirmar_cuenta(db_session, correo, "654321")
+            assert exc.value.status_code == 400
+            assert exc.value.detail == "La cuenta ya está confirmada"
+        
+        assert self._contar_selects(db_session, reintentar) == []
+    
+    def test_sin_commit_no_se_cachea(self, db_session, usuario_sin_confirmar):
+        """Prueba que una confirmación revertida no deja el correo marcado como confirmado."""
+        from app.crud import confirmar_cuenta
+        
+        correo = usuario_sin_confirmar.correo
+        confirmar_cuenta(db_session, correo, "654321")
+        db_session.rollback()
+        
+        usuario = confirmar_cuenta(db_session, correo, "654321")
+        assert usuario.email_verificado == "S"
+    
+    def test_eliminar_usuario_invalida_la_cache(self, db_session, usuario_sin_confirmar):
+        """Prueba que tras eliminar al usuario el correo vuelve a consultarse en la BD."""
+        from fastapi import HTTPException
+        from app.crud import confirmar_cuenta, eliminar_usuario
+        
+        correo = usuario_sin_confirmar.correo
+        confirmar_cuenta(db_session, correo, "654321")
+        db_session.commit()
+        eliminar_usuario(db_session, usuario_sin_confirmar.id_usuario)
+        db_session.commit()
+        
+        with pytest.raises(HTTPException) as exc:
+            confirmar_cuenta(db_session, correo, "654321")
+        assert exc.value.status_code == 404
+
+    
+    def test_regenerar_pin_sin_select(self, db_session, usuario_sin_confirmar, monkeypatch):
+        """Prueba que regenerar el PIN es un solo UPDATE ... RETURNING, sin SELECT previo."""
+        from app import crud
+        from app.crud import regenerar_token_confirmacion
+        
+        monkeypatch.setattr(crud, "_generar_pin", lambda: "111111")
+        correo = usuario_sin_confirmar.correo
+        resultado = {}
+        selects = self._contar_selects(
+            db_session, lambda: resultado.update(usuario=regenerar_token_confirmacion(db_session, correo))
+        )
+        
+        assert selects == []
+        assert resultado["usuario"].token_confirmacion == "111111"
+    
+    def test_regenerar_pin_cuenta_confirmada_o_inexistente(self, db_session, usuario_sin_confirmar):
+        """Prueba que no se regenera el PIN de una cuenta confirmada ni de un correo desconocido."""
+        from fastapi import HTTPException
+        from app.crud import regenerar_token_confirmacion
+        
+        usuario_sin_confirmar.email_verificado = "S"
+        db_session.commit()
+        
+        with pytest.raises(HTTPException) as exc:
+            regenerar_token_confirmacion(db_session, usuario_sin_confirmar.correo)
+        assert exc.value.status_code == 400
+        
+        with pytest.raises(HTTPException) as exc:
+            regenerar_token_confirmacion(db_session, "nadie@example.com")
+        assert exc.value.status_code == 404
+
+
+class TestPinRecuperacion:
+    """Pruebas de la validación del PIN de recuperación."""
+    
+    @pytest.fixture
+    def usuario_con_pin(self, db_session, usuario_test):
+        """Asigna un PIN de recuperación vigente al usuario de prueba."""
+        from datetime import datetime, timedelta
+        
+        usuario_test.token_reset = "123456"
+        usuario_test.token_reset_expira = datetime.utcnow() + timedelta(minutes=15)
+        db_session.commit()
+        return usuario_test
+    
+    def test_pin_correcto(self, db_session, usuario_con_pin):
+        """Prueba que el PIN vigente se acepta."""
+        from app.crud import validar_pin_recuperacion
+        
+        assert validar_pin_recuperacion(db_session, usuario_con_pin.correo, "123456") is True
+    
+    def test_pin_incorrecto_o_no_ascii(self, db_session, usuario_con_pin):
+        """Prueba que un PIN distinto (incluso con caracteres no ASCII) se rechaza sin excepción."""
+        from app.crud import validar_pin_recuperacion
+        
+        assert validar_pin_recuperacion(db_session, usuario_con_pin.correo, "123457") is False
+        assert validar_pin_recuperacion(db_session, usuario_con_pin.correo, "12345ñ") is False
+    
+    def test_pin_expirado(self, db_session, usuario_con_pin):
+        """Prueba que un PIN expirado se rechaza."""
+        from datetime import datetime, timedelta
+        from app.crud import validar_pin_recuperacion
+        
+        usuario_con_pin.token_reset_expira = datetime.utcnow() - timedelta(minutes=1)
+        db_session.commit()
+        
+        assert validar_pin_recuperacion(db_session, usuario_con_pin.correo, "123456") is False
+    
+    def test_pin_expirado_no_se_compara(self, db_session, usuario_con_pin, monkeypatch):
+        """Prueba que un PIN expirado se rechaza sin llegar a la comparación."""
+        from datetime import datetime, timedelta
+        from app import crud
+        
+        comparaciones = []
+        monkeypatch.setattr(crud, "_pin_coincide", lambda esperado, pin: comparaciones.append(pin) or True)
+        usuario_con_pin.token_reset_expira = datetime.utcnow() - timedelta(minutes=1)
+        db_session.commit()
+        
+        assert crud.validar_pin_recuperacion(db_session, usuario_con_pin.correo, "123456") is False
+        assert comparaciones == []
+    
+    def test_cambiar_contraseña_invalida_el_pin(self, db_session, usuario_con_pin):
+        """Prueba que el PIN deja de valer después de cambiar la contraseña."""
+        from app.auth import verify_password
+        from app.crud import cambiar_contraseña_con_pin, validar_pin_recuperacion
+        
+        usuario = cambiar_contraseña_con_pin(db_session, usuario_con_pin.correo, "123456", "nueva_password1")
+        
+        assert verify_password("nueva_password1", usuario.contraseña) is True
+        assert validar_pin_recuperacion(db_session, usuario_con_pin.correo, "123456") is False
+    
+    def test_cambiar_contraseña_sin_select_adicional(self, db_session, usuario_con_pin):
+        """Prueba que cambiar la contraseña con PIN solo consulta al usuario una vez (sin refresh)."""
+        from sqlalchemy import event
+        from app.crud import cambiar_contraseña_con_pin
+        
+        correo = usuario_con_pin.correo
+        db_session.expire_all()
+        selects = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and "FROM usuarios" in statement:
+                selects.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            usuario = cambiar_contraseña_con_pin(db_session, correo, "123456", "nueva_password1")
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        
+        assert len(selects) == 1
+        assert usuario.token_reset is None
+    
+    def test_solicitar_recuperacion_una_consulta_de_usuario(self, client, db_session, usuario_test, monkeypatch):
+        """Prueba que solicitar la recuperación busca al usuario una sola vez y envía el PIN guardado."""
+        from sqlalchemy import event
+        from app import email_service
+        
+        enviados = []
+        monkeypatch.setattr(
+            email_service, "enviar_email_recuperacion",
+            lambda destinatario, nombre, pin: enviados.append(pin)
+        )
+        selects = []
+        
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and "FROM usuarios" in statement:
+                selects.append(statement)
+        
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            response = client.post("/usuarios/solicitar-recuperacion", json={"correo": usuario_test.correo})
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+        db_session.refresh(usuario_test)
+        
+        assert response.status_code == 200
+        assert enviados == [usuario_test.token_reset]
+        assert len(selects) == 1